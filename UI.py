@@ -1,6 +1,101 @@
+import logging
 import streamlit as st
 import pandas as pd
+from datetime import date, datetime, time, timedelta
+import config
+import database
+import metrics
+import queries
+import maintenance_schedule
+from concurrency import StaleVersionError
+from devices import Device
 from users import User
+from reservations import Reservation
+from maintenance_events import MaintenanceEvent
+
+PAGE_SIZES = [25, 50, 100]
+SCHEDULE_ROWS = 100
+
+logging.basicConfig(level=config.LOG_LEVEL)
+
+
+# The database stays open across reruns and sessions of this process
+@st.cache_resource
+def get_database():
+    return database.get_database()
+
+
+# One metrics endpoint per process, not one per rerun
+@st.cache_resource
+def start_metrics_server():
+    return metrics.serve(config.METRICS_PORT) if config.METRICS_PORT else None
+
+
+# Pages are only read again if the data version changed since the last rerun
+@st.cache_data(max_entries=32)
+def load_device_page(version, offset, limit, status, verantwortlich, name_prefix) -> tuple:
+    is_active = {"Alle": None, "Aktiv": True, "Inaktiv": False}[status]
+    devices, total = Device.find_page(offset, limit, is_active=is_active,
+                                      managed_by_user_id=verantwortlich or None, name_prefix=name_prefix or None)
+    rows = [{"Name": d.device_name, "Verantwortlich": d.managed_by_user_id,
+             "Status": "Aktiv" if d.is_active else "Inaktiv"} for d in devices]
+    return rows, total
+
+
+@st.cache_data(max_entries=32)
+def load_user_page(version, offset, limit, name_prefix) -> tuple:
+    users, total = User.find_page(offset, limit, name_prefix=name_prefix or None)
+    return [{"Name": u.name, "Email": u.id} for u in users], total
+
+
+@st.cache_data(max_entries=4)
+def load_reservations(version) -> list:
+    return [{"Gerät": r.device_name, "Reserviert von": r.user_id, "Start": r.start_date.strftime("%d.%m.%Y %H:%M"),
+             "Ende": r.end_date.strftime("%d.%m.%Y %H:%M"), "Grund": r.reason}
+            for r in sorted(Reservation.find_all(), key=lambda r: r.start_date)]
+
+
+@st.cache_data(max_entries=4)
+def load_cost_history(version, scope) -> pd.DataFrame:
+    # One stored total per month/quarter/user, nothing is added up here
+    return pd.DataFrame([{"Zeitraum": key, "Wartungen": totals["count"], "Kosten (€)": round(totals["cost"], 2)}
+                         for key, totals in MaintenanceEvent.totals_by(scope).items()])
+
+
+# The schedule depends on the day as well, "today" is part of the cache key
+@st.cache_data(max_entries=4)
+def load_schedule(version, today) -> pd.DataFrame:
+    return maintenance_schedule.fleet_schedule()
+
+
+def schedule_rows(schedule: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Gerät": schedule["device_name"],
+        "Verantwortlich": schedule["managed_by_user_id"],
+        "Nächste Wartung": schedule["next_due"].dt.strftime("%d.%m.%Y"),
+        "Tage bis Wartung": schedule["days_remaining"].astype("Int64"),
+    })
+
+
+def page_selection(key: str) -> tuple:
+    """Seitengröße und Seite auswählen, gibt (offset, limit) zurück"""
+    col1, col2 = st.columns(2)
+    with col1:
+        limit = st.selectbox("Einträge pro Seite", PAGE_SIZES, key=f"{key}_page_size")
+    with col2:
+        page = st.number_input("Seite", min_value=1, value=1, step=1, key=f"{key}_page")
+    return (page - 1) * limit, limit
+
+
+def page_caption(offset: int, limit: int, total: int) -> str:
+    if not total:
+        return "Keine Einträge gefunden"
+    if offset >= total:
+        return f"Seite leer, es gibt nur {total} Einträge"
+    return f"Einträge {offset + 1}–{min(offset + limit, total)} von {total}"
+
+
+start_metrics_server()
 
 # Eine Überschrift der ersten Ebene
 st.write("# Gerätemanagement")
@@ -10,24 +105,25 @@ tab1, tab2, tab3, tab4 = st.tabs(["Geräte", "Nutzerverwaltung", "Reservierungen
 with tab1:
     st.header("Geräteübersicht")
     
-    # Mock-Daten für Geräte
-    from datetime import datetime, timedelta
-    
-    devices = [
-        {"Name": "Laser-Cutter", "Typ": "Laser", "Verantwortlich": "Max Müller", "Status": "Verfügbar", 
-         "Nächste_Wartung": "2025-12-25", "Wartung_bis": None, "Tage_bis_Wartung": 10},
-        {"Name": "3D-Drucker", "Typ": "3D-Druck", "Verantwortlich": "Anna Schmidt", "Status": "In Wartung", 
-         "Nächste_Wartung": "2025-12-15", "Wartung_bis": "2025-12-18", "Tage_bis_Wartung": 0},
-        {"Name": "CNC-Fräse", "Typ": "Fräse", "Verantwortlich": "Tom Weber", "Status": "Reserviert", 
-         "Nächste_Wartung": "2026-01-05", "Wartung_bis": None, "Tage_bis_Wartung": 21},
-        {"Name": "Oszilloskop", "Typ": "Messinstrument", "Verantwortlich": "Lisa Klein", "Status": "Verfügbar", 
-         "Nächste_Wartung": "2025-12-20", "Wartung_bis": None, "Tage_bis_Wartung": 5},
-    ]
+    # Filter werden in der Datenbank ausgewertet, geladen wird nur die sichtbare Seite
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        filter_status = st.selectbox("Status", ["Alle", "Aktiv", "Inaktiv"], key="device_filter_status")
+    with col2:
+        filter_verantwortlich = st.text_input("Verantwortlich", key="device_filter_user")
+    with col3:
+        filter_name = st.text_input("Name beginnt mit", key="device_filter_name")
     
     st.subheader("Alle Geräte")
     
+    offset, limit = page_selection("device")
+    devices_page, devices_total = load_device_page(
+        get_database().storage.version(), offset, limit, filter_status, filter_verantwortlich, filter_name
+    )
+    st.caption(page_caption(offset, limit, devices_total))
+    
     # Geräte als Tabelle anzeigen
-    df_devices = pd.DataFrame(devices)
+    df_devices = pd.DataFrame(devices_page)
     
     event_devices = st.dataframe(
         df_devices,
@@ -37,27 +133,25 @@ with tab1:
         key="device_table"
     )
     
-    # Wenn eine Zeile ausgewählt wurde
-    if event_devices.selection.rows:
+    # Wenn eine Zeile ausgewählt wurde, erst dann das Gerät vollständig laden
+    if event_devices.selection.rows and event_devices.selection.rows[0] < len(devices_page):
         selected_idx = event_devices.selection.rows[0]
-        selected_device = devices[selected_idx]
-        
+        selected_device = Device.find_by_attribute("device_name", devices_page[selected_idx]["Name"])
+    else:
+        selected_device = None
+    
+    if selected_device:
         st.divider()
-        st.subheader(f"Gerät bearbeiten: {selected_device['Name']}")
+        st.subheader(f"Gerät bearbeiten: {selected_device.device_name}")
         
         with st.form("edit_device"):
-            edit_name = st.text_input("Name", value=selected_device["Name"])
-            edit_typ = st.text_input("Typ", value=selected_device["Typ"])
-            edit_verantwortlich = st.text_input("Verantwortlich", value=selected_device["Verantwortlich"])
-            edit_status = st.selectbox("Status", ["Verfügbar", "In Wartung", "Reserviert", "Defekt"], 
-                                       index=["Verfügbar", "In Wartung", "Reserviert", "Defekt"].index(selected_device["Status"]))
+            edit_verantwortlich = st.text_input("Verantwortlich", value=selected_device.managed_by_user_id)
+            edit_aktiv = st.checkbox("Aktiv", value=selected_device.is_active)
             
             # Wartungsinformationen
             st.write("**Wartungsinformationen**")
-            if selected_device["Status"] == "In Wartung" and selected_device["Wartung_bis"]:
-                st.info(f"In Wartung bis: {selected_device['Wartung_bis']}")
-            else:
-                st.info(f"Nächste Wartung in {selected_device['Tage_bis_Wartung']} Tagen ({selected_device['Nächste_Wartung']})")
+            st.info(f"Nächste Wartung in {selected_device.get_days_until_maintenance()} Tagen "
+                    f"({selected_device.next_maintenance.strftime('%d.%m.%Y')})")
             
             col1, col2 = st.columns(2)
             with col1:
@@ -65,10 +159,28 @@ with tab1:
             with col2:
                 deleted = st.form_submit_button("Gerät löschen", type="secondary")
             
+            # Beim Speichern zählt der Stand, mit dem das Formular angezeigt wurde
+            version_key = f"device_version_{selected_device.device_name}"
+            loaded_version = selected_device.version
+            
             if submitted:
-                st.success(f"Gerät {edit_name} wurde aktualisiert!")
+                selected_device.set_managed_by_user_id(edit_verantwortlich)
+                selected_device.is_active = edit_aktiv
+                selected_device.version = st.session_state.get(version_key, loaded_version)
+                try:
+                    selected_device.store_data()
+                except StaleVersionError:
+                    st.error(f"Gerät {selected_device.device_name} wurde inzwischen von jemand anderem geändert. "
+                             "Bitte die Änderungen prüfen und erneut speichern.")
+                else:
+                    st.success(f"Gerät {selected_device.device_name} wurde aktualisiert!")
+                    st.session_state.pop(version_key, None)
+                    st.rerun()
             if deleted:
-                st.warning(f"Gerät {selected_device['Name']} wurde gelöscht!")
+                selected_device.delete()
+                st.warning(f"Gerät {selected_device.device_name} wurde gelöscht!")
+                st.rerun()
+            st.session_state[version_key] = loaded_version
     
     st.divider()
     
@@ -87,13 +199,15 @@ with tab1:
 with tab2:
     st.header("Nutzerverwaltung")
     
-    # Lade alle User aus der Datenbank
-    user_objects = User.find_all()
-    users = [{"Name": u.name, "Email": u.id} for u in user_objects]
+    filter_user_name = st.text_input("Name beginnt mit", key="user_filter_name")
     
     st.subheader("Alle Nutzer")
     
-   
+    # Lade nur die sichtbare Seite der User aus der Datenbank
+    offset, limit = page_selection("user")
+    users, users_total = load_user_page(get_database().storage.version(), offset, limit, filter_user_name)
+    st.caption(page_caption(offset, limit, users_total))
+    
     df = pd.DataFrame(users)
     
     event = st.dataframe(
@@ -104,17 +218,20 @@ with tab2:
         key="user_table"
     )
     
-    # Wenn eine Zeile ausgewählt wurde
-    if event.selection.rows:
+    # Wenn eine Zeile ausgewählt wurde, den User mit seiner Version laden
+    if event.selection.rows and event.selection.rows[0] < len(users):
         selected_idx = event.selection.rows[0]
-        selected_user = users[selected_idx]
-        
+        selected_user = User.find_by_attribute("id", users[selected_idx]["Email"])
+    else:
+        selected_user = None
+    
+    if selected_user:
         st.divider()
-        st.subheader(f"Nutzer bearbeiten: {selected_user['Name']}")
+        st.subheader(f"Nutzer bearbeiten: {selected_user.name}")
         
         with st.form("edit_user"):
-            edit_name = st.text_input("Name", value=selected_user["Name"])
-            edit_email = st.text_input("Email", value=selected_user["Email"])
+            edit_name = st.text_input("Name", value=selected_user.name)
+            edit_email = st.text_input("Email", value=selected_user.id)
             
             col1, col2 = st.columns(2)
             with col1:
@@ -122,18 +239,30 @@ with tab2:
             with col2:
                 deleted = st.form_submit_button("Nutzer löschen", type="secondary")
             
+            # Beim Speichern zählt der Stand, mit dem das Formular angezeigt wurde
+            version_key = f"user_version_{selected_user.id}"
+            loaded_version = selected_user.version
+            
             if submitted:
                 # Aktualisiere User in der Datenbank
-                user = User(edit_email, edit_name)
-                user.store_data()
-                st.success(f"Nutzer {edit_name} wurde aktualisiert!")
-                st.rerun()
+                selected_user.name = edit_name
+                selected_user.id = edit_email
+                selected_user.version = st.session_state.get(version_key, loaded_version)
+                try:
+                    selected_user.store_data()
+                except StaleVersionError:
+                    st.error(f"Nutzer {edit_name} wurde inzwischen von jemand anderem geändert. "
+                             "Bitte die Änderungen prüfen und erneut speichern.")
+                else:
+                    st.success(f"Nutzer {edit_name} wurde aktualisiert!")
+                    st.session_state.pop(version_key, None)
+                    st.rerun()
             if deleted:
                 # Lösche User aus der Datenbank
-                user = User(selected_user["Email"], selected_user["Name"])
-                user.delete()
-                st.warning(f"Nutzer {selected_user['Name']} wurde gelöscht!")
+                selected_user.delete()
+                st.warning(f"Nutzer {selected_user.name} wurde gelöscht!")
                 st.rerun()
+            st.session_state[version_key] = loaded_version
     
     st.divider()
     st.subheader("Neuen Nutzer hinzufügen")
@@ -154,16 +283,9 @@ with tab2:
 with tab3:
     st.header("Reservierungen")
     
-    # Mock-Daten
-    reservations = [
-        {"Gerät": "Laser-Cutter", "Reserviert von": "Prof. Müller", "Start": "2025-12-16", "Ende": "2025-12-20", "Grund": "Forschungsprojekt"},
-        {"Gerät": "3D-Drucker", "Reserviert von": "Anna Schmidt", "Start": "2025-12-18", "Ende": "2025-12-22", "Grund": "Lehrlabor"},
-        {"Gerät": "CNC-Fräse", "Reserviert von": "Tom Weber", "Start": "2025-12-15", "Ende": "2025-12-17", "Grund": "Abschlussarbeit"},
-        {"Gerät": "Laser-Cutter", "Reserviert von": "Lisa Klein", "Start": "2025-12-22", "Ende": "2025-12-25", "Grund": "Studentenprojekt"},
-    ]
-    
     st.subheader("Alle Reservierungen")
     
+    reservations = load_reservations(get_database().storage.version())
     df_reservations = pd.DataFrame(reservations)
     st.dataframe(df_reservations, use_container_width=True)
     
@@ -172,7 +294,7 @@ with tab3:
     # Neue Reservierung hinzufügen
     st.subheader("Neue Reservierung erstellen")
     with st.form("new_reservation"):
-        geraet = st.selectbox("Gerät", ["Laser-Cutter", "3D-Drucker", "CNC-Fräse", "Oszilloskop"])
+        geraet = st.selectbox("Gerät", queries.find_devices())
         reserviert_von = st.text_input("Reserviert von")
         col1, col2 = st.columns(2)
         with col1:
@@ -183,66 +305,140 @@ with tab3:
         
         submitted = st.form_submit_button("Reservierung speichern")
         if submitted:
-            st.success(f"Reservierung für {geraet} wurde erstellt!")
+            # Das End-Datum ist inklusive, die Reservierung läuft bis zum Beginn des Folgetags
+            start = datetime.combine(start_datum, time.min)
+            ende = datetime.combine(end_datum, time.min) + timedelta(days=1)
+            try:
+                Reservation(geraet, reserviert_von, start, ende, grund).store_data()
+            except ValueError as error:
+                st.error(str(error))
+                freie_zeiten = Reservation.free_slots(geraet, start, start + timedelta(days=30), ende - start)
+                if freie_zeiten:
+                    st.info(f"Nächster freier Zeitraum ab {freie_zeiten[0][0].strftime('%d.%m.%Y %H:%M')}")
+            else:
+                st.success(f"Reservierung für {geraet} wurde erstellt!")
+                st.rerun()
 
 with tab4:
     st.header("Wartungsplan")
     
-    # Geräte in Wartung
-    st.subheader("Geräte in Wartung")
-    geraete_in_wartung = [d for d in devices if d["Status"] == "In Wartung"]
-    
-    if geraete_in_wartung:
-        wartung_data = []
-        for device in geraete_in_wartung:
-            wartung_ende = datetime.strptime(device["Wartung_bis"], "%Y-%m-%d")
-            tage_verbleibend = (wartung_ende - datetime.now()).days
-            wartung_data.append({
-                "Gerät": device["Name"],
-                "Typ": device["Typ"],
-                "Verantwortlich": device["Verantwortlich"],
-                "Wartung bis": device["Wartung_bis"],
-                "Verbleibende Tage": tage_verbleibend
-            })
-        df_wartung = pd.DataFrame(wartung_data)
-        st.dataframe(df_wartung, use_container_width=True)
+    schedule = load_schedule(get_database().storage.version(), date.today())
+    
+    # Überfällige Wartungen
+    st.subheader("Überfällige Wartungen")
+    ueberfaellig = schedule[schedule["overdue"]]
+    
+    if len(ueberfaellig):
+        st.dataframe(schedule_rows(ueberfaellig), use_container_width=True)
     else:
-        st.info("Aktuell befinden sich keine Geräte in Wartung.")
+        st.info("Aktuell sind keine Wartungen überfällig.")
     
     st.divider()
     
-    # Anstehende Wartungen
+    # Anstehende Wartungen kommen aus der Warteschlange, die nach nächster Wartung geordnet ist
     st.subheader("Anstehende Wartungen")
+    tage = st.number_input("Fällig in den nächsten Tagen", min_value=1, value=30, step=1)
+    now = datetime.now()
+    anstehend = [(due, name) for due, name in Device.upcoming_maintenance.due_within(tage, now) if due >= now]
+    verantwortlich = dict(zip(schedule["device_name"], schedule["managed_by_user_id"]))
+    st.dataframe(pd.DataFrame([{
+        "Gerät": name,
+        "Verantwortlich": verantwortlich.get(name),
+        "Nächste Wartung": due.strftime("%d.%m.%Y"),
+        "Tage bis Wartung": (due - now).days,
+    } for due, name in anstehend[:SCHEDULE_ROWS]]), use_container_width=True)
+    if len(anstehend) > SCHEDULE_ROWS:
+        st.caption(f"Die nächsten {SCHEDULE_ROWS} von {len(anstehend)} Wartungen")
     
-    # Sort
-    # iere Geräte nach Tagen bis zur Wartung
-    wartungsplan = sorted(
-        [d for d in devices if d["Status"] != "In Wartung"],
-        key=lambda x: x["Tage_bis_Wartung"]
-    )
+    st.divider()
+    
+    # Wartungskosten pro Verantwortlichem
+    st.subheader("Wartungskosten pro Verantwortlichem")
+    kosten = maintenance_schedule.cost_per_user(schedule).reset_index().rename(columns={
+        "managed_by_user_id": "Verantwortlich", "devices": "Geräte", "overdue": "Überfällig",
+        "quarterly_cost": "Kosten pro Quartal (€)", "annual_cost": "Kosten pro Jahr (€)"
+    })
+    st.dataframe(kosten, use_container_width=True)
+    
+    st.divider()
+    
+    # Wartungskosten aus der Historie, aus den laufend mitgeführten Summen
+    st.subheader("Wartungskosten (Historie)")
+    auswertung = st.radio("Auswertung", ["Monat", "Quartal", "Verantwortlich"], horizontal=True)
+    scope = {"Monat": "month", "Quartal": "quarter", "Verantwortlich": "user"}[auswertung]
+    historie = load_cost_history(get_database().storage.version(), scope)
+    if len(historie):
+        st.dataframe(historie.rename(columns={"Zeitraum": auswertung}), use_container_width=True)
+    else:
+        st.info("Noch keine durchgeführten Wartungen erfasst.")
     
-    wartungsplan_data = []
-    for device in wartungsplan:
-        tage = device["Tage_bis_Wartung"]
-        wartungsplan_data.append({
-            "Gerät": device["Name"],
-            "Typ": device["Typ"],
-            "Nächste Wartung": device["Nächste_Wartung"],
-            "Tage bis Wartung": device["Tage_bis_Wartung"],
-            "Verantwortlich": device["Verantwortlich"]
-        })
-    
-    df_wartungsplan = pd.DataFrame(wartungsplan_data)
-    st.dataframe(df_wartungsplan, use_container_width=True)    
     st.divider()
     
     # Wartung planen
     st.subheader("Wartung planen")
     with st.form("plan_wartung"):
-        geraet_wartung = st.selectbox("Gerät", [d["Name"] for d in devices])
-        neues_wartungsdatum = st.date_input("Nächstes Wartungsdatum")
+        geraet_wartung = st.selectbox("Gerät", schedule["device_name"].tolist())
+        neues_wartungsdatum = st.date_input("Wartungsdatum")
+        wartungskosten = st.number_input("Kosten (€), leer = Wartungskosten des Geräts", min_value=0.0, value=None)
         wartungsnotizen = st.text_area("Notizen")
         
-        submitted = st.form_submit_button("Wartung planen")
-        if submitted:
-            st.success(f"Wartung für {geraet_wartung} am {neues_wartungsdatum} geplant!")
\ No newline at end of file
+        col1, col2 = st.columns(2)
+        with col1:
+            submitted = st.form_submit_button("Wartung planen")
+        with col2:
+            durchgefuehrt = st.form_submit_button("Als durchgeführt erfassen")
+        if (submitted or durchgefuehrt) and geraet_wartung:
+            device = Device.find_by_attribute("device_name", geraet_wartung)
+            wartungsdatum = datetime.combine(neues_wartungsdatum, time())
+            kosten = device.maintenance_cost if wartungskosten is None else wartungskosten
+            if durchgefuehrt:
+                device.complete_maintenance(wartungsdatum, kosten, wartungsnotizen)
+                device.store_data()
+                st.success(f"Wartung für {geraet_wartung} am {neues_wartungsdatum} erfasst!")
+            else:
+                MaintenanceEvent(geraet_wartung, device.managed_by_user_id, wartungsdatum, kosten,
+                                 wartungsnotizen, planned=True).store_data()
+                st.success(f"Wartung für {geraet_wartung} am {neues_wartungsdatum} geplant!")
+    
+    st.divider()
+    
+    # Wartungen eines Zeitraums, über den Datumsindex der Historie
+    st.subheader("Wartungen im Zeitraum")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        von = st.date_input("Von", value=date.today() - timedelta(days=90), key="wartung_von")
+    with col2:
+        bis = st.date_input("Bis", value=date.today() + timedelta(days=90), key="wartung_bis")
+    with col3:
+        nur_geraet = st.selectbox("Gerät", ["Alle"] + schedule["device_name"].tolist(), key="wartung_geraet")
+    ereignisse = MaintenanceEvent.find_between(datetime.combine(von, time()), datetime.combine(bis + timedelta(days=1), time()),
+                                               None if nur_geraet == "Alle" else nur_geraet)
+    if ereignisse:
+        st.dataframe(pd.DataFrame([{
+            "Datum": e.date.strftime("%d.%m.%Y"),
+            "Gerät": e.device_name,
+            "Verantwortlich": e.managed_by_user_id,
+            "Status": "Geplant" if e.planned else "Durchgeführt",
+            "Kosten (€)": e.cost,
+            "Notizen": e.notes,
+        } for e in ereignisse]), use_container_width=True)
+    else:
+        st.info("Keine Wartungen in diesem Zeitraum.")
+
+# Debug-Panel: Laufzeiten, gelesene Zeilen, Bytes und Cache-Trefferquote der Datenbankzugriffe dieses Prozesses
+with st.sidebar.expander("Debug: Datenbank-Metriken"):
+    metrics.registry.enabled = st.toggle("Metriken erfassen", value=metrics.registry.enabled)
+    messwerte = metrics.snapshot()
+    if messwerte:
+        st.dataframe(pd.DataFrame(messwerte).rename(columns={
+            "operation": "Operation", "table": "Tabelle", "calls": "Aufrufe", "errors": "Fehler",
+            "total_ms": "Gesamt [ms]", "mean_ms": "Mittel [ms]", "p50_ms": "p50 [ms]", "p95_ms": "p95 [ms]",
+            "rows": "Zeilen", "bytes_read": "Bytes gelesen", "bytes_written": "Bytes geschrieben",
+            "cache_hit_rate": "Cache-Trefferquote",
+        }), use_container_width=True)
+        st.download_button("Prometheus-Export", metrics.prometheus_text(), file_name="metrics.txt")
+    else:
+        st.caption("Noch keine Messwerte, Erfassung einschalten und die Seite benutzen.")
+    if st.button("Messwerte zurücksetzen"):
+        metrics.registry.reset()
+        st.rerun()
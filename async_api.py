@@ -0,0 +1,130 @@
+"""Helpers behind the async methods of the models (`astore_data`, `afind_all`, ...).
+
+The models do blocking file or SQLite I/O. Called from a coroutine, that work
+runs in a small pool of worker threads instead of on the event loop, with a
+limit on how many calls may wait for a thread at once. Writes arriving while
+another write is running are collected and stored together in one write
+batch, so a burst of `astore_data` calls costs one file write (or one fsync)
+instead of one per call.
+"""
+import threading
+import weakref
+from functools import partial
+
+import config
+
+# asyncio and concurrent.futures are imported where they are used: every model imports this
+# module, but only code that already runs an event loop calls into it
+
+
+class BoundedExecutor:
+    """Runs blocking calls in worker threads, with at most `max_pending` calls queued or running per event loop"""
+
+    def __init__(self, workers: int = None, max_pending: int = None):
+        self._workers = workers or config.ASYNC_WORKERS
+        self._max_pending = max_pending or config.ASYNC_MAX_PENDING
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Semaphores belong to one event loop, every loop gets its own
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def run(self, func, *args, **kwargs):
+        """Call `func` in a worker thread and return its result, waiting for a free slot first"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self._max_pending)
+        async with semaphore:
+            return await loop.run_in_executor(self._get_pool(), partial(func, *args, **kwargs))
+
+    def shutdown(self, wait=True) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+    def _get_pool(self):
+        # Created on first use, so importing the models doesn't start any threads
+        with self._pool_lock:
+            if self._pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='database')
+            return self._pool
+
+
+class WriteCoalescer:
+    """Collects the writes submitted while a write is running and applies them together.
+
+    `apply` gets a list of blocking callables and has to run them as one write
+    batch. If the batch fails, its writes are applied one by one again, so
+    every caller gets the result or the error of its own write. For that a
+    failed batch has to leave the objects of its writes as they were before,
+    the models undo their changes with `storage.on_rollback`.
+    """
+
+    def __init__(self, apply, executor: BoundedExecutor = None):
+        self._apply = apply
+        self._executor = executor
+        # Event loop -> [(write, future)] waiting for the next batch
+        self._queues = weakref.WeakKeyDictionary()
+
+    async def submit(self, write):
+        """Run the blocking callable `write` in the next write batch and return its result"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues.get(loop)
+        if queue is None:
+            # Nothing running, this call drains the queue until it is empty
+            queue = self._queues[loop] = []
+            queue.append((write, future))
+            loop.create_task(self._drain(loop))
+        else:
+            queue.append((write, future))
+        return await future
+
+    async def submit_many(self, writes) -> list:
+        """Run all blocking callables in `writes`, together with whatever else is waiting"""
+        import asyncio
+        return await asyncio.gather(*(self.submit(write) for write in writes))
+
+    async def _drain(self, loop):
+        executor = self._executor or default_executor
+        try:
+            while self._queues[loop]:
+                batch, self._queues[loop] = self._queues[loop], []
+                writes = [write for write, _ in batch]
+                try:
+                    results = await executor.run(self._apply, writes)
+                except Exception:
+                    # Nothing of the batch was written and the objects are back to their state
+                    # before it (versions etc.), find out whose write failed
+                    for write, future in batch:
+                        await self._settle(future, executor.run(self._apply, [write]))
+                    continue
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self._queues[loop]
+
+    @staticmethod
+    async def _settle(future, call):
+        try:
+            results = await call
+        except Exception as error:
+            if not future.done():
+                future.set_exception(error)
+        else:
+            if not future.done():
+                future.set_result(results[0])
+
+
+# Shared by all models
+default_executor = BoundedExecutor()
+
+
+async def run(func, *args, **kwargs):
+    """Call the blocking `func` in a worker thread of the shared executor"""
+    return await default_executor.run(func, *args, **kwargs)
@@ -0,0 +1,111 @@
+"""Request latency and event loop stalls of the async model methods under concurrent load.
+
+Simulates an async API server: many concurrent clients, each sending a mix
+of device lookups and device writes. Compares calling the blocking methods
+right on the event loop, the async methods with one executor call per write
+and the async methods with coalesced writes. A ticker task measures how long
+the event loop was stalled at most.
+
+Run from the repository root with `python -m benchmarks.async_api [clients] [requests]`.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import async_api
+from devices import Device
+from index import IndexedTinyDB
+from serializer import create_serializer
+
+DEVICES = 2_000
+DEFAULT_CLIENTS = 50
+DEFAULT_REQUESTS = 20
+WRITE_SHARE = 0.2
+TICK = 0.001
+
+
+def fill(directory: str, storage: str):
+    table = IndexedTinyDB(os.path.join(directory, f'{storage}.json'), storage=create_serializer(storage)).table(
+        'devices', indexes=('device_name', 'device_id', 'managed_by_user_id'))
+    Device.db_connector = table
+    Device.upcoming_maintenance.invalidate()
+    Device.store_many(Device(i, f'Device{i}', f'user{i % 100}@mci.edu') for i in range(DEVICES))
+
+
+async def blocking_request(name: str, write: bool):
+    device = Device.find_by_attribute('device_name', name)
+    if write:
+        device.maintenance_cost = device.maintenance_cost + 1
+        device.version = None
+        device.store_data()
+
+
+async def executor_request(name: str, write: bool):
+    device = await Device.afind_by_attribute('device_name', name)
+    if write:
+        device.maintenance_cost = device.maintenance_cost + 1
+        device.version = None
+        await async_api.run(device.store_data)
+
+
+async def coalesced_request(name: str, write: bool):
+    device = await Device.afind_by_attribute('device_name', name)
+    if write:
+        device.maintenance_cost = device.maintenance_cost + 1
+        device.version = None
+        await device.astore_data()
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def client(request, count: int, latencies: list):
+    for _ in range(count):
+        name = f'Device{random.randrange(DEVICES)}'
+        start = time.perf_counter()
+        await request(name, random.random() < WRITE_SHARE)
+        latencies.append(time.perf_counter() - start)
+
+
+async def load(request, clients: int, count: int) -> tuple:
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(client(request, count, latencies) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    return clients * count / elapsed, latencies, max(lags, default=0.0)
+
+
+def run(clients: int, count: int):
+    print(f"{clients} concurrent clients, {count} requests each, {WRITE_SHARE:.0%} writes, {DEVICES} devices")
+    print(f"{'storage':>7} {'mode':>10} {'req/s':>7} {'p50 [ms]':>9} {'p95 [ms]':>9} {'p99 [ms]':>9} {'max stall [ms]':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        for storage in ('fast', 'log'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                fill(directory, storage)
+            for mode, request in (('blocking', blocking_request), ('executor', executor_request),
+                                  ('coalesced', coalesced_request)):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    rate, latencies, stall = asyncio.run(load(request, clients, count))
+                quantiles = statistics.quantiles(latencies, n=100)
+                print(f"{storage:>7} {mode:>10} {rate:>7.0f} {quantiles[49] * 1000:>9.2f} {quantiles[94] * 1000:>9.2f} "
+                      f"{quantiles[98] * 1000:>9.2f} {stall * 1000:>15.2f}")
+    async_api.default_executor.shutdown()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CLIENTS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REQUESTS)
@@ -0,0 +1,77 @@
+"""Compare the TinyDB (database.json) and SQLite backends on the calls the models make.
+
+Run from the repository root with `python -m benchmarks.backends`.
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from database import INDEXES
+from index import IndexedTinyDB
+from serializer import create_serializer
+from sqlite_storage import SQLiteDatabase
+from migrate import migrate
+
+SIZES = (1_000, 20_000)
+LOOKUPS = 100
+UPSERTS = 20
+
+
+def make_json_database(path: str, size: int):
+    now = datetime.now()
+    table = IndexedTinyDB(path, storage=create_serializer()).table('devices', indexes=INDEXES['devices'])
+    table.insert_multiple(
+        {'device_id': i, 'device_name': f'Device{i}', 'managed_by_user_id': f'user{i % 100}@mci.edu',
+         'is_active': True, '_Device__creation_date': now, '_Device__last_update': now}
+        for i in range(size)
+    )
+
+
+def open_backend(backend: str, directory: str):
+    if backend == 'sqlite':
+        return SQLiteDatabase(os.path.join(directory, 'db.sqlite3')).table('devices', indexes=INDEXES['devices'])
+    return IndexedTinyDB(os.path.join(directory, 'db.json'), storage=create_serializer()).table(
+        'devices', indexes=INDEXES['devices'])
+
+
+def measure(backend: str, directory: str, size: int) -> dict:
+    results = {}
+    start = time.perf_counter()
+    table = open_backend(backend, directory)
+    table.lookup('device_name', 'Device0')
+    results['open [ms]'] = (time.perf_counter() - start) * 1000
+
+    names = [f'Device{random.randrange(size)}' for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for name in names:
+        table.find('device_name', name)
+    results['find [ms]'] = (time.perf_counter() - start) / LOOKUPS * 1000
+
+    start = time.perf_counter()
+    table.all()
+    results['all [ms]'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for name in names[:UPSERTS]:
+        doc_ids = table.lookup('device_name', name)
+        table.update({'is_active': False, '_Device__last_update': datetime.now()}, doc_ids=doc_ids[:1])
+    results['upsert [ms]'] = (time.perf_counter() - start) / UPSERTS * 1000
+    return results
+
+
+def run():
+    columns = ('open [ms]', 'find [ms]', 'all [ms]', 'upsert [ms]')
+    print(f"{'rows':>8} {'backend':>8} " + ' '.join(f'{column:>12}' for column in columns))
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            make_json_database(os.path.join(directory, 'db.json'), size)
+            migrate(os.path.join(directory, 'db.json'), os.path.join(directory, 'db.sqlite3'))
+            for backend in ('tinydb', 'sqlite'):
+                results = measure(backend, directory, size)
+                print(f"{size:>8} {backend:>8} " + ' '.join(f'{results[column]:>12.2f}' for column in columns))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,47 @@
+"""Import devices one `store_data` at a time versus through `Device.store_many`.
+
+Run from the repository root with `python -m benchmarks.bulk_import`.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from index import IndexedTinyDB
+from serializer import create_serializer
+from devices import Device
+
+SIZES = (100, 500)
+
+
+def fresh_table(directory: str, name: str):
+    return IndexedTinyDB(os.path.join(directory, name), storage=create_serializer()).table(
+        'devices', indexes=('device_name', 'device_id', 'managed_by_user_id'))
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    # store_data reports every row on stdout, keep that out of the timing output
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    return time.perf_counter() - start
+
+
+def run():
+    print(f"{'rows':>8} {'one by one [s]':>16} {'store_many [s]':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in SIZES:
+            devices = [Device(i, f'Device{i}', f'user{i % 50}@mci.edu') for i in range(size)]
+
+            Device.db_connector = fresh_table(directory, f'single_{size}.json')
+            single = timed(lambda: [device.store_data() for device in devices])
+
+            Device.db_connector = fresh_table(directory, f'batch_{size}.json')
+            batched = timed(lambda: Device.store_many(devices))
+
+            print(f"{size:>8} {single:>16.3f} {batched:>16.3f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,115 @@
+"""Lost updates and throughput with several processes writing the same devices.
+
+Every writer process increments the maintenance cost of a few shared devices
+through `Device.store_data`, reloading and retrying when its copy turns out to
+be stale. The final costs have to add up to the number of increments. For
+comparison the same runs without version checks ("blind" writes) show the
+updates that get lost that way.
+
+Run from the repository root with `python -m benchmarks.concurrency [writers] [increments]`.
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+DEFAULT_WRITERS = 4
+DEFAULT_INCREMENTS = 50
+DEVICES = 3
+# Pause between loading and storing a device, like the time a form is open, so the writers interleave
+EDIT_TIME = 0.002
+# (label, environment of the writer processes)
+SETUPS = (
+    ('json', {'DEVICE_DB_BACKEND': 'tinydb', 'DEVICE_DB_JSON_STORAGE': 'fast'}),
+    ('log', {'DEVICE_DB_BACKEND': 'tinydb', 'DEVICE_DB_JSON_STORAGE': 'log'}),
+    ('sqlite', {'DEVICE_DB_BACKEND': 'sqlite'}),
+)
+
+
+def _seed(results):
+    from devices import Device
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(DEVICES):
+            Device(i, f'Shared{i}', 'bench@mci.edu').store_data()
+    results.put(None)
+
+
+def _writer(worker: int, increments: int, versioned: bool, start, results):
+    # Imported in the process, after the environment selected the storage
+    from concurrency import StaleVersionError
+    from devices import Device
+    retries = 0
+    start.wait()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(increments):
+            name = f'Shared{(worker + i) % DEVICES}'
+            while True:
+                device = Device.find_by_attribute('device_name', name)
+                device.maintenance_cost = device.maintenance_cost + 1
+                time.sleep(EDIT_TIME)
+                if not versioned:
+                    device.version = None
+                try:
+                    device.store_data()
+                    break
+                except StaleVersionError:
+                    retries += 1
+    results.put(retries)
+
+
+def _total(results):
+    from devices import Device
+    results.put(sum(Device.find_by_attribute('device_name', f'Shared{i}').maintenance_cost for i in range(DEVICES)))
+
+
+def run_setup(environment: dict, writers: int, increments: int, versioned: bool) -> tuple:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(environment, DEVICE_DB_JSON_PATH=os.path.join(directory, 'db.json'),
+                          DEVICE_DB_SQLITE_PATH=os.path.join(directory, 'db.sqlite3'))
+        seed = context.Process(target=_seed, args=(results,))
+        seed.start()
+        results.get()
+        seed.join()
+
+        start = context.Event()
+        processes = [context.Process(target=_writer, args=(worker, increments, versioned, start, results))
+                     for worker in range(writers)]
+        for process in processes:
+            process.start()
+        # Give the processes time to import everything, then let them all go at once
+        time.sleep(2)
+        began = time.perf_counter()
+        start.set()
+        retries = sum(results.get() for _ in processes)
+        elapsed = time.perf_counter() - began
+        for process in processes:
+            process.join()
+
+        check = context.Process(target=_total, args=(results,))
+        check.start()
+        total = results.get()
+        check.join()
+    lost = writers * increments - int(total)
+    return writers * increments / elapsed, retries, lost
+
+
+def run(writers: int, increments: int):
+    print(f"{writers} writer processes, {increments} increments each, on {DEVICES} shared devices")
+    print(f"{'storage':>8} {'writes':>9} {'updates/s':>10} {'retries':>8} {'lost':>6}")
+    for label, environment in SETUPS:
+        for versioned in (True, False):
+            rate, retries, lost = run_setup(environment, writers, increments, versioned)
+            mode = 'versioned' if versioned else 'blind'
+            print(f"{label:>8} {mode:>9} {rate:>10.0f} {retries:>8} {lost:>6}")
+            if versioned:
+                assert lost == 0, f'{label}: {lost} updates lost'
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WRITERS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_INCREMENTS)
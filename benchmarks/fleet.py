@@ -0,0 +1,170 @@
+"""Synthetic device fleet for the benchmarks: users, devices, reservations and maintenance histories.
+
+The documents look like the ones the models store: a few users manage most
+of the devices, maintenance intervals and costs vary by device kind, some
+devices are retired, reservations of a device never overlap and the history
+holds done and planned maintenances. The same seed always gives the same fleet.
+
+`fill(devices, seed)` writes a fleet of the given size into the database the
+models are connected to, e.g. `python -m benchmarks.fleet 100000` into the
+configured one (see config.py for the DEVICE_DB_* variables).
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from concurrency import VERSION_FIELD
+from devices import Device
+from maintenance_events import MaintenanceEvent
+from reservations import Reservation
+from storage import write_batch
+from users import User
+
+# Number of devices of the named fleet sizes
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+# Fixed point in time the fleet is built around, so the same seed gives the same documents
+NOW = datetime(2025, 1, 1)
+CHUNK = 10_000
+
+# (kind, maintenance intervals in days, typical cost of one maintenance)
+KINDS = (
+    ('Laptop', (180, 365), 60.0),
+    ('Beamer', (90, 180), 80.0),
+    ('Oszilloskop', (180, 365), 150.0),
+    ('3D-Drucker', (30, 60, 90), 120.0),
+    ('Mikroskop', (90, 180), 200.0),
+    ('Zugprüfmaschine', (30, 90), 450.0),
+    ('Lötstation', (90, 365), 25.0),
+    ('Roboterarm', (30, 90), 600.0),
+)
+FIRST_NAMES = ('Anna', 'Lukas', 'Lena', 'David', 'Sophie', 'Jakob', 'Marie', 'Elias', 'Laura', 'Felix', 'Hannah', 'Paul')
+LAST_NAMES = ('Gruber', 'Huber', 'Wagner', 'Müller', 'Pichler', 'Moser', 'Mayer', 'Hofer', 'Berger', 'Eder', 'Steiner')
+REASONS = ('Praktikum', 'Projektarbeit', 'Messreihe', 'Vorlesung', 'Abschlussarbeit', '')
+
+
+def fleet_sizes(devices: int) -> dict:
+    """Number of documents per table for a fleet of `devices` devices"""
+    return {
+        'users': max(10, devices // 20),
+        'devices': devices,
+        'reservations': devices // 4,
+        'maintenance_events': devices // 2,
+    }
+
+
+def user_id(number: int) -> str:
+    return f'user{number:06d}@mci.edu'
+
+
+def device_name(number: int) -> str:
+    return f'{KINDS[number % len(KINDS)][0]}-{number:07d}'
+
+
+def user_documents(count: int, rng: random.Random):
+    for number in range(count):
+        yield {'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', 'id': user_id(number), VERSION_FIELD: 1}
+
+
+def device_documents(count: int, users: int, rng: random.Random):
+    for number in range(count):
+        _, intervals, typical_cost = KINDS[number % len(KINDS)]
+        interval = rng.choice(intervals)
+        created = NOW - timedelta(days=rng.randrange(5 * 365), minutes=rng.randrange(24 * 60))
+        last_maintenance = None
+        if rng.random() < 0.7:
+            last_maintenance = min(NOW, created + timedelta(days=rng.randrange(1, 3 * interval)))
+        retired = rng.random() < 0.05
+        yield {
+            'device_id': number,
+            'device_name': device_name(number),
+            # Squaring skews the owners towards the first users, like labs where a few people manage most devices
+            'managed_by_user_id': user_id(int(users * rng.random() ** 2)),
+            'is_active': not retired,
+            '_Device__creation_date': created,
+            '_Device__last_update': max(created, last_maintenance or created),
+            '_Device__maintenance_interval': interval,
+            '_Device__maintenance_cost': round(typical_cost * rng.uniform(0.5, 1.5), 2),
+            'end_of_life': NOW - timedelta(days=rng.randrange(365)) if retired else None,
+            'first_maintenance': created + timedelta(days=interval),
+            'next_maintenance': (last_maintenance or created) + timedelta(days=interval),
+            '_Device__last_maintenance_date': last_maintenance,
+            VERSION_FIELD: 1,
+        }
+
+
+def reservation_documents(count: int, devices: int, users: int, rng: random.Random):
+    # Every device is booked from the end of its previous reservation on, so reservations never overlap
+    booked_until = {}
+    for _ in range(count):
+        number = rng.randrange(devices)
+        start = booked_until.get(number, NOW - timedelta(days=365)) + timedelta(hours=rng.randrange(1, 24 * 14))
+        end = start + timedelta(hours=rng.randrange(1, 72))
+        booked_until[number] = end
+        yield {
+            'reservation_id': f'{rng.getrandbits(128):032x}',
+            'device_name': device_name(number),
+            'user_id': user_id(rng.randrange(users)),
+            'start_date': start,
+            'end_date': end,
+            'reason': rng.choice(REASONS),
+            VERSION_FIELD: 1,
+        }
+
+
+def event_documents(count: int, devices: int, users: int, rng: random.Random):
+    for _ in range(count):
+        number = rng.randrange(devices)
+        planned = rng.random() < 0.05
+        # Done maintenances lie in the last three years, planned ones in the next half year
+        offset = timedelta(days=rng.randrange(180)) if planned else -timedelta(days=rng.randrange(3 * 365))
+        yield {
+            'event_id': f'{rng.getrandbits(128):032x}',
+            'device_name': device_name(number),
+            'managed_by_user_id': user_id(int(users * rng.random() ** 2)),
+            'date': NOW + offset,
+            'cost': round(KINDS[number % len(KINDS)][2] * rng.uniform(0.3, 3.0), 2),
+            'notes': rng.choice(('', 'Kalibrierung', 'Verschleißteile getauscht', 'Sichtprüfung')),
+            'planned': planned,
+            VERSION_FIELD: 1,
+        }
+
+
+def fill(devices: int, seed: int = 0) -> dict:
+    """Write a fleet of `devices` devices into the tables of the models, and return the documents per table.
+
+    Expects empty tables. Every table is written in one write batch, the cost
+    totals of the maintenance history are computed once at the end.
+    """
+    rng = random.Random(seed)
+    sizes = fleet_sizes(devices)
+    users = sizes['users']
+    generators = (
+        (User.db_connector, user_documents(users, rng)),
+        (Device.db_connector, device_documents(devices, users, rng)),
+        (Reservation.db_connector, reservation_documents(sizes['reservations'], devices, users, rng)),
+        (MaintenanceEvent.db_connector, event_documents(sizes['maintenance_events'], devices, users, rng)),
+    )
+    for table, documents in generators:
+        with write_batch(table):
+            chunk = []
+            for document in documents:
+                chunk.append(document)
+                if len(chunk) == CHUNK:
+                    table.insert_multiple(chunk)
+                    chunk = []
+            if chunk:
+                table.insert_multiple(chunk)
+    MaintenanceEvent.rebuild_rollups()
+    # Written around the models, their in-memory indexes have to be built again
+    Device.upcoming_maintenance.invalidate()
+    Reservation.index.invalidate()
+    MaintenanceEvent.index.invalidate()
+    return sizes
+
+
+if __name__ == "__main__":
+    size = sys.argv[1] if len(sys.argv) > 1 else '1k'
+    start = time.perf_counter()
+    written = fill(SCALES[size] if size in SCALES else int(size))
+    print(f"{written} written in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,102 @@
+"""Throughput of the streaming CSV/JSONL import and export, and their memory use.
+
+Generates a device file with a few invalid rows mixed in and imports it into a
+fresh database per storage, then exports it again. For comparison the first
+rows are also stored one `store_data` call at a time, the only way before.
+The memory check reads a file ten times as large as the first one and expects
+the peak to stay the same.
+
+Run from the repository root with `python -m benchmarks.import_export [rows]`.
+"""
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import import_export
+from devices import Device
+from index import IndexedTinyDB
+from serializer import create_serializer
+
+DEFAULT_ROWS = 20_000
+SINGLE_ROWS = 500
+# Every INVALID_EVERY-th row breaks one of the device rules
+INVALID_EVERY = 100
+STORAGES = ('fast', 'log')
+
+
+def write_devices(path: str, rows: int) -> None:
+    columns = ('device_id', 'device_name', 'managed_by_user_id', 'maintenance_interval', 'maintenance_cost')
+    with open(path, 'w', newline='') as handle:
+        writer = None if path.endswith('.jsonl') else csv.writer(handle)
+        if writer:
+            writer.writerow(columns)
+        for i in range(rows):
+            interval = 0 if i % INVALID_EVERY == 0 else 30 + i % 60
+            row = (i, f'Device{i}', f'user{i % 100}@mci.edu', interval, i % 500 / 2)
+            if writer:
+                writer.writerow(row)
+            else:
+                handle.write(json.dumps(dict(zip(columns, row))) + '\n')
+
+
+def use_table(directory: str, name: str, storage: str):
+    Device.db_connector = IndexedTinyDB(os.path.join(directory, name), storage=create_serializer(storage)).table(
+        'devices', indexes=('device_name', 'device_id', 'managed_by_user_id'))
+    Device.upcoming_maintenance.invalidate()
+
+
+def read_peak(path: str) -> int:
+    tracemalloc.start()
+    for _ in import_export.read_rows(path):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run(rows: int):
+    print(f"{rows} device rows, every {INVALID_EVERY}th invalid")
+    print(f"{'storage':>8} {'file':>6} {'mode':>10} {'rows/s':>9} {'rejected':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ('csv', 'jsonl'):
+            source = os.path.join(directory, f'devices.{extension}')
+            write_devices(source, rows)
+            for storage in STORAGES:
+                use_table(directory, f'{storage}_{extension}.json', storage)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    report = import_export.import_devices(source)
+                assert report.failed == len(range(0, rows, INVALID_EVERY)), report
+                assert len(Device.db_connector) == rows - report.failed
+                print(f"{storage:>8} {extension:>6} {'import':>10} {report.rows_per_second:>9.0f} {report.failed:>9}")
+
+                target = os.path.join(directory, f'export_{storage}.{extension}')
+                report = import_export.write_rows(target, import_export.export_devices(), import_export.DEVICE_FIELDS)
+                assert report.rows == len(Device.db_connector)
+                print(f"{storage:>8} {extension:>6} {'export':>10} {report.rows_per_second:>9.0f} {'':>9}")
+
+                use_table(directory, f'{storage}_{extension}_single.json', storage)
+                single = [import_export.device_from_row(row) for _, row in import_export.read_rows(target)]
+                single = single[:SINGLE_ROWS]
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for device in single:
+                        device.store_data()
+                rate = len(single) / (time.perf_counter() - start)
+                print(f"{storage:>8} {extension:>6} {'store_data':>10} {rate:>9.0f} {'':>9}")
+
+        small = os.path.join(directory, 'devices.csv')
+        large = os.path.join(directory, 'large.csv')
+        write_devices(large, rows * 10)
+        small_peak, large_peak = read_peak(small), read_peak(large)
+        print(f"peak memory reading {rows} rows: {small_peak / 1024:.0f} KiB, {rows * 10} rows: {large_peak / 1024:.0f} KiB")
+        assert large_peak < small_peak * 1.5 + 64 * 1024, 'reading memory grows with the file size'
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS)
@@ -0,0 +1,55 @@
+"""Compare indexed lookups with full-table query scans for growing table sizes.
+
+Run from the repository root with `python -m benchmarks.index_lookup`.
+"""
+import random
+import time
+
+from tinydb import Query
+from tinydb.storages import MemoryStorage
+
+from index import IndexedTinyDB
+from devices import Device
+
+SIZES = (1_000, 10_000, 50_000)
+LOOKUPS = 200
+
+
+def make_table(size: int):
+    # MemoryStorage keeps file I/O out of the measurement, only the lookup itself is timed
+    table = IndexedTinyDB(storage=MemoryStorage).table(
+        'devices', indexes=('device_name', 'device_id', 'managed_by_user_id'))
+    table.insert_multiple(
+        {'device_id': i, 'device_name': f'Device{i}', 'managed_by_user_id': f'user{i % 100}@mci.edu', 'is_active': True}
+        for i in range(size)
+    )
+    return table
+
+
+def time_per_call(func, names) -> float:
+    start = time.perf_counter()
+    for name in names:
+        func(name)
+    return (time.perf_counter() - start) / len(names)
+
+
+def run():
+    print(f"{'rows':>8} {'scan [ms]':>12} {'index [ms]':>12} {'upsert [ms]':>12}")
+    for size in SIZES:
+        table = make_table(size)
+        # Every name only once, otherwise TinyDB's query cache answers the scan
+        names = [f'Device{random.randrange(size)}' for _ in range(LOOKUPS)]
+
+        scan = time_per_call(lambda name: table.search(Query().device_name == name), names)
+        # The first lookup builds the index, which shouldn't count as the time of a lookup
+        table.lookup('device_name', 'Device0')
+        indexed = time_per_call(lambda name: table.find('device_name', name), names)
+
+        Device.db_connector = table
+        upsert = time_per_call(lambda name: Device(0, name, 'one@mci.edu').store_data(), names[:20])
+
+        print(f"{size:>8} {scan * 1000:>12.3f} {indexed * 1000:>12.3f} {upsert * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    run()
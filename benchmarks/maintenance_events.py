@@ -0,0 +1,108 @@
+"""Cost reports and date range queries over the maintenance history: stored totals versus scanning all events.
+
+Fills a history of random maintenances, then answers the dashboard questions
+(costs per month, per user, of one device, events of the last 30 days) once
+from the totals and the date index and once by walking over every event. The
+answers have to agree.
+
+Run from the repository root with `python -m benchmarks.maintenance_events`.
+"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import cached_all
+from index import IndexedTinyDB
+from maintenance_events import MaintenanceEvent, month_key, rollup_keys
+from serializer import create_serializer
+
+SIZES = (10_000, 100_000)
+DEVICES = 1_000
+USERS = 50
+CHUNK = 5_000
+START = datetime(2022, 1, 1)
+DAYS = 3 * 365
+REPEAT = 20
+
+
+def fill(directory: str, size: int) -> float:
+    database = IndexedTinyDB(os.path.join(directory, f'events_{size}.json'), storage=create_serializer('log'))
+    MaintenanceEvent.db_connector = database.table(
+        'maintenance_events', indexes=('event_id', 'device_name', 'managed_by_user_id'))
+    MaintenanceEvent.rollups = database.table('maintenance_rollups', indexes=('rollup_key', 'scope'))
+    MaintenanceEvent.index.invalidate()
+    random.seed(size)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for offset in range(0, size, CHUNK):
+            events = []
+            for _ in range(min(CHUNK, size - offset)):
+                device = random.randrange(DEVICES)
+                events.append(MaintenanceEvent(
+                    f'Device{device}', f'user{device % USERS}@mci.edu',
+                    START + timedelta(days=random.randrange(DAYS), hours=random.randrange(24)),
+                    round(random.uniform(10, 500), 2), planned=random.random() < 0.05))
+            MaintenanceEvent.store_many(events)
+    return size / (time.perf_counter() - start)
+
+
+def timed(func) -> tuple:
+    result = func()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func()
+    return (time.perf_counter() - start) / REPEAT * 1000, result
+
+
+def scan_totals(scope: str) -> dict:
+    totals = {}
+    for data in cached_all(MaintenanceEvent.db_connector):
+        if not data['planned']:
+            key = rollup_keys(data)[scope]
+            totals[key] = totals.get(key, 0.0) + data['cost']
+    return totals
+
+
+def scan_between(start: datetime, end: datetime) -> list:
+    events = [(data['date'], data['event_id']) for data in cached_all(MaintenanceEvent.db_connector)
+              if start <= data['date'] < end]
+    return [event_id for _, event_id in sorted(events)]
+
+
+def run():
+    print(f"{'events':>8} {'stored/s':>9} {'query':>18} {'totals/index [ms]':>18} {'scan [ms]':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in SIZES:
+            rate = fill(directory, size)
+            end = START + timedelta(days=DAYS)
+            month = month_key(end - timedelta(days=40))
+            queries = (
+                ('costs per month', lambda: {k: v['cost'] for k, v in MaintenanceEvent.totals_by('month').items()},
+                 lambda: scan_totals('month')),
+                ('costs per user', lambda: {k: v['cost'] for k, v in MaintenanceEvent.totals_by('user').items()},
+                 lambda: scan_totals('user')),
+                ('one month', lambda: MaintenanceEvent.totals('month', month)['cost'],
+                 lambda: scan_totals('month')[month]),
+                ('last 30 days', lambda: MaintenanceEvent.index.between(end - timedelta(days=30), end),
+                 lambda: scan_between(end - timedelta(days=30), end)),
+            )
+            for label, fast, scan in queries:
+                fast_ms, fast_result = timed(fast)
+                scan_ms, scan_result = timed(scan)
+                if isinstance(fast_result, dict):
+                    assert fast_result.keys() == scan_result.keys(), label
+                    assert all(abs(fast_result[key] - scan_result[key]) < 0.01 for key in fast_result), label
+                elif isinstance(fast_result, float):
+                    assert abs(fast_result - scan_result) < 0.01, label
+                else:
+                    assert fast_result == scan_result, label
+                print(f"{size:>8} {rate:>9.0f} {label:>18} {fast_ms:>18.3f} {scan_ms:>10.2f}")
+            MaintenanceEvent.db_connector.storage.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,50 @@
+"""Sorting the whole fleet by next maintenance versus reading from the MaintenanceQueue.
+
+Run from the repository root with `python -m benchmarks.maintenance_queue`.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from maintenance_queue import MaintenanceQueue
+
+SIZES = (10_000, 100_000, 1_000_000)
+K = 20
+UPDATES = 10_000
+
+
+def make_documents(count: int) -> list:
+    now = datetime.now()
+    return [{'device_name': f'Device{i}', 'next_maintenance': now + timedelta(minutes=random.randrange(-10_000, 500_000))}
+            for i in range(count)]
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def run():
+    print(f"{'devices':>9} {'build [ms]':>11} {'sort all [ms]':>14} {'next_k [ms]':>12} {'due 7d [ms]':>12} {'update [us]':>12}")
+    for size in SIZES:
+        documents = make_documents(size)
+        queue = MaintenanceQueue()
+        build = timed(lambda: queue.load(documents))
+        sort_all = timed(lambda: sorted(documents, key=lambda d: d['next_maintenance'])[:K])
+        next_k = timed(lambda: queue.next_k(K))
+        due = timed(lambda: queue.due_within(7))
+
+        now = datetime.now()
+        names = [f'Device{random.randrange(size)}' for _ in range(UPDATES)]
+        update = timed(lambda: [queue.update(name, now + timedelta(days=random.randrange(365))) for name in names])
+
+        # The queue has to agree with a full sort after the updates (ties may come in any order)
+        expected = sorted(due for due, _ in queue._current.values())[:K]
+        assert [due for due, _ in queue.next_k(K)] == expected
+
+        print(f"{size:>9} {build:>11.1f} {sort_all:>14.1f} {next_k:>12.3f} {due:>12.1f} {update / UPDATES * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,80 @@
+"""Per-object maintenance calculations versus the vectorized fleet schedule.
+
+Both sides start from the same stored device documents and produce days until
+maintenance, overdue flags and quarterly/annual costs per responsible user.
+Run from the repository root with `python -m benchmarks.maintenance_schedule [devices]`.
+"""
+import contextlib
+import io
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import maintenance_schedule as schedule_module
+from devices import Device
+
+DEFAULT_DEVICES = 1_000_000
+
+
+def make_documents(count: int) -> list:
+    now = datetime.now()
+    documents = []
+    for i in range(count):
+        created = now - timedelta(days=random.randrange(1000))
+        interval = random.choice((7, 30, 90, 180, 365))
+        last = created + timedelta(days=random.randrange(400)) if i % 3 else None
+        documents.append({
+            'device_id': i, 'device_name': f'Device{i}', 'managed_by_user_id': f'user{i % 1000}@mci.edu',
+            'is_active': True, schedule_module.CREATION_DATE: created, schedule_module.INTERVAL: interval,
+            schedule_module.COST: round(random.uniform(0, 500), 2), schedule_module.LAST_MAINTENANCE: last,
+        })
+    return documents
+
+
+def per_object(documents: list) -> dict:
+    totals = {}
+    for data in documents:
+        device = Device(data['device_id'], data['device_name'], data['managed_by_user_id'])
+        device.maintenance_cost = data[schedule_module.COST]
+        # maintenance_interval(days) recalculates next_maintenance from the last maintenance date
+        device._Device__creation_date = data[schedule_module.CREATION_DATE]
+        device._Device__last_maintenance_date = data[schedule_module.LAST_MAINTENANCE]
+        device.maintenance_interval(data[schedule_module.INTERVAL])
+
+        days = device.get_days_until_maintenance()
+        quarterly = device.calculate_quarterly_maintenance_cost()
+        user = totals.setdefault(device.managed_by_user_id, [0, 0, 0.0, 0.0])
+        user[0] += 1
+        user[1] += days < 0
+        user[2] += quarterly
+        user[3] += 4 * quarterly
+    return totals
+
+
+def vectorized(documents: list):
+    return schedule_module.cost_per_user(schedule_module.compute_schedule(schedule_module.load_frame(documents)))
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    return time.perf_counter() - start
+
+
+def run(count: int):
+    documents = make_documents(count)
+    print(f"{count} devices")
+    print(f"per-object loop:        {timed(per_object, documents):8.2f} s")
+
+    frame_time = timed(schedule_module.load_frame, documents)
+    frame = schedule_module.load_frame(documents)
+    compute_time = timed(lambda: schedule_module.cost_per_user(schedule_module.compute_schedule(frame)))
+    print(f"vectorized, load frame: {frame_time:8.2f} s")
+    print(f"vectorized, schedule:   {compute_time:8.2f} s")
+    print(f"vectorized, total:      {timed(vectorized, documents):8.2f} s")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DEVICES)
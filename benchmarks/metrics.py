@@ -0,0 +1,81 @@
+"""Cost of the instrumentation: model calls without wrappers, with recording off and with recording on.
+
+Run from the repository root with `python -m benchmarks.metrics`.
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import metrics
+from devices import Device
+from index import IndexedTable, IndexedTinyDB
+from serializer import create_serializer
+
+DEVICES = 10_000
+CALLS = 20_000
+ROUNDS = 5
+
+
+def fill(directory: str):
+    Device.db_connector = IndexedTinyDB(os.path.join(directory, 'db.json'), storage=create_serializer()).table(
+        'devices', indexes=('device_name', 'device_id', 'managed_by_user_id'))
+    Device.upcoming_maintenance.invalidate()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Device.store_many(Device(i, f'Device{i}', f'user{i % 100}@mci.edu') for i in range(DEVICES))
+
+
+def lookups(find) -> float:
+    """Time of CALLS lookups, in microseconds per call"""
+    names = [f'Device{i * 7919 % DEVICES}' for i in range(CALLS)]
+    start = time.perf_counter()
+    for name in names:
+        find('device_name', name)
+    return (time.perf_counter() - start) / CALLS * 1e6
+
+
+@contextlib.contextmanager
+def unwrapped():
+    """Device.find_by_attribute and IndexedTable.find without their instrumentation wrappers"""
+    wrapped_model = Device.__dict__['find_by_attribute']
+    wrapped_find = IndexedTable.find
+    Device.find_by_attribute = classmethod(wrapped_model.__func__.__wrapped__)
+    IndexedTable.find = wrapped_find.__wrapped__
+    try:
+        yield
+    finally:
+        Device.find_by_attribute = wrapped_model
+        IndexedTable.find = wrapped_find
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        fill(directory)
+        metrics.registry.reset()
+        bare = disabled = enabled = float('inf')
+        # The modes take turns, so a slow moment of the machine doesn't count against one of them
+        for _ in range(ROUNDS):
+            with unwrapped():
+                bare = min(bare, lookups(Device.find_by_attribute))
+            metrics.registry.enabled = False
+            disabled = min(disabled, lookups(Device.find_by_attribute))
+            metrics.registry.enabled = True
+            enabled = min(enabled, lookups(Device.find_by_attribute))
+            metrics.registry.enabled = False
+        recorded = {(row['operation'], row['table']): row for row in metrics.snapshot()}
+
+    print(f"Device.find_by_attribute on {DEVICES} devices, {CALLS} calls")
+    print(f"{'mode':>16} {'us/call':>8} {'overhead':>9}")
+    for mode, value in (('no wrappers', bare), ('recording off', disabled), ('recording on', enabled)):
+        print(f"{mode:>16} {value:>8.2f} {(value / bare - 1):>9.1%}")
+    assert recorded[('Device.find_by_attribute', 'devices')]['calls'] == CALLS * ROUNDS
+    assert recorded[('find', 'devices')]['rows'] == CALLS * ROUNDS
+    text = metrics.prometheus_text()
+    assert f'device_db_operation_seconds_count{{operation="find",table="devices"}} {CALLS * ROUNDS}' in text
+    # Switched off, the wrappers only check a flag
+    assert disabled < bare * 1.15, f'recording off costs {disabled / bare - 1:.0%}'
+
+
+if __name__ == "__main__":
+    run()
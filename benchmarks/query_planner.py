@@ -0,0 +1,91 @@
+"""Queries through query_planner versus loading whole documents and filtering them in Python.
+
+Compares, on a synthetic fleet (see benchmarks.fleet), the device names of
+`queries.find_devices`, the due devices of one user and the first matches of
+a condition on a field without an index. The old way reads every device
+document through the read cache after a write, like a rerun of the UI after
+an edit. Both ways have to give the same rows.
+
+Run from the repository root with `python -m benchmarks.query_planner [devices]`.
+"""
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import database
+import queries
+from benchmarks import fleet
+from benchmarks.suite import connect, touch
+from devices import Device
+from query_planner import Select
+
+DEFAULT_DEVICES = 100_000
+STORAGES = ('fast', 'sqlite')
+REPEAT = 3
+
+
+def timed(func) -> tuple:
+    """Best time in milliseconds of REPEAT runs, each right after a write, and the result"""
+    best = float('inf')
+    for _ in range(REPEAT):
+        touch()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def names_before():
+    return [data['device_name'] for data in database.cached_all(Device.db_connector)]
+
+
+def due_before(owner: str, cutoff) -> list:
+    due = [data for data in database.cached_all(Device.db_connector)
+           if data['managed_by_user_id'] == owner and data.get('is_active', True) and data['next_maintenance'] <= cutoff]
+    return [data['device_name'] for data in sorted(due, key=lambda data: data['next_maintenance'])[:10]]
+
+
+def due_planned(owner: str, cutoff) -> list:
+    rows = (Select(Device.db_connector, fields=('device_name',)).equals(managed_by_user_id=owner, is_active=True)
+            .where('next_maintenance', '<=', cutoff).order_by('next_maintenance').limit(10).run())
+    return [row['device_name'] for row in rows]
+
+
+def first_before(cost: float) -> list:
+    # What find did for fields without an index: collect every match, then slice
+    return [data['device_name'] for data in database.cached_all(Device.db_connector)
+            if data['_Device__maintenance_cost'] > cost][:5]
+
+
+def first_planned(cost: float) -> list:
+    rows = Select(Device.db_connector, fields=('device_name',)).where('_Device__maintenance_cost', '>', cost).limit(5).run()
+    return [row['device_name'] for row in rows]
+
+
+def run(devices: int):
+    owner = fleet.user_id(3)
+    cutoff = fleet.NOW + timedelta(days=30)
+    cases = (
+        ('device names', names_before, queries.find_devices),
+        ('due of one user', lambda: due_before(owner, cutoff), lambda: due_planned(owner, cutoff)),
+        ('first 5 by cost', lambda: first_before(300.0), lambda: first_planned(300.0)),
+    )
+    print(f"{devices} devices")
+    print(f"{'storage':>8} {'query':>16} {'before [ms]':>12} {'planned [ms]':>13}")
+    for storage in STORAGES:
+        with tempfile.TemporaryDirectory() as directory:
+            connect(storage, directory)
+            fleet.fill(devices)
+            for label, before, planned in cases:
+                before_ms, expected = timed(before)
+                planned_ms, result = timed(planned)
+                assert result == expected, label
+                print(f"{storage:>8} {label:>16} {before_ms:>12.1f} {planned_ms:>13.1f}")
+            print(Select(Device.db_connector, fields=('device_name',)).equals(managed_by_user_id=owner, is_active=True)
+                  .where('next_maintenance', '<=', cutoff).order_by('next_maintenance').limit(10).explain())
+            database.close_all()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DEVICES)
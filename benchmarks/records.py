@@ -0,0 +1,85 @@
+"""Memory and time per row of Device objects, and lazy iteration versus loading the whole table.
+
+Run from the repository root with `python -m benchmarks.records [rows]`.
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from database import INDEXES
+from sqlite_storage import SQLiteDatabase
+from devices import Device
+
+DEFAULT_ROWS = 1_000_000
+ITERATION_ROWS = 200_000
+
+
+class DictDevice:
+    """Same attributes as Device, but in a per-instance __dict__ like Device had before __slots__"""
+
+    def __init__(self, data):
+        for field in Device.stored_fields:
+            setattr(self, field, data[field])
+
+
+def make_documents(count: int) -> list:
+    now = datetime.now()
+    due = now + timedelta(days=90)
+    return [{'device_id': i, 'device_name': f'Device{i}', 'managed_by_user_id': 'one@mci.edu', 'is_active': True,
+             '_Device__creation_date': now, '_Device__last_update': now, '_Device__maintenance_interval': 90,
+             '_Device__maintenance_cost': 10.0, 'end_of_life': None, 'first_maintenance': due,
+             'next_maintenance': due, '_Device__last_maintenance_date': None} for i in range(count)]
+
+
+def measure(func) -> tuple:
+    """Return (seconds, bytes still allocated by the result)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, allocated
+
+
+def peak(func) -> int:
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_memory
+
+
+def run(rows: int):
+    documents = make_documents(rows)
+    cases = {
+        'Device(...) constructor': lambda: [Device(d['device_id'], d['device_name'], d['managed_by_user_id']) for d in documents],
+        '__dict__ object': lambda: [DictDevice(d) for d in documents],
+        '__slots__ hydration': lambda: [Device._from_document(d) for d in documents],
+    }
+    print(f"{rows} rows")
+    print(f"{'':>24} {'time/row [us]':>14} {'memory/row [B]':>15}")
+    for name, func in cases.items():
+        elapsed, allocated = measure(func)
+        print(f"{name:>24} {elapsed / rows * 1e6:>14.2f} {allocated / rows:>15.0f}")
+    del documents
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = SQLiteDatabase(os.path.join(directory, 'db.sqlite3'))
+        Device.db_connector = database.table('devices', indexes=INDEXES['devices'])
+        Device.db_connector.insert_multiple(make_documents(ITERATION_ROWS))
+        print(f"\nwalking {ITERATION_ROWS} stored devices (sqlite)")
+        print(f"{'list(find_all)':>24} peak {peak(lambda: sum(1 for _ in list(Device.find_all()))) / 2**20:8.1f} MiB")
+        print(f"{'iter_all':>24} peak {peak(lambda: sum(1 for _ in Device.iter_all())) / 2**20:8.1f} MiB")
+        database.close()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS)
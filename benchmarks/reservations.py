@@ -0,0 +1,84 @@
+"""Booking throughput with the per-device reservation calendar versus a linear overlap scan.
+
+Run from the repository root with `python -m benchmarks.reservations`.
+"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import INDEXES
+from sqlite_storage import SQLiteDatabase
+from reservations import DeviceCalendar, Reservation, ReservationIndex
+
+DEVICES = 5
+REQUESTS = (1_000, 10_000, 50_000)
+STORED_REQUESTS = 2_000
+
+
+def booking_requests(count: int) -> list:
+    start = datetime(2026, 1, 1)
+    requests = []
+    for _ in range(count):
+        begin = start + timedelta(hours=random.randrange(24 * 365 * 5))
+        requests.append((f'Device{random.randrange(DEVICES)}', begin, begin + timedelta(hours=random.randrange(1, 48))))
+    return requests
+
+
+def book_with_calendar(requests) -> int:
+    calendars = {}
+    booked = 0
+    for number, (device, begin, end) in enumerate(requests):
+        calendar = calendars.setdefault(device, DeviceCalendar())
+        if not calendar.overlapping(begin, end):
+            calendar.add(str(number), begin, end)
+            booked += 1
+    return booked
+
+
+def book_with_scan(requests) -> int:
+    bookings = {}
+    booked = 0
+    for device, begin, end in requests:
+        existing = bookings.setdefault(device, [])
+        if not any(other_begin < end and other_end > begin for other_begin, other_end in existing):
+            existing.append((begin, end))
+            booked += 1
+    return booked
+
+
+def run():
+    print(f"{'requests':>9} {'booked':>7} {'calendar [req/s]':>17} {'scan [req/s]':>13}")
+    for count in REQUESTS:
+        requests = booking_requests(count)
+        start = time.perf_counter()
+        booked = book_with_calendar(requests)
+        calendar_time = time.perf_counter() - start
+        start = time.perf_counter()
+        assert book_with_scan(requests) == booked
+        scan_time = time.perf_counter() - start
+        print(f"{count:>9} {booked:>7} {count / calendar_time:>17.0f} {count / scan_time:>13.0f}")
+
+    # End to end through Reservation.store_data on the SQLite backend
+    with tempfile.TemporaryDirectory() as directory:
+        Reservation.db_connector = SQLiteDatabase(os.path.join(directory, 'db.sqlite3')).table(
+            'reservations', indexes=INDEXES['reservations'])
+        Reservation.index = ReservationIndex(lambda: Reservation.db_connector.all())
+        booked = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for device, begin, end in booking_requests(STORED_REQUESTS):
+                try:
+                    Reservation(device, 'user@mci.edu', begin, end).store_data()
+                    booked += 1
+                except ValueError:
+                    pass
+        elapsed = time.perf_counter() - start
+        print(f"store_data (sqlite): {STORED_REQUESTS} requests, {booked} booked, {STORED_REQUESTS / elapsed:.0f} req/s")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,61 @@
+"""Encode/decode throughput of the SerializationMiddleware chain versus SchemaJSONStorage.
+
+Run from the repository root with `python -m benchmarks.serializer [documents]`.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from serializer import SchemaJSONStorage, create_serialization_middleware, load_codec, JSON_CODECS
+
+DEFAULT_DOCUMENTS = 100_000
+
+
+def make_data(count: int) -> dict:
+    now = datetime.now()
+    due = now + timedelta(days=90)
+    devices = {str(i): {'device_id': i, 'device_name': f'Device{i}', 'managed_by_user_id': f'user{i % 100}@mci.edu',
+                        'is_active': True, '_Device__creation_date': now, '_Device__last_update': now,
+                        '_Device__maintenance_interval': 90, '_Device__maintenance_cost': 10.0, 'end_of_life': None,
+                        'first_maintenance': due, 'next_maintenance': due, '_Device__last_maintenance_date': None}
+               for i in range(1, count + 1)}
+    users = {str(i): {'name': f'User {i}', 'id': f'user{i}@mci.edu'} for i in range(1, count // 10 + 1)}
+    return {'devices': devices, 'users': users}
+
+
+def storages(path: str) -> dict:
+    # Without the BatchMiddleware of the 'middleware' storage, which would answer the read from memory
+    result = {'middleware': create_serialization_middleware()(path)}
+    for codec in JSON_CODECS:
+        try:
+            load_codec(codec)
+        except ImportError:
+            continue
+        result[f'fast ({codec})'] = SchemaJSONStorage(path, codec=codec)
+    return result
+
+
+def run(count: int):
+    data = make_data(count)
+    documents = count + count // 10
+    print(f"{documents} documents")
+    print(f"{'storage':>16} {'write [docs/s]':>15} {'read [docs/s]':>14} {'file [MiB]':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, storage in storages(os.path.join(directory, 'db.json')).items():
+            start = time.perf_counter()
+            storage.write(data)
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = storage.read()
+            read_time = time.perf_counter() - start
+            assert result == data
+
+            size = os.path.getsize(os.path.join(directory, 'db.json')) / 2**20
+            print(f"{name:>16} {documents / write_time:>15.0f} {documents / read_time:>14.0f} {size:>11.1f}")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DOCUMENTS)
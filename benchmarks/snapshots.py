@@ -0,0 +1,106 @@
+"""Cost of full versus incremental snapshots for growing fleets, plus restore and diff checks.
+
+For every fleet size (see benchmarks.fleet) and storage a full snapshot is
+taken, then `CHANGES` devices are changed through the model and an incremental
+snapshot follows. The changed devices are the same at every fleet size, so the
+incremental one has to read and write the same chunks whatever the size of the
+fleet. With the 'fast' storage its time still grows with the fleet: starting
+the new journal rewrites database.json like every write of that storage does.
+
+The checks: the diff of the two snapshots names exactly the changed devices,
+restoring the full snapshot gives back the documents it was taken of, and
+restoring the incremental one the documents after the changes.
+
+Run from the repository root with `python -m benchmarks.snapshots [devices...]`.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import database
+from benchmarks import fleet
+from benchmarks.suite import connect
+from devices import Device
+from serializer import encode_value
+from snapshots import SnapshotStore, _data_tables
+
+DEFAULT_SIZES = (10_000, 100_000)
+STORAGES = ('fast', 'log', 'sqlite')
+CHANGES = 20
+# The changed devices are picked among the first ones, which every fleet size has
+SPREAD = 10_000
+
+
+def contents() -> dict:
+    """Every document of the database, encoded, by table and id"""
+    return {name: {doc_id: encode_value(doc) for doc_id, doc in database.open_table(name).documents()}
+            for name in _data_tables(database.get_database())}
+
+
+def timed(func) -> tuple:
+    start = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def change_devices(devices: int, rng: random.Random) -> set:
+    """Raise the cost of CHANGES random devices and return their document ids"""
+    changed = set()
+    for number in rng.sample(range(min(devices, SPREAD)), CHANGES):
+        device = Device.find_by_attribute('device_name', fleet.device_name(number))
+        device.maintenance_cost = device.maintenance_cost + 1
+        device.store_data()
+        changed.add(Device.db_connector.lookup('device_name', device.device_name)[0])
+    return changed
+
+
+def benchmark(devices: int, storage: str) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        connect(storage, directory)
+        fleet.fill(devices)
+        store = SnapshotStore(os.path.join(directory, 'backups'))
+        before = contents()
+        full_ms, full = timed(store.create)
+
+        changed = change_devices(devices, random.Random(0))
+        after = contents()
+        incremental_ms, incremental = timed(store.create)
+        assert incremental['parent'] == full['id'] and incremental['changed'] == CHANGES, incremental
+        assert incremental['chunks_read'] <= CHANGES, incremental
+
+        diff_ms, differences = timed(lambda: store.diff(full['id'], incremental['id']))
+        assert differences == {'devices': {'added': [], 'removed': [], 'changed': sorted(changed)}}, differences
+
+        restore_ms, _ = timed(lambda: store.restore(full['id']))
+        assert contents() == before, 'restoring the full snapshot changed the data'
+        store.restore(incremental['id'])
+        assert contents() == after, 'restoring the incremental snapshot changed the data'
+        database.close_all()
+    return {'devices': devices, 'storage': storage, 'full_ms': full_ms, 'full_bytes': full['bytes_written'],
+            'incremental_ms': incremental_ms, 'incremental_chunks': incremental['chunks_read'],
+            'incremental_bytes': incremental['bytes_written'], 'diff_ms': diff_ms, 'restore_ms': restore_ms}
+
+
+def run_benchmark(sizes):
+    print(f"{CHANGES} devices changed between a full and an incremental snapshot")
+    print(f"{'devices':>8} {'storage':>7} {'full [ms]':>10} {'full [KB]':>10} {'incr. [ms]':>11} {'chunks':>7} "
+          f"{'incr. [KB]':>11} {'diff [ms]':>10} {'restore [ms]':>13}")
+    results = []
+    for size in sizes:
+        for storage in STORAGES:
+            result = benchmark(size, storage)
+            results.append(result)
+            print(f"{size:>8} {storage:>7} {result['full_ms']:>10.0f} {result['full_bytes'] / 1024:>10.0f} "
+                  f"{result['incremental_ms']:>11.1f} {result['incremental_chunks']:>7} "
+                  f"{result['incremental_bytes'] / 1024:>11.0f} {result['diff_ms']:>10.1f} {result['restore_ms']:>13.0f}")
+
+    # What an incremental snapshot writes depends on the changes, not on the size of the fleet
+    for storage in STORAGES:
+        written = [result['incremental_bytes'] for result in results if result['storage'] == storage]
+        assert max(written) < 1.2 * min(written), f'{storage}: incremental snapshots grew with the fleet {written}'
+
+
+if __name__ == "__main__":
+    run_benchmark([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,118 @@
+"""Cold start of the entry points: import time per module with `-X importtime`, and time to the first answer.
+
+Every entry point runs in fresh interpreters, several times. The table shows
+the wall time of the whole process, the part spent importing (the sum of
+what `-X importtime` reports) and the imports that took longest. The
+database is a small synthetic fleet in a temporary directory (see
+benchmarks.fleet), so the first queries read a real file. Entries whose
+dependencies aren't installed (Streamlit for the UI) are skipped.
+
+The check at the end makes sure that importing the models opens no database
+file, which is what keeps the imports cheap.
+
+Run from the repository root with `python -m benchmarks.startup [runs] [output.json]`.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fleet
+from benchmarks.suite import connect, environment
+
+DEFAULT_RUNS = 5
+DEVICES = 1_000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (entry point, code run by the interpreter)
+ENTRIES = (
+    ('python', 'pass'),
+    ('devices', 'import devices'),
+    ('users', 'import users'),
+    ('queries', 'import queries'),
+    ('import_export', 'import import_export'),
+    ('migrate', 'import migrate'),
+    ('maintenance_schedule', 'import maintenance_schedule'),
+    # The imports of UI.py, the script itself only runs inside Streamlit
+    ('UI imports', 'import streamlit, pandas, config, database, metrics, queries, maintenance_schedule, '
+                   'concurrency, devices, users, reservations, maintenance_events'),
+    ('first lookup', "from devices import Device; Device.find_by_attribute('device_name', 'Laptop-0000000')"),
+    ('first find_all', 'from devices import Device; Device.find_all()'),
+    ('first find_devices', 'import queries; queries.find_devices()'),
+)
+
+
+def run_once(code: str, env: dict) -> tuple:
+    """(wall seconds, import seconds, {module: self seconds}) of one fresh interpreter, None if it failed"""
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        return None, process.stderr.strip().splitlines()[-1]
+    modules = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us) / 1e6
+    return (wall, sum(modules.values()), modules), None
+
+
+def measure(code: str, env: dict, runs: int) -> dict:
+    results = []
+    for _ in range(runs):
+        result, error = run_once(code, env)
+        if result is None:
+            return {'skipped': error}
+        results.append(result)
+    walls = [wall for wall, _, _ in results]
+    imports = [imported for _, imported, _ in results]
+    # Slowest imports of the median run
+    _, _, modules = sorted(results, key=lambda result: result[0])[len(results) // 2]
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:3]
+    return {'runs': runs, 'wall_ms': statistics.median(walls) * 1000, 'wall_min_ms': min(walls) * 1000,
+            'import_ms': statistics.median(imports) * 1000, 'modules': len(modules),
+            'slowest': [[name, seconds * 1000] for name, seconds in slowest]}
+
+
+def opens_no_database(env: dict, directory: str) -> None:
+    for backend, path in (('tinydb', 'untouched.json'), ('sqlite', 'untouched.sqlite3')):
+        path = os.path.join(directory, path)
+        subprocess.run([sys.executable, '-c', 'import devices, users, reservations, maintenance_events, queries'],
+                       cwd=ROOT, check=True,
+                       env={**env, 'DEVICE_DB_BACKEND': backend, 'DEVICE_DB_JSON_PATH': path, 'DEVICE_DB_SQLITE_PATH': path})
+        assert not os.path.exists(path), f'importing the models created {path}'
+
+
+def run(runs: int, output: str = None):
+    with tempfile.TemporaryDirectory() as directory:
+        connect('fast', directory)
+        fleet.fill(DEVICES)
+        env = {**os.environ, 'DEVICE_DB_BACKEND': 'tinydb', 'DEVICE_DB_JSON_STORAGE': 'fast',
+               'DEVICE_DB_JSON_PATH': os.path.join(directory, 'database.json')}
+
+        print(f"{runs} fresh interpreters per entry, database with {DEVICES} devices")
+        print(f"{'entry':>20} {'wall [ms]':>10} {'imports [ms]':>13} {'modules':>8}  slowest imports [ms]")
+        results = []
+        for name, code in ENTRIES:
+            result = {'entry': name, **measure(code, env, runs)}
+            results.append(result)
+            if 'skipped' in result:
+                print(f"{name:>20} skipped: {result['skipped']}")
+                continue
+            slowest = ', '.join(f'{module} {ms:.1f}' for module, ms in result['slowest'])
+            print(f"{name:>20} {result['wall_ms']:>10.1f} {result['import_ms']:>13.1f} {result['modules']:>8}  {slowest}")
+        opens_no_database(env, directory)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump({'environment': environment(0, runs), 'results': results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,251 @@
+"""Benchmark suite of the core model paths on synthetic fleets, with JSON results to compare commits.
+
+For every fleet size and storage a fresh database is filled by
+`benchmarks.fleet` and opened again, then every case is timed `--repeat`
+times: opening the database, device upserts, lookups, loading all devices
+and users, `queries.find_devices` and the data preparation of the UI tabs.
+Cases marked cold run right after a write, like a rerun of the UI after an
+edit, so they can't answer from the read cache.
+
+The results are printed and, with `--output`, written as JSON together with
+the commit they were measured on. `--compare` reads such a file and shows
+the change of the best run of every case; it exits with 1 if a case got
+slower than `--tolerance` allows, so it can guard a commit. Cases of a few
+microseconds vary by some ten percent from run to run on a busy machine.
+
+Run from the repository root with
+`python -m benchmarks.suite [--scales 1k 100k 1m] [--storages fast log sqlite] [--output new.json] [--compare old.json]`.
+The 1m fleet takes a few minutes per storage and some GB of memory with the JSON storages.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import config
+import database
+import maintenance_schedule
+import queries
+from benchmarks import fleet
+from devices import Device
+from maintenance_events import MaintenanceEvent
+from reservations import Reservation
+from users import User
+
+STORAGES = ('fast', 'log', 'sqlite')
+LOOKUPS = 200
+UPSERTS = 20
+PAGE_SIZE = 50
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.2
+TABLES = ('users', 'devices', 'reservations', 'maintenance_events', 'maintenance_rollups')
+
+
+def connect(storage: str, directory: str) -> None:
+    """Point the shared database and all models at the database files of `storage` in `directory`"""
+    config.DB_BACKEND = 'sqlite' if storage == 'sqlite' else 'tinydb'
+    if storage != 'sqlite':
+        config.JSON_STORAGE = storage
+    config.JSON_PATH = os.path.join(directory, 'database.json')
+    config.SQLITE_PATH = os.path.join(directory, 'database.sqlite3')
+    # The tables of the models (database.LazyTable) open the new files on next use
+    database.close_all()
+    Device.upcoming_maintenance.invalidate()
+    Reservation.index.invalidate()
+    MaintenanceEvent.index.invalidate()
+
+
+def open_database(storage: str, directory: str) -> None:
+    # What a fresh process does before it can answer: open the files and read every table once
+    connect(storage, directory)
+    for name in TABLES:
+        len(database.open_table(name))
+
+
+def touch() -> None:
+    """Store one device and one user, so the next reads can't be answered from the read cache"""
+    Device.find_by_attribute('device_name', fleet.device_name(0)).store_data()
+    User.find_by_attribute('id', fleet.user_id(0)).store_data()
+
+
+def device_page_rows() -> pd.DataFrame:
+    # Like load_device_page and the device table of UI.py
+    devices, total = Device.find_page(0, PAGE_SIZE, is_active=True)
+    return pd.DataFrame([{"Name": d.device_name, "Verantwortlich": d.managed_by_user_id,
+                          "Status": "Aktiv" if d.is_active else "Inaktiv"} for d in devices])
+
+
+def reservation_rows() -> pd.DataFrame:
+    # Like load_reservations of UI.py
+    return pd.DataFrame([{"Gerät": r.device_name, "Reserviert von": r.user_id,
+                          "Start": r.start_date.strftime("%d.%m.%Y %H:%M"), "Ende": r.end_date.strftime("%d.%m.%Y %H:%M"),
+                          "Grund": r.reason}
+                         for r in sorted(Reservation.find_all(), key=lambda r: r.start_date)])
+
+
+def cost_history_rows() -> pd.DataFrame:
+    # Like load_cost_history of UI.py
+    return pd.DataFrame([{"Zeitraum": key, "Wartungen": totals["count"], "Kosten (€)": round(totals["cost"], 2)}
+                         for key, totals in MaintenanceEvent.totals_by('month').items()])
+
+
+def cases(storage: str, directory: str, devices: int, rng: random.Random) -> list:
+    """(name, setup, run, calls per run) of every timed case"""
+    names = [fleet.device_name(rng.randrange(devices)) for _ in range(LOOKUPS)]
+    # Owners among the first tenth of the users, who manage most devices
+    users = fleet.fleet_sizes(devices)['users']
+    owners = [fleet.user_id(rng.randrange(max(1, users // 10))) for _ in range(LOOKUPS)]
+    loaded = []
+    inserted = iter(range(sys.maxsize))
+
+    def load_for_update():
+        loaded[:] = [Device.find_by_attribute('device_name', name) for name in names[:UPSERTS]]
+        for device in loaded:
+            device.maintenance_cost = device.maintenance_cost + 1
+
+    def update():
+        for device in loaded:
+            device.store_data()
+
+    def insert():
+        for _ in range(UPSERTS):
+            number = next(inserted)
+            Device(devices + number, f'Benchmark-{number:07d}', fleet.user_id(0)).store_data()
+
+    return [
+        ('database.open', None, lambda: open_database(storage, directory), 1),
+        ('Device.store_data update', load_for_update, update, UPSERTS),
+        ('Device.store_data insert', None, insert, UPSERTS),
+        ('Device.find_by_attribute name', None,
+         lambda: [Device.find_by_attribute('device_name', name) for name in names], LOOKUPS),
+        ('Device.find_by_attribute owner', None,
+         lambda: [Device.find_by_attribute('managed_by_user_id', owner, num_to_return=10) for owner in owners], LOOKUPS),
+        ('Device.find_due owner', None,
+         lambda: [Device.find_due(30, owner, limit=10, now=fleet.NOW) for owner in owners[:UPSERTS]], UPSERTS),
+        ('Device.find_all cold', touch, Device.find_all, 1),
+        ('Device.find_all warm', None, Device.find_all, 1),
+        ('User.find_all cold', touch, User.find_all, 1),
+        ('queries.find_devices cold', touch, queries.find_devices, 1),
+        ('ui.device_page cold', touch, device_page_rows, 1),
+        ('ui.schedule cold', touch, maintenance_schedule.fleet_schedule, 1),
+        ('ui.reservations', None, reservation_rows, 1),
+        ('ui.cost_history', None, cost_history_rows, 1),
+    ]
+
+
+def measure(setup, run, calls: int, repeat: int) -> dict:
+    """Milliseconds per call of `run`, over `repeat` runs each after a fresh `setup`"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000 / calls)
+    return {'calls': calls, 'repeat': repeat, 'min_ms': min(times), 'median_ms': statistics.median(times),
+            'max_ms': max(times)}
+
+
+def benchmark_fleet(scale: str, storage: str, seed: int, repeat: int) -> tuple:
+    """(fleet description, results) of one fleet size on one storage"""
+    devices = fleet.SCALES[scale]
+    with tempfile.TemporaryDirectory() as directory:
+        connect(storage, directory)
+        start = time.perf_counter()
+        sizes = fleet.fill(devices, seed)
+        fill_seconds = time.perf_counter() - start
+        database.close_all()
+        file_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        description = {'scale': scale, 'storage': storage, 'documents': sizes, 'fill_s': fill_seconds,
+                       'file_bytes': file_bytes}
+
+        results = []
+        open_database(storage, directory)
+        for name, setup, run, calls in cases(storage, directory, devices, random.Random(seed)):
+            result = {'scale': scale, 'storage': storage, 'case': name, **measure(setup, run, calls, repeat)}
+            results.append(result)
+            print(f"{scale:>5} {storage:>7} {name:>32} {result['median_ms']:>12.3f} {result['min_ms']:>12.3f}")
+        database.close_all()
+    return description, results
+
+
+def environment(seed: int, repeat: int) -> dict:
+    """Where the results were measured: commit, interpreter and machine"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    commit, dirty = None, None
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    return {'commit': commit, 'dirty': dirty, 'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'seed': seed, 'repeat': repeat}
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """Print the change of every case measured in both runs, and return the cases slower than `tolerance` allows"""
+    before = {(r['scale'], r['storage'], r['case']): r for r in baseline['results']}
+    print(f"\ncompared with {baseline['environment'].get('commit') or 'unknown commit'}")
+    print(f"{'scale':>5} {'storage':>7} {'case':>32} {'min before':>12} {'min now':>12} {'change':>8}")
+    slower = []
+    for result in results:
+        old = before.get((result['scale'], result['storage'], result['case']))
+        if old is None:
+            continue
+        # The best run is the least disturbed by the rest of the machine, like timeit reports it
+        change = result['min_ms'] / old['min_ms'] - 1 if old['min_ms'] else 0.0
+        flag = ''
+        if change > tolerance:
+            slower.append(result)
+            flag = ' slower'
+        print(f"{result['scale']:>5} {result['storage']:>7} {result['case']:>32} {old['min_ms']:>12.3f} "
+              f"{result['min_ms']:>12.3f} {change:>+8.0%}{flag}")
+    return slower
+
+
+def run(scales, storages, seed: int, repeat: int, output: str = None, baseline: str = None,
+        tolerance: float = DEFAULT_TOLERANCE) -> int:
+    report = {'environment': environment(seed, repeat), 'fleets': [], 'results': []}
+    print(f"{'scale':>5} {'storage':>7} {'case':>32} {'median [ms]':>12} {'min [ms]':>12}")
+    for scale in scales:
+        for storage in storages:
+            description, results = benchmark_fleet(scale, storage, seed, repeat)
+            report['fleets'].append(description)
+            report['results'].extend(results)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if baseline:
+        with open(baseline, encoding='utf-8') as file:
+            slower = compare(report['results'], json.load(file), tolerance)
+        if slower:
+            print(f"{len(slower)} case(s) more than {tolerance:.0%} slower")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', nargs='+', choices=fleet.SCALES, default=['1k'])
+    parser.add_argument('--storages', nargs='+', choices=STORAGES, default=list(STORAGES))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown of the best run before a case counts as slower (0.2 = 20%%)')
+    arguments = parser.parse_args()
+    sys.exit(run(arguments.scales, arguments.storages, arguments.seed, arguments.repeat, arguments.output,
+                 arguments.compare, arguments.tolerance))
@@ -0,0 +1,69 @@
+"""Time the data preparation of the device table: the whole table versus one filtered page.
+
+Measures what a Streamlit rerun of the "Geräte" tab costs before rendering:
+loading the rows and building the DataFrame that is sent to the browser.
+Run from the repository root with `python -m benchmarks.ui_pages`.
+"""
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from database import INDEXES
+from index import IndexedTinyDB
+from serializer import create_serializer
+from sqlite_storage import SQLiteDatabase
+from devices import Device
+
+ROWS = 100_000
+PAGE_SIZE = 50
+
+
+def fill(table):
+    table.insert_multiple(
+        {'device_id': i, 'device_name': f'Device{i:06d}', 'managed_by_user_id': f'user{i % 500}@mci.edu',
+         'is_active': i % 10 != 0}
+        for i in range(ROWS)
+    )
+
+
+def to_frame(devices) -> pd.DataFrame:
+    return pd.DataFrame([{"Name": d.device_name, "Verantwortlich": d.managed_by_user_id,
+                          "Status": "Aktiv" if d.is_active else "Inaktiv"} for d in devices])
+
+
+def timed(func) -> tuple:
+    start = time.perf_counter()
+    frame = func()
+    return (time.perf_counter() - start) * 1000, frame.memory_usage(deep=True).sum() / 1024
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        tables = {
+            'tinydb': IndexedTinyDB(os.path.join(directory, 'db.json'), storage=create_serializer()).table(
+                'devices', indexes=INDEXES['devices']),
+            'sqlite': SQLiteDatabase(os.path.join(directory, 'db.sqlite3')).table('devices', indexes=INDEXES['devices']),
+        }
+        cases = {
+            'all rows': lambda: to_frame(Device.find_all()),
+            'page 1': lambda: to_frame(Device.find_page(0, PAGE_SIZE)[0]),
+            'page 1000': lambda: to_frame(Device.find_page(999 * PAGE_SIZE, PAGE_SIZE)[0]),
+            'user filter': lambda: to_frame(Device.find_page(0, PAGE_SIZE, managed_by_user_id='user7@mci.edu')[0]),
+            'name prefix': lambda: to_frame(Device.find_page(0, PAGE_SIZE, name_prefix='Device0421')[0]),
+            'inactive': lambda: to_frame(Device.find_page(0, PAGE_SIZE, is_active=False)[0]),
+        }
+
+        print(f"{ROWS} devices, page size {PAGE_SIZE}")
+        print(f"{'backend':>8} {'case':>12} {'time [ms]':>10} {'frame [KiB]':>12}")
+        for backend, table in tables.items():
+            fill(table)
+            Device.db_connector = table
+            for case, func in cases.items():
+                elapsed, size = timed(func)
+                print(f"{backend:>8} {case:>12} {elapsed:>10.1f} {size:>12.1f}")
+
+
+if __name__ == "__main__":
+    run()
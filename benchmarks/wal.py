@@ -0,0 +1,109 @@
+"""Single-record write throughput of the whole-file JSON storage versus the append-only LogStorage, plus a crash-recovery check.
+
+The recovery check kills a writing process at random points (while appending
+and while compacting), reopens the database and verifies that every write the
+process had finished is there and the data can still be written.
+
+Run from the repository root with `python -m benchmarks.wal [sizes...]`.
+"""
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from index import IndexedTinyDB
+from serializer import create_serializer
+
+DEFAULT_SIZES = (1_000, 10_000, 50_000)
+WRITES = 200
+CRASHES = 5
+
+
+def device(i: int) -> dict:
+    return {'device_id': i, 'device_name': f'Device{i}', 'managed_by_user_id': f'user{i % 100}@mci.edu',
+            'is_active': True, '_Device__maintenance_interval': 90, '_Device__maintenance_cost': 10.0}
+
+
+def open_devices(path: str, storage: str, **kwargs):
+    database = IndexedTinyDB(path, storage=create_serializer(storage), **kwargs)
+    return database, database.table('devices', indexes=('device_name',))
+
+
+def writes_per_second(directory: str, storage: str, size: int) -> float:
+    path = os.path.join(directory, f'{storage}-{size}.json')
+    database, table = open_devices(path, storage)
+    with table.storage.batch():
+        table.insert_multiple(device(i) for i in range(size))
+
+    start = time.perf_counter()
+    for i in range(WRITES):
+        doc_id = table.lookup('device_name', f'Device{i}')[0]
+        table.update({'is_active': False}, doc_ids=[doc_id])
+    elapsed = time.perf_counter() - start
+    database.close()
+    return WRITES / elapsed
+
+
+def run_benchmark(sizes):
+    print(f"{WRITES} single-record updates")
+    print(f"{'devices':>8} {'json [writes/s]':>16} {'log [writes/s]':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            json_rate = writes_per_second(directory, 'fast', size)
+            log_rate = writes_per_second(directory, 'log', size)
+            print(f"{size:>8} {json_rate:>16.0f} {log_rate:>15.0f}")
+
+
+def _writer(path: str, connection):
+    # Writes until killed, reporting every write that returned
+    database, table = open_devices(path, 'log')
+    table.storage._compact_bytes = 16 * 1024
+    i = 0
+    while True:
+        i += 1
+        table.insert(device(i))
+        if i % 3 == 0:
+            table.remove(doc_ids=table.lookup('device_name', f'Device{i - 1}'))
+        connection.send(i)
+
+
+def check_recovery():
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'db.json')
+        for crash in range(1, CRASHES + 1):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_writer, args=(path, sender))
+            process.start()
+            acknowledged = 0
+            deadline = time.monotonic() + 0.2 * crash
+            while time.monotonic() < deadline:
+                if receiver.poll(0.01):
+                    acknowledged = receiver.recv()
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+            # Writes sent before the kill count as acknowledged as well
+            while receiver.poll():
+                acknowledged = receiver.recv()
+
+            database, table = open_devices(path, 'log')
+            names = {doc['device_name'] for doc in table}
+            for i in range(1, acknowledged + 1):
+                expected = not (i % 3 == 2 and i + 1 <= acknowledged)
+                assert (f'Device{i}' in names) == expected or i == acknowledged, f'Device{i} after crash {crash}'
+            table.insert(device(0))
+            table.remove(doc_ids=table.lookup('device_name', 'Device0'))
+            database.close()
+            print(f"crash {crash}: {acknowledged} acknowledged writes recovered")
+            # The next writer starts counting from 1 again
+            os.remove(path)
+            for suffix in ('.log', '.log.compacting'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    check_recovery()
+    run_benchmark([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
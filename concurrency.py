@@ -0,0 +1,117 @@
+"""Locking and optimistic versioning for several processes sharing one database.
+
+Readers hold a shared and writers an exclusive `flock` on `<database>.lock`
+for the whole read-modify-write, so no write is built on data another process
+is replacing at the same time. On top of that every stored document carries a
+version number: a model object remembers the version it was loaded with and
+its write is refused with `StaleVersionError` if the stored document has moved
+on since, instead of silently overwriting the other change.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the threads of one process are locked out from each other
+    fcntl = None
+
+# Stored field counting the writes of a document
+VERSION_FIELD = 'version'
+
+SHARED = 'shared'
+EXCLUSIVE = 'exclusive'
+
+
+class StaleVersionError(ValueError):
+    """The document was changed (or removed) by someone else since it was loaded"""
+
+
+class FileLock:
+    """Shared/exclusive lock on `<path>.lock` between processes, reentrant within a process.
+
+    `flock` locks belong to the open file and not to a thread, so the threads
+    of this process take turns through an RLock in addition. An exclusive lock
+    requested while holding a shared one upgrades it until the inner block ends.
+    Without a path (in-memory storages) or without fcntl only the RLock is used.
+    """
+
+    def __init__(self, path: str = None):
+        self._path = None if path is None else path + '.lock'
+        self._thread_lock = threading.RLock()
+        self._handle = None
+        self._mode = None
+
+    def shared(self):
+        return self._hold(SHARED)
+
+    def exclusive(self):
+        return self._hold(EXCLUSIVE)
+
+    @contextmanager
+    def _hold(self, mode):
+        with self._thread_lock:
+            previous = self._mode
+            if previous is None or (mode == EXCLUSIVE and previous == SHARED):
+                self._lock_file(mode)
+                self._mode = mode
+            try:
+                yield
+            finally:
+                if previous is None:
+                    self._unlock_file()
+                    self._mode = None
+                elif previous != self._mode:
+                    # Back from an upgrade
+                    self._lock_file(previous)
+                    self._mode = previous
+
+    def _lock_file(self, mode):
+        handle = self._open()
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_SH if mode == SHARED else fcntl.LOCK_EX)
+
+    def _unlock_file(self):
+        if self._handle is not None:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+
+    def _open(self):
+        if self._handle is None and self._path is not None and fcntl is not None:
+            try:
+                self._handle = open(self._path, 'a+b')
+            except OSError:
+                # E.g. a read-only directory, nobody can write there anyway
+                self._path = None
+        return self._handle
+
+
+def try_lock(handle) -> bool:
+    """Lock an open file exclusively if nobody else holds it, without waiting"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def file_token(path: str):
+    """(inode, mtime, size) of a file, changes whenever the file is written or replaced. None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except (TypeError, FileNotFoundError):
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def next_version(table_name: str, doc_id, doc, version=None) -> int:
+    """Return the version a write of `doc` gets, if it was loaded with `version` (None writes unconditionally)"""
+    if doc is None:
+        raise StaleVersionError(f"Dokument {doc_id} in '{table_name}' wurde inzwischen gelöscht")
+    stored = doc.get(VERSION_FIELD, 0)
+    if version is not None and stored != version:
+        raise StaleVersionError(
+            f"Dokument {doc_id} in '{table_name}' wurde inzwischen geändert (Version {stored} statt {version})")
+    return stored + 1
@@ -0,0 +1,37 @@
+import os
+
+# Directory of this file, the database files live next to the code by default
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Storage backend used by the models: 'tinydb' (database.json) or 'sqlite'
+DB_BACKEND = os.environ.get('DEVICE_DB_BACKEND', 'tinydb')
+
+JSON_PATH = os.environ.get('DEVICE_DB_JSON_PATH', os.path.join(BASE_DIR, 'database.json'))
+SQLITE_PATH = os.environ.get('DEVICE_DB_SQLITE_PATH', os.path.join(BASE_DIR, 'database.sqlite3'))
+
+# How database.json is (de)serialized: 'fast' (SchemaJSONStorage), 'middleware' (tinydb_serialization)
+# or 'log' (snapshot plus append-only log of changed records, see wal.py)
+JSON_STORAGE = os.environ.get('DEVICE_DB_JSON_STORAGE', 'fast')
+# JSON codec of the fast storage: 'orjson', 'ujson' or 'json', unset picks the fastest installed one
+JSON_CODEC = os.environ.get('DEVICE_DB_JSON_CODEC') or None
+# The log is compacted into the snapshot once it is larger than this and than the snapshot itself
+LOG_COMPACT_BYTES = int(os.environ.get('DEVICE_DB_LOG_COMPACT_BYTES', 4 * 1024 * 1024))
+
+# Directory of the snapshots and incremental backups (see snapshots.py)
+BACKUP_DIR = os.environ.get('DEVICE_DB_BACKUP_DIR', os.path.join(BASE_DIR, 'backups'))
+
+# Worker threads running the blocking database calls of the async model methods, and how many
+# calls may be waiting for them at once per event loop
+ASYNC_WORKERS = int(os.environ.get('DEVICE_DB_ASYNC_WORKERS', 4))
+ASYNC_MAX_PENDING = int(os.environ.get('DEVICE_DB_ASYNC_MAX_PENDING', 256))
+
+# Rows of a CSV/JSONL import that are validated and stored together in one write batch
+IMPORT_CHUNK_SIZE = int(os.environ.get('DEVICE_DB_IMPORT_CHUNK_SIZE', 1000))
+
+# Record latency, rows, bytes and cache hits of the database operations (see metrics.py). Can also be
+# switched on at runtime in the debug panel of the UI
+METRICS = os.environ.get('DEVICE_DB_METRICS', '').lower() in ('1', 'true', 'yes')
+# Serve the metrics as Prometheus text on http://127.0.0.1:<port>/metrics, unset serves nothing
+METRICS_PORT = int(os.environ['DEVICE_DB_METRICS_PORT']) if os.environ.get('DEVICE_DB_METRICS_PORT') else None
+# Level of the log messages the UI and the command line tools show, e.g. 'DEBUG' for every database write
+LOG_LEVEL = os.environ.get('DEVICE_DB_LOG_LEVEL', 'WARNING').upper()
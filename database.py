@@ -0,0 +1,148 @@
+import threading
+from abc import ABC, abstractmethod
+
+import config
+import metrics
+from index import IndexedTinyDB
+from serializer import create_serializer
+
+# Indexed fields per table, used by both backends
+INDEXES = {
+    'devices': ('device_name', 'device_id', 'managed_by_user_id'),
+    'users': ('id',),
+    'reservations': ('reservation_id', 'device_name', 'user_id'),
+    'maintenance_events': ('event_id', 'device_name', 'managed_by_user_id'),
+    'maintenance_rollups': ('rollup_key', 'scope'),
+}
+
+# One open database per backend, shared by all models of the process
+_databases = {}
+_databases_lock = threading.Lock()
+
+# (backend, table name) -> (data version, documents)
+_read_cache = {}
+# Counts close_all calls, tables opened before the last one are closed
+_generation = 0
+
+
+def get_database(backend: str = None):
+    """Return the process-wide database of the configured storage backend ('tinydb' or 'sqlite')"""
+    backend = backend or config.DB_BACKEND
+    with _databases_lock:
+        if backend not in _databases:
+            _databases[backend] = _connect(backend)
+        return _databases[backend]
+
+
+def open_table(name: str, backend: str = None):
+    """Return a table of the shared database, with the indexes configured for it"""
+    return get_database(backend).table(name, indexes=INDEXES.get(name, ()))
+
+
+class LazyTable:
+    """Class attribute holding a table of the shared database, opened on first access instead of at import.
+
+    Importing a model therefore doesn't open (or create) any database file,
+    and the configuration can still be changed up to the first query. After
+    `close_all` the table is opened again from the current configuration.
+    Assigning another table to the attribute replaces it, e.g. in benchmarks.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # (generation, table) of the last open
+        self._opened = None
+
+    def __get__(self, instance, owner):
+        opened = self._opened
+        if opened is None or opened[0] != _generation:
+            opened = self._opened = (_generation, open_table(self.name))
+        return opened[1]
+
+
+class LazyIndex(ABC):
+    """Base of the in-memory indexes of the models, built from the stored documents on first use.
+
+    Subclasses build their structures in `_build`, drop them in `_clear` and
+    keep them up to date with the writes of this process. The index is built
+    again when `version` changes, i.e. someone else changed the stored
+    documents, or after `invalidate()`.
+    """
+
+    def __init__(self, loader=None, version=None):
+        # loader returns the documents to build the index from on first use,
+        # version a token that changes when someone else changed them
+        self._loader = loader
+        self._version = version
+        self._loaded_version = None
+        self._lock = threading.RLock()
+
+    @property
+    @abstractmethod
+    def loaded(self) -> bool:
+        """Whether the index is built"""
+
+    def load(self, documents) -> None:
+        """(Re)build the index from `documents`"""
+        with self._lock:
+            self._build(documents)
+
+    def invalidate(self) -> None:
+        """Forget the index, it is built again from the loader on the next query"""
+        with self._lock:
+            self._clear()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            version = self._version() if self._version else None
+            if self.loaded and version == self._loaded_version:
+                return
+            self._loaded_version = version
+            self.load(self._loader() if self._loader else ())
+
+    @abstractmethod
+    def _build(self, documents):
+        """Build the index from `documents`, called under the lock"""
+
+    @abstractmethod
+    def _clear(self):
+        """Drop the index, called under the lock"""
+
+
+def cached_all(table) -> list:
+    """Return all documents of `table`, only reading the storage again if the data changed since the last call.
+
+    The returned documents are shared between callers and must not be modified.
+    """
+    key = (id(table.storage), table.name)
+    version = table.storage.version()
+    entry = _read_cache.get(key)
+    hit = entry is not None and entry[0] == version
+    if metrics.registry.enabled:
+        metrics.registry.cache('cached_all', table.name, hit)
+    if hit:
+        return entry[1]
+    documents = table.all()
+    _read_cache[key] = (version, documents)
+    return documents
+
+
+def close_all() -> None:
+    """Close all shared databases, e.g. before the database files are replaced"""
+    global _generation
+    with _databases_lock:
+        for database in _databases.values():
+            database.close()
+        _databases.clear()
+        _read_cache.clear()
+        _generation += 1
+
+
+def _connect(backend: str):
+    if backend == 'sqlite':
+        # Imported here so the TinyDB setup doesn't need the sqlite module
+        from sqlite_storage import SQLiteDatabase
+        return SQLiteDatabase(config.SQLITE_PATH)
+    if backend == 'tinydb':
+        return IndexedTinyDB(config.JSON_PATH, storage=create_serializer())
+    raise ValueError(f"Unknown database backend '{backend}'")
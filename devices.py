@@ -0,0 +1,335 @@
+import logging
+import math
+from datetime import datetime, timedelta
+from database import LazyTable, cached_all
+from metrics import instrument
+from query_planner import Select
+from storage import on_commit, on_rollback, write_batch
+from concurrency import VERSION_FIELD
+from maintenance_queue import MaintenanceQueue
+from maintenance_events import MaintenanceEvent
+import async_api
+
+logger = logging.getLogger(__name__)
+
+# Creation date of records stored before it was, if they have no last update either. Fixed, so the
+# maintenance scheduled from it stays the same on every load instead of moving with the time of the load
+LEGACY_CREATION_DATE = datetime(2024, 1, 1)
+
+
+class Device():
+    # Fixed attributes instead of a per-instance __dict__, keeps large result sets small
+    __slots__ = ('device_id', 'device_name', 'managed_by_user_id', 'is_active', '__creation_date', '__last_update',
+                 '__maintenance_interval', '__maintenance_cost', 'end_of_life', 'first_maintenance',
+                 'next_maintenance', '__last_maintenance_date', 'version', 'unsaved_maintenance')
+    # Keys of a stored device, the private attributes are stored under their mangled names
+    stored_fields = ('device_id', 'device_name', 'managed_by_user_id', 'is_active', '_Device__creation_date',
+                     '_Device__last_update', '_Device__maintenance_interval', '_Device__maintenance_cost',
+                     'end_of_life', 'first_maintenance', 'next_maintenance', '_Device__last_maintenance_date')
+
+    # Class variable that is shared between all instances of the class, opened on first use
+    db_connector = LazyTable('devices')
+    # Stored devices ordered by next maintenance, built from the database on first use
+    upcoming_maintenance = MaintenanceQueue(lambda: cached_all(Device.db_connector),
+                                            lambda: Device.db_connector.storage.external_version())
+    # Writes of the async methods, stored together when they arrive at the same time
+    async_writes = async_api.WriteCoalescer(lambda writes: Device.run_batch(writes))
+    # Constructor
+    def __init__(self, device_id: int, device_name: str, managed_by_user_id: str):
+        self.device_id = device_id
+        self.device_name = device_name
+        self.managed_by_user_id = managed_by_user_id
+        self.is_active = True
+        self.__creation_date = datetime.now()
+        self.__last_update = datetime.now()
+        self.__maintenance_interval = 90
+        self.__maintenance_cost = 0.0
+        self.end_of_life = None
+        self.first_maintenance = self.__creation_date + timedelta(days=self.__maintenance_interval)
+        self.next_maintenance = self.__creation_date + timedelta(days=self.__maintenance_interval)
+        self.__last_maintenance_date = None
+        # Version of the stored document this object was loaded from, None if it wasn't loaded
+        self.version = None
+        # Maintenances recorded by complete_maintenance, added to the history by the next store_data
+        self.unsaved_maintenance = []
+        
+    def creation_date(self):
+        return self.__creation_date
+    
+
+    def last_update(self):
+        return self.__last_update
+    
+    def maintenance_interval(self):
+        return self.__maintenance_interval
+    
+    def maintenance_interval(self, days: int):
+        if days < 1:
+            raise ValueError("Wartungsintervall muss mindestens 1 Tag sein")
+        self.__maintenance_interval = days
+        if self.__last_maintenance_date:
+            self.next_maintenance = self.__last_maintenance_date + timedelta(days=days)
+        else:
+            self.next_maintenance = self.__creation_date + timedelta(days=days)
+        self.__last_update = datetime.now()
+    
+    @property
+    def maintenance_cost(self):
+        return self.__maintenance_cost
+    
+    @maintenance_cost.setter
+    def maintenance_cost(self, cost: float):
+        if not math.isfinite(cost):
+            raise ValueError("Wartungskosten müssen eine endliche Zahl sein")
+        if cost < 0:
+            raise ValueError("Wartungskosten können nicht negativ sein")
+        self.__maintenance_cost = cost
+        self.__last_update = datetime.now()
+    
+    @property
+    def last_maintenance_date(self):
+        return self.__last_maintenance_date
+    
+    # String representation of the class
+    def __str__(self):
+        return f'Device (Object) {self.device_name} ({self.managed_by_user_id})'
+
+    # String representation of the class
+    def __repr__(self):
+        return self.__str__()
+    
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.stored_fields}
+
+    @instrument('Device.store_data')
+    def store_data(self):
+        """Save the device. Raises StaleVersionError if it was loaded and someone else changed it since"""
+        logger.debug("Storing device %s", self.device_name)
+        # Lookup and write as one step, so no other process writes in between
+        with write_batch(self.db_connector):
+            # The version only counts once the outermost batch is written, it is put back if that fails
+            version = self.version
+            on_rollback(lambda: setattr(self, 'version', version))
+            # Check if the device already exists in the database
+            doc_ids = self.db_connector.lookup('device_name', self.device_name)
+            if doc_ids:
+                # Update the existing record with the current instance's data
+                self.version = self.db_connector.update_versioned(self.to_dict(), doc_ids[0], self.version)
+                logger.debug("Device %s updated", self.device_name)
+            else:
+                # If the device doesn't exist, insert a new record
+                self.db_connector.insert({**self.to_dict(), VERSION_FIELD: 1})
+                self.version = 1
+                logger.debug("Device %s inserted", self.device_name)
+            if self.unsaved_maintenance:
+                # Only gone from the list once the outermost batch is written, so a failed one loses nothing
+                events, self.unsaved_maintenance = self.unsaved_maintenance, []
+                on_rollback(lambda: setattr(self, 'unsaved_maintenance', events + self.unsaved_maintenance))
+                MaintenanceEvent.store_many(events)
+            # The queue only sees the stored state, inactive devices aren't due like in find_due
+            next_maintenance = self.next_maintenance if self.is_active is not False else None
+            on_commit(lambda: self.upcoming_maintenance.update(self.device_name, next_maintenance))
+    
+    @classmethod
+    @instrument('Device.store_many')
+    def store_many(cls, devices) -> None:
+        """Store all given devices with a single write of the database file"""
+        cls.run_batch([device.store_data for device in devices])
+
+    @classmethod
+    def run_batch(cls, writes) -> list:
+        """Call all `writes` (store_data/delete of devices) as one write batch and return their results"""
+        with write_batch(cls.db_connector):
+            return [write() for write in writes]
+
+    async def astore_data(self):
+        """Like store_data, without blocking the event loop"""
+        await self.async_writes.submit(self.store_data)
+
+    async def adelete(self):
+        """Like delete, without blocking the event loop"""
+        await self.async_writes.submit(self.delete)
+
+    @classmethod
+    async def astore_many(cls, devices) -> None:
+        """Like store_many, without blocking the event loop"""
+        await cls.async_writes.submit_many([device.store_data for device in devices])
+
+    @instrument('Device.delete')
+    def delete(self):
+        logger.debug("Deleting device %s", self.device_name)
+        # Check if the device exists in the database
+        doc_ids = self.db_connector.lookup('device_name', self.device_name)
+        if doc_ids:
+            # Delete the record from the database
+            self.db_connector.remove(doc_ids=[doc_ids[0]])
+            on_commit(lambda: self.upcoming_maintenance.remove(self.device_name))
+            logger.debug("Device %s deleted", self.device_name)
+        else:
+            logger.warning("Device %s not found, nothing deleted", self.device_name)
+
+    def set_managed_by_user_id(self, managed_by_user_id: str):
+        """Expects `managed_by_user_id` to be a valid user id that exists in the database."""
+        self.managed_by_user_id = managed_by_user_id
+        self.__last_update = datetime.now()
+    
+    def complete_maintenance(self, date: datetime = None, cost: float = None, notes: str = "", event_id: str = None):
+        """Record a maintenance done at `date` (now if not given) that cost `cost` (the maintenance cost if not given).
+
+        The next maintenance is scheduled from the latest one recorded, a
+        maintenance added afterwards for an earlier date only goes to the history.
+        `event_id` identifies the maintenance in the history, a new one if not given.
+        """
+        date = date or datetime.now()
+        self.unsaved_maintenance.append(MaintenanceEvent(
+            self.device_name, self.managed_by_user_id, date, self.__maintenance_cost if cost is None else cost, notes,
+            event_id=event_id))
+        if self.__last_maintenance_date is None or date >= self.__last_maintenance_date:
+            self.__last_maintenance_date = date
+            self.next_maintenance = self.__last_maintenance_date + timedelta(days=self.__maintenance_interval)
+        self.__last_update = datetime.now()
+        logger.info("Wartung für %s abgeschlossen. Nächste Wartung: %s", self.device_name,
+                    self.next_maintenance.strftime('%d.%m.%Y'))
+    
+    def get_days_until_maintenance(self) -> int:
+        delta = self.next_maintenance - datetime.now()
+        return delta.days
+    
+    def calculate_quarterly_maintenance_cost(self) -> float:
+        maintenances_per_quarter = 90 / self.__maintenance_interval
+        return maintenances_per_quarter * self.__maintenance_cost
+
+    @classmethod
+    def _from_document(cls, data):
+        # Restore the stored state instead of running __init__, which would reset all dates to now.
+        # Older records lack most fields, they get the defaults of __init__ and fixed dates (see LEGACY_CREATION_DATE)
+        device = cls.__new__(cls)
+        device.device_id = data.get('device_id')
+        device.device_name = data['device_name']
+        device.managed_by_user_id = data['managed_by_user_id']
+        device.is_active = data.get('is_active', True)
+        device.__creation_date = (data.get('_Device__creation_date') or data.get('_Device__last_update')
+                                  or LEGACY_CREATION_DATE)
+        device.__last_update = data.get('_Device__last_update') or device.__creation_date
+        device.__maintenance_interval = data.get('_Device__maintenance_interval', 90)
+        device.__maintenance_cost = data.get('_Device__maintenance_cost', 0.0)
+        device.end_of_life = data.get('end_of_life')
+        device.__last_maintenance_date = data.get('_Device__last_maintenance_date')
+        device.version = data.get(VERSION_FIELD, 0)
+        device.unsaved_maintenance = []
+
+        first_maintenance = data.get('first_maintenance')
+        next_maintenance = data.get('next_maintenance')
+        if first_maintenance is None:
+            first_maintenance = device.__creation_date + timedelta(days=device.__maintenance_interval)
+        if next_maintenance is None:
+            last = device.__last_maintenance_date or device.__creation_date
+            next_maintenance = last + timedelta(days=device.__maintenance_interval)
+        device.first_maintenance = first_maintenance
+        device.next_maintenance = next_maintenance
+        return device
+
+    # Class method that can be called without an instance of the class to construct an instance of the class
+    @classmethod
+    @instrument('Device.find_by_attribute')
+    def find_by_attribute(cls, by_attribute: str, attribute_value: str, num_to_return=1):
+        # Load data from the database and create an instance of the Device class
+        result = cls.db_connector.find(by_attribute, attribute_value, limit=num_to_return)
+
+        if result:
+            device_results = [cls._from_document(d) for d in result]
+            return device_results if num_to_return > 1 else device_results[0]
+        else:
+            return None
+
+    @classmethod
+    @instrument('Device.find_page')
+    def find_page(cls, offset=0, limit=50, is_active=None, managed_by_user_id=None, name_prefix=None):
+        """Return the devices of one page matching the given filters, and the number of all matching devices"""
+        # The filters are evaluated by the storage, only the requested page is turned into objects
+        equals = {}
+        if is_active is not None:
+            equals['is_active'] = is_active
+        if managed_by_user_id:
+            equals['managed_by_user_id'] = managed_by_user_id
+        prefixes = {'device_name': name_prefix} if name_prefix else {}
+
+        documents, total = cls.db_connector.find_page(equals, prefixes, offset, limit)
+        return [cls._from_document(d) for d in documents], total
+
+    @classmethod
+    @instrument('Device.find_due')
+    def find_due(cls, days: int, managed_by_user_id: str = None, limit=None, now: datetime = None) -> list:
+        """Find the active devices due for maintenance in the next `days` days (overdue ones included), soonest first"""
+        # Older records without is_active count as active, like in _from_document
+        query = Select(cls.db_connector).where('is_active', '!=', False).where(
+            'next_maintenance', '<=', (now or datetime.now()) + timedelta(days=days))
+        if managed_by_user_id:
+            query.where('managed_by_user_id', '==', managed_by_user_id)
+        return [cls._from_document(d) for d in query.order_by('next_maintenance').limit(limit).run()]
+
+    @classmethod
+    @instrument('Device.find_all')
+    def find_all(cls) -> list:
+        # Load all data from the database and create instances of the Device class
+        devices = []
+        for device_data in cached_all(Device.db_connector):
+            devices.append(Device._from_document(device_data))
+        return devices
+
+    @classmethod
+    def iter_all(cls):
+        # Like find_all, but only creates each Device when the caller gets to it
+        for device_data in cls.db_connector:
+            yield cls._from_document(device_data)
+
+    @classmethod
+    async def afind_by_attribute(cls, by_attribute: str, attribute_value: str, num_to_return=1):
+        return await async_api.run(cls.find_by_attribute, by_attribute, attribute_value, num_to_return)
+
+    @classmethod
+    async def afind_page(cls, offset=0, limit=50, is_active=None, managed_by_user_id=None, name_prefix=None):
+        return await async_api.run(cls.find_page, offset, limit, is_active, managed_by_user_id, name_prefix)
+
+    @classmethod
+    async def afind_all(cls) -> list:
+        return await async_api.run(cls.find_all)
+
+
+
+    
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Create a device
+    device1 = Device(1, "Device1", "one@mci.edu")
+    device2 = Device(2, "Device2", "two@mci.edu") 
+    device3 = Device(3, "Device3", "two@mci.edu") 
+    device4 = Device(4, "Device4", "two@mci.edu") 
+    
+    device1.maintenance_cost = 150.50
+    device2.maintenance_cost = 200.00
+    
+    device1.store_data()
+    device2.store_data()
+    device3.store_data()
+    device4.store_data()
+    
+    print(f"Tage bis zur nächsten Wartung: {device1.get_days_until_maintenance()}")
+    print(f"Wartungskosten pro Quartal: {device1.calculate_quarterly_maintenance_cost():.2f} €")
+    
+    device1.complete_maintenance()
+    
+    #loaded_device = Device.find_by_attribute("device_name", "Device2")
+    loaded_device = Device.find_by_attribute("managed_by_user_id", "two@mci.edu")
+    if loaded_device:
+        print(f"Loaded Device: {loaded_device}")
+    else:
+        print("Device not found.")
+
+    devices = Device.find_all()
+    print("All devices:")
+    for device in devices:
+        print(device)
+
+    
\ No newline at end of file
@@ -0,0 +1,378 @@
+"""Streaming CSV/JSONL import and export of devices, users and maintenance history.
+
+Files are read row by row and handled in chunks of `config.IMPORT_CHUNK_SIZE`:
+every row of a chunk is validated by the same rules as the models (interval of
+at least one day, no negative cost, user with name and email) and the valid
+ones are stored with one `store_many` call, i.e. one write batch per chunk
+instead of one file write per row. Memory use depends on the chunk size, not
+on the size of the file. Rows that fail validation are reported with their
+line number and don't stop the import.
+
+Exports are generators of plain rows (dates as ISO strings), written out line
+by line, so they don't build the whole file in memory either.
+
+Usage: python import_export.py import|export devices|users|maintenance <file.csv|file.jsonl>
+"""
+import csv
+import json
+import logging
+import math
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from itertools import islice
+
+import config
+from devices import Device
+from maintenance_events import MaintenanceEvent
+from users import User
+
+# Columns of the files, in this order when exporting to CSV
+DEVICE_FIELDS = ('device_id', 'device_name', 'managed_by_user_id', 'is_active', 'maintenance_interval',
+                 'maintenance_cost', 'creation_date', 'last_maintenance_date', 'next_maintenance', 'end_of_life')
+USER_FIELDS = ('id', 'name')
+# One row per done maintenance of the history, event_id makes importing the same rows again a no-op
+MAINTENANCE_FIELDS = ('event_id', 'device_name', 'managed_by_user_id', 'maintenance_date', 'maintenance_cost', 'notes')
+
+# Only the first errors are kept with their message, the rest is just counted
+MAX_REPORTED_ERRORS = 100
+
+_TRUE = ('1', 'true', 'yes', 'ja', 'y', 'j')
+_FALSE = ('0', 'false', 'no', 'nein', 'n')
+
+
+class TransferReport:
+    """Outcome of an import or export: rows handled, rejected rows and throughput"""
+
+    def __init__(self):
+        self.rows = 0
+        self.failed = 0
+        # [(line number, message)] of the first MAX_REPORTED_ERRORS rejected rows
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return (self.rows + self.failed) / self.seconds if self.seconds else 0.0
+
+    def add_error(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self):
+        return (f"{self.rows} rows, {self.failed} rejected in {self.seconds:.2f} s "
+                f"({self.rows_per_second:.0f} rows/s)")
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def read_rows(path: str, on_error=None):
+    """Yield (line number, row dict) of a CSV or JSONL file, one row at a time.
+
+    JSONL lines that aren't a JSON object are passed to `on_error(line number,
+    message)` and skipped, without `on_error` they raise ValueError.
+    """
+    file_format = _file_format(path)
+    # utf-8-sig: CSV files saved by Excel start with a byte order mark
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if file_format == 'csv':
+            reader = csv.DictReader(handle)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, dict):
+                        raise ValueError(f"Zeile ist kein JSON-Objekt: {line.strip()[:40]!r}")
+                except ValueError as error:
+                    if on_error is None:
+                        raise
+                    on_error(line_number, str(error))
+                    continue
+                yield line_number, row
+
+
+def write_rows(path: str, rows, fields) -> TransferReport:
+    """Write the row dicts of the iterable `rows` to a CSV or JSONL file, streaming"""
+    file_format = _file_format(path)
+    report = TransferReport()
+    start = time.perf_counter()
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        if file_format == 'csv':
+            writer = csv.DictWriter(handle, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                report.rows += 1
+        else:
+            for row in rows:
+                handle.write(json.dumps(row, ensure_ascii=False) + '\n')
+                report.rows += 1
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def device_from_row(row: dict) -> Device:
+    """Build a Device from an import row. Raises ValueError if the row breaks one of the device rules"""
+    interval = _parse_int(row, 'maintenance_interval', 90)
+    creation_date = _parse_datetime(row, 'creation_date')
+    device = Device._from_document({
+        'device_id': _parse_int(row, 'device_id', None),
+        'device_name': _required(row, 'device_name'),
+        'managed_by_user_id': _required(row, 'managed_by_user_id'),
+        'is_active': _parse_bool(row, 'is_active', True),
+        '_Device__creation_date': creation_date,
+        '_Device__last_update': datetime.now(),
+        '_Device__maintenance_interval': interval,
+        'end_of_life': _parse_datetime(row, 'end_of_life'),
+        '_Device__last_maintenance_date': _parse_datetime(row, 'last_maintenance_date'),
+    })
+    # The setters hold the rules, and schedule the next maintenance from the imported dates
+    device.maintenance_interval(interval)
+    device.maintenance_cost = _parse_float(row, 'maintenance_cost', 0.0)
+    # Imported rows replace what is stored, whatever version that is
+    device.version = None
+    return device
+
+
+def user_from_row(row: dict) -> User:
+    """Build a User from an import row. Raises ValueError if name or email are missing"""
+    return User(_required(row, 'id'), _required(row, 'name'))
+
+
+def import_devices(path: str, chunk_size: int = None) -> TransferReport:
+    """Insert or update (by device name) the devices of a CSV/JSONL file"""
+    return _import(path, device_from_row, Device.store_many, chunk_size)
+
+
+def import_users(path: str, chunk_size: int = None) -> TransferReport:
+    """Insert or update (by email) the users of a CSV/JSONL file"""
+    return _import(path, user_from_row, User.store_many, chunk_size)
+
+
+def import_maintenance(path: str, chunk_size: int = None) -> TransferReport:
+    """Add the maintenances of a CSV/JSONL file to the history of the stored devices.
+
+    Rows need device_name and maintenance_date, maintenance_cost defaults to
+    the device's maintenance cost. The next maintenance of a device is
+    scheduled from the latest maintenance, see `Device.complete_maintenance`.
+    Rows without event_id get one derived from device and date. Rows whose
+    maintenance is already stored, e.g. of a file imported before, are rejected.
+    """
+    report = TransferReport()
+    start = time.perf_counter()
+    rows = read_rows(path, report.add_error)
+    while True:
+        chunk = list(islice(rows, chunk_size or config.IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        # Several maintenances of one device in a chunk all go to the same object
+        devices = {}
+        event_ids = set()
+        for line_number, row in chunk:
+            try:
+                name = _required(row, 'device_name')
+                date = _parse_datetime(row, 'maintenance_date')
+                if date is None:
+                    raise ValueError("Feld 'maintenance_date' fehlt")
+                event_id = _value(row, 'event_id') or _maintenance_id(name, date)
+                if event_id in event_ids or MaintenanceEvent.exists(event_id):
+                    raise ValueError(f"Wartung {event_id} ist bereits gespeichert")
+                device = devices.get(name) or Device.find_by_attribute('device_name', name)
+                if device is None:
+                    raise ValueError(f"Gerät {name} existiert nicht")
+                device.complete_maintenance(date, _parse_float(row, 'maintenance_cost', None),
+                                            _value(row, 'notes') or "", event_id)
+            except ValueError as error:
+                report.add_error(line_number, str(error))
+                continue
+            devices[name] = device
+            event_ids.add(event_id)
+            report.rows += 1
+        Device.store_many(devices.values())
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def export_devices():
+    """Yield every stored device as an export row"""
+    for device in Device.iter_all():
+        # maintenance_interval() only sets the interval, the stored fields hold the current one
+        stored = device.to_dict()
+        yield {
+            'device_id': device.device_id,
+            'device_name': device.device_name,
+            'managed_by_user_id': device.managed_by_user_id,
+            'is_active': device.is_active,
+            'maintenance_interval': stored['_Device__maintenance_interval'],
+            'maintenance_cost': device.maintenance_cost,
+            'creation_date': _format_datetime(device.creation_date()),
+            'last_maintenance_date': _format_datetime(device.last_maintenance_date),
+            'next_maintenance': _format_datetime(device.next_maintenance),
+            'end_of_life': _format_datetime(device.end_of_life),
+        }
+
+
+def export_users():
+    """Yield every stored user as an export row"""
+    for user in User.iter_all():
+        yield {'id': user.id, 'name': user.name}
+
+
+def export_maintenance():
+    """Yield every done maintenance of the history"""
+    for event in MaintenanceEvent.iter_all():
+        if not event.planned:
+            yield {
+                'event_id': event.event_id,
+                'device_name': event.device_name,
+                'managed_by_user_id': event.managed_by_user_id,
+                'maintenance_date': _format_datetime(event.date),
+                'maintenance_cost': event.cost,
+                'notes': event.notes,
+            }
+
+
+# kind -> (import function, export generator, columns)
+KINDS = {
+    'devices': (import_devices, export_devices, DEVICE_FIELDS),
+    'users': (import_users, export_users, USER_FIELDS),
+    'maintenance': (import_maintenance, export_maintenance, MAINTENANCE_FIELDS),
+}
+
+
+def _import(path, from_row, store_many, chunk_size) -> TransferReport:
+    report = TransferReport()
+    start = time.perf_counter()
+    rows = read_rows(path, report.add_error)
+    while True:
+        chunk = list(islice(rows, chunk_size or config.IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        valid = []
+        for line_number, row in chunk:
+            try:
+                valid.append(from_row(row))
+            except ValueError as error:
+                report.add_error(line_number, str(error))
+        store_many(valid)
+        report.rows += len(valid)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def _maintenance_id(device_name: str, date: datetime) -> str:
+    # The same for every import of the same maintenance, so it is only stored once
+    return uuid.uuid5(uuid.NAMESPACE_URL, f'maintenance:{device_name}:{date.isoformat()}').hex
+
+
+def _file_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f"Unbekanntes Dateiformat '{extension}', erwartet wird .csv oder .jsonl")
+
+
+def _value(row: dict, field: str):
+    # Empty CSV cells count as missing
+    value = row.get(field)
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+    return value
+
+
+def _required(row: dict, field: str) -> str:
+    value = _value(row, field)
+    if value is None:
+        raise ValueError(f"Feld '{field}' fehlt")
+    return str(value)
+
+
+def _parse_int(row: dict, field: str, default):
+    value = _value(row, field)
+    if value is None:
+        return default
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"Ungültige ganze Zahl in '{field}': {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        # TypeError for lists/objects of JSONL rows, OverflowError for infinity
+        raise ValueError(f"Ungültige ganze Zahl in '{field}': {value!r}") from None
+
+
+def _parse_float(row: dict, field: str, default):
+    value = _value(row, field)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"Ungültige Zahl in '{field}': {value!r}")
+    try:
+        # Accepts the German decimal comma as well
+        number = float(value.replace(',', '.') if isinstance(value, str) else value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Ungültige Zahl in '{field}': {value!r}") from None
+    # NaN and infinity would pass every range check and can't be stored as JSON
+    if not math.isfinite(number):
+        raise ValueError(f"Ungültige Zahl in '{field}': {value!r}")
+    return number
+
+
+def _parse_bool(row: dict, field: str, default):
+    value = _value(row, field)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"Ungültiger Wahrheitswert in '{field}': {value!r}")
+
+
+def _parse_datetime(row: dict, field: str):
+    value = _value(row, field)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        # The date format shown in the UI
+        return datetime.strptime(value, '%d.%m.%Y')
+    except (TypeError, ValueError):
+        raise ValueError(f"Ungültiges Datum in '{field}': {value!r}") from None
+
+
+def _format_datetime(value):
+    return value.isoformat() if value is not None else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=config.LOG_LEVEL)
+    if len(sys.argv) != 4 or sys.argv[1] not in ('import', 'export') or sys.argv[2] not in KINDS:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(2)
+    action, kind, path = sys.argv[1:]
+    import_rows, export_rows, fields = KINDS[kind]
+    if action == 'import':
+        result = import_rows(path)
+        for line_number, message in result.errors:
+            print(f"line {line_number}: {message}")
+    else:
+        result = write_rows(path, export_rows(), fields)
+    print(f"{kind} {action}: {result}")
@@ -0,0 +1,424 @@
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from tinydb import TinyDB
+from tinydb.table import Table
+
+import metrics
+from concurrency import VERSION_FIELD, next_version
+from metrics import instrument
+from query_planner import Select
+from storage import CHANGES_TABLE, SNAPSHOT_KEY
+
+
+def _reads(method):
+    # Runs a read under the storage's shared lock, so it never sees the write of another thread half done
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._reading():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+class IndexedTable(Table):
+    """A TinyDB table that keeps in-memory hash indexes on selected fields.
+
+    Each index maps a field value to the ids of the documents holding it. The
+    indexes are built from a single read of the table on first use and are
+    kept up to date by every insert, update and remove that goes through this
+    table, so lookups on an indexed field don't evaluate a query per document.
+    When the storage reports that another process changed the data, the
+    indexes and cached results are dropped and built again on next use.
+    """
+
+    def __init__(self, storage, name, indexes=(), **kwargs):
+        # field -> value -> set of document ids, None until first use
+        self._indexed_fields = tuple(indexes)
+        self._indexes = None
+        # doc_id -> {field: value}, remembers what to unindex on update/remove
+        self._indexed_values = {}
+        # Table data as it looked right after the last write
+        self._last_table = None
+        # storage.external_version() the indexes and caches belong to
+        self._synced_version = None
+        super().__init__(storage, name, **kwargs)
+
+    @property
+    def indexed_fields(self) -> tuple:
+        return self._indexed_fields
+
+    @_reads
+    def lookup(self, field: str, value) -> list:
+        """Return the ids of all documents whose `field` equals `value`, lowest id first"""
+        if field not in self._indexed_fields:
+            raise KeyError(f"Field '{field}' is not indexed in table '{self.name}'")
+        self._ensure_indexes()
+        try:
+            return sorted(self._indexes[field].get(value, ()))
+        except TypeError:
+            # Unhashable values (lists, dicts) are never indexed
+            return []
+
+    @instrument('find')
+    @_reads
+    def find(self, field: str, value, limit=None) -> list:
+        """Return the documents whose `field` equals `value`, using an index when there is one"""
+        if field not in self._indexed_fields:
+            # Streams through the documents and stops at `limit` matches instead of collecting all of them
+            return Select(self).where(field, '==', value).limit(limit).run()
+
+        doc_ids = self.lookup(field, value)
+        if limit is not None:
+            doc_ids = doc_ids[:limit]
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('find', self.name, len(doc_ids))
+        if not doc_ids:
+            return []
+        # Pick the documents straight out of the table instead of filtering
+        # every document like `get(doc_ids=...)` does
+        table = self._read_table()
+        return [
+            self.document_class(table[str(doc_id)], doc_id)
+            for doc_id in doc_ids
+            if str(doc_id) in table
+        ]
+
+    @instrument('find_page')
+    @_reads
+    def find_page(self, equals=None, prefixes=None, offset=0, limit=None):
+        """Return one page of the documents matching all conditions, and the number of all matches.
+
+        `equals` maps fields to the value they must have, `prefixes` maps fields
+        to the text they must start with. Conditions on indexed fields narrow the
+        candidates through the index, the rest is checked per candidate.
+        """
+        equals = dict(equals or {})
+        prefixes = dict(prefixes or {})
+
+        candidates = None
+        for field in [field for field in equals if field in self._indexed_fields]:
+            doc_ids = set(self.lookup(field, equals.pop(field)))
+            candidates = doc_ids if candidates is None else candidates & doc_ids
+
+        table = self._read_table()
+        if candidates is None:
+            items = ((self.document_id_class(doc_id), doc) for doc_id, doc in table.items())
+        else:
+            items = ((doc_id, table[str(doc_id)]) for doc_id in sorted(candidates) if str(doc_id) in table)
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('find_page', self.name, len(table) if candidates is None else len(candidates))
+
+        matches = [(doc_id, doc) for doc_id, doc in items if _matches(doc, equals, prefixes)]
+        end = None if limit is None else offset + limit
+        page = [self.document_class(doc, doc_id) for doc_id, doc in matches[offset:end]]
+        return page, len(matches)
+
+    @instrument('search')
+    @_reads
+    def search(self, cond):
+        self._sync()
+        if metrics.registry.enabled:
+            # Every document is checked against the query, unless TinyDB has the result cached
+            cached = self._query_cache.get(cond) is not None
+            metrics.registry.cache('search', self.name, cached)
+            if not cached:
+                metrics.registry.add_rows('search', self.name, len(self._read_table()))
+        return super().search(cond)
+
+    @_reads
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        return super().get(cond, doc_id, doc_ids)
+
+    @instrument('all')
+    @_reads
+    def all(self):
+        documents = super().all()
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('all', self.name, len(documents))
+        return documents
+
+    @_reads
+    def count(self, cond) -> int:
+        return super().count(cond)
+
+    @_reads
+    def contains(self, cond=None, doc_id=None) -> bool:
+        return super().contains(cond, doc_id)
+
+    @_reads
+    def __len__(self):
+        return super().__len__()
+
+    def documents(self, doc_ids=None):
+        """Yield (doc_id, document) of the given ids, or of all documents, without copying them.
+
+        The documents are the stored ones and must not be modified. The shared
+        lock is held until the generator is exhausted or closed, so the caller
+        has to read them right away (see query_planner).
+        """
+        with self._reading():
+            table = self._read_table()
+            if doc_ids is None:
+                for doc_id, doc in table.items():
+                    yield self.document_id_class(doc_id), doc
+                return
+            for doc_id in doc_ids:
+                doc = table.get(str(doc_id))
+                if doc is not None:
+                    yield doc_id, doc
+
+    @_reads
+    def doc_ids(self) -> list:
+        """Ids of all documents, without copying any document"""
+        return [self.document_id_class(doc_id) for doc_id in self._read_table()]
+
+    def __iter__(self):
+        # Only the list of documents is taken under the lock, the caller may iterate slowly
+        with self._reading():
+            items = list(self._read_table().items())
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('iter', self.name, len(items))
+        for doc_id, doc in items:
+            yield self.document_class(doc, self.document_id_class(doc_id))
+
+    @instrument('insert')
+    def insert(self, document):
+        with self._writing():
+            doc_id = super().insert(document)
+            self._reindex([doc_id])
+        return doc_id
+
+    @instrument('insert_multiple')
+    def insert_multiple(self, documents):
+        with self._writing():
+            doc_ids = super().insert_multiple(documents)
+            self._reindex(doc_ids)
+        return doc_ids
+
+    @instrument('update')
+    def update(self, fields, cond=None, doc_ids=None):
+        with self._writing():
+            updated_ids = super().update(fields, cond, doc_ids)
+            self._reindex(updated_ids)
+        return updated_ids
+
+    def update_multiple(self, updates):
+        with self._writing():
+            updated_ids = super().update_multiple(updates)
+            self._reindex(updated_ids)
+        return updated_ids
+
+    def update_versioned(self, fields: dict, doc_id: int, version=None) -> int:
+        """Merge `fields` into the document if it still has the `version` it was loaded with, and return its new version.
+
+        Raises StaleVersionError if someone else changed or removed it in the
+        meantime. Without `version` the document is updated unconditionally.
+        """
+        with self._writing():
+            new_version = next_version(self.name, doc_id, self._read_table().get(str(doc_id)), version)
+            self.update({**fields, VERSION_FIELD: new_version}, doc_ids=[doc_id])
+        return new_version
+
+    def upsert(self, document, cond=None):
+        with self._writing():
+            return super().upsert(document, cond)
+
+    @instrument('remove')
+    def remove(self, cond=None, doc_ids=None):
+        with self._writing():
+            removed_ids = super().remove(cond, doc_ids)
+            self._reindex(removed_ids)
+        return removed_ids
+
+    def truncate(self) -> None:
+        with self._writing():
+            super().truncate()
+            self._last_table = None
+            if self._logs_records():
+                self._storage.log_truncate(self.name)
+            self._journal(['*'])
+            self._reset_indexes()
+
+    def invalidate(self) -> None:
+        """Forget the cached query results and indexes, e.g. after a discarded write batch"""
+        self.clear_cache()
+        self._indexes = None
+        self._indexed_values = {}
+        self._next_id = None
+
+    def _update_table(self, updater):
+        # Change the stored data in place instead of TinyDB's copy of the whole table
+        # to integer ids and back, which made every single insert or update as slow as
+        # the table is large. A failed write batch reads the data again (see storage.py)
+        tables = self._storage.read()
+        if tables is None:
+            tables = {}
+        # Kept so the written documents can be reindexed without reading the storage a second time
+        self._last_table = _DocumentView(tables.setdefault(self.name, {}), self.document_id_class)
+        updater(self._last_table)
+        if not self._logs_records():
+            # A storage persisting single documents gets them from `_reindex` instead
+            self._storage.write(tables)
+        self.clear_cache()
+
+    def _reading(self):
+        lock = getattr(self._storage, 'lock', None)
+        return lock.shared() if lock is not None else nullcontext()
+
+    @contextmanager
+    def _writing(self):
+        # Holds the storage's write lock for the whole read-modify-write, working
+        # on data that includes everything other processes wrote before
+        batch = getattr(self._storage, 'batch', None)
+        with batch() if batch is not None else nullcontext():
+            self._sync()
+            yield
+
+    def _sync(self):
+        external_version = getattr(self._storage, 'external_version', None)
+        if external_version is None:
+            return
+        version = external_version()
+        if version != self._synced_version:
+            self.invalidate()
+            self._synced_version = version
+
+    def _read_table(self):
+        self._sync()
+        return super()._read_table()
+
+    def _ensure_indexes(self):
+        self._sync()
+        if self._indexes is not None:
+            return
+        # Read before resetting, reading may find changes of other processes and invalidate the indexes
+        table = self._read_table()
+        self._reset_indexes()
+        for doc_id, doc in table.items():
+            self._index_document(self.document_id_class(doc_id), doc)
+
+    def _reset_indexes(self):
+        self._indexes = {field: {} for field in self._indexed_fields}
+        self._indexed_values = {}
+
+    def _logs_records(self) -> bool:
+        return getattr(self._storage, 'log_records', None) is not None
+
+    def _reindex(self, doc_ids):
+        table, self._last_table = self._last_table, None
+        if table is not None and self._logs_records():
+            self._storage.log_records(self.name, [(doc_id, table.get(doc_id)) for doc_id in doc_ids])
+        self._journal(doc_ids)
+        if self._indexes is None:
+            # Nothing built yet, the indexes will be read fresh on first use
+            return
+        for doc_id in doc_ids:
+            self._unindex_document(doc_id)
+            if table is not None and doc_id in table:
+                self._index_document(doc_id, table[doc_id])
+
+    def _journal(self, doc_ids):
+        # Note the written documents in the change journal, if a snapshot started one. Runs inside
+        # the write, so the journal is stored together with the documents
+        tables = self._storage.read()
+        journal = tables.get(CHANGES_TABLE) if tables else None
+        if journal is None or SNAPSHOT_KEY not in journal:
+            return
+        keys = [key for key in (f'{self.name}:{doc_id}' for doc_id in doc_ids) if key not in journal]
+        for key in keys:
+            journal[key] = {}
+        if keys and self._logs_records():
+            self._storage.log_records(CHANGES_TABLE, [(key, {}) for key in keys])
+
+    def _index_document(self, doc_id, doc):
+        values = {}
+        for field in self._indexed_fields:
+            if field not in doc:
+                continue
+            value = doc[field]
+            try:
+                self._indexes[field].setdefault(value, set()).add(doc_id)
+            except TypeError:
+                continue
+            values[field] = value
+        self._indexed_values[doc_id] = values
+
+    def _unindex_document(self, doc_id):
+        for field, value in self._indexed_values.pop(doc_id, {}).items():
+            doc_ids = self._indexes[field].get(value)
+            if doc_ids is None:
+                continue
+            doc_ids.discard(doc_id)
+            if not doc_ids:
+                del self._indexes[field][value]
+
+
+class _DocumentView(MutableMapping):
+    """The stored table (string ids) seen the way TinyDB's updaters expect it (integer ids), without copying it"""
+
+    def __init__(self, raw: dict, document_id_class):
+        self._raw = raw
+        self._document_id_class = document_id_class
+
+    def __getitem__(self, doc_id):
+        return self._raw[str(doc_id)]
+
+    def __setitem__(self, doc_id, doc):
+        self._raw[str(doc_id)] = doc
+
+    def __delitem__(self, doc_id):
+        del self._raw[str(doc_id)]
+
+    def __contains__(self, doc_id):
+        return str(doc_id) in self._raw
+
+    def __iter__(self):
+        return (self._document_id_class(doc_id) for doc_id in self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def clear(self):
+        self._raw.clear()
+
+
+def _matches(doc, equals: dict, prefixes: dict) -> bool:
+    for field, value in equals.items():
+        if field not in doc or doc[field] != value:
+            return False
+    for field, prefix in prefixes.items():
+        value = doc.get(field)
+        if not isinstance(value, str) or not value.startswith(prefix):
+            return False
+    return True
+
+
+class IndexedTinyDB(TinyDB):
+    """TinyDB whose tables accept an `indexes` argument, e.g. `db.table('users', indexes=('id',))`"""
+    table_class = IndexedTable
+
+    def changes(self) -> tuple:
+        """(snapshot id, keys of the documents written since) of the change journal, (None, []) without one"""
+        lock = getattr(self.storage, 'lock', None)
+        with lock.shared() if lock is not None else nullcontext():
+            journal = (self.storage.read() or {}).get(CHANGES_TABLE) or {}
+            if SNAPSHOT_KEY not in journal:
+                return None, []
+            return journal[SNAPSHOT_KEY]['snapshot'], [key for key in journal if key != SNAPSHOT_KEY]
+
+    def reset_changes(self, snapshot_id=None) -> None:
+        """Start an empty change journal after the snapshot `snapshot_id`, or stop recording changes with None"""
+        batch = getattr(self.storage, 'batch', None)
+        with batch() if batch is not None else nullcontext():
+            tables = self.storage.read()
+            if tables is None:
+                tables = {}
+            journal = tables[CHANGES_TABLE] = {}
+            if snapshot_id is not None:
+                journal[SNAPSHOT_KEY] = {'snapshot': snapshot_id}
+            if getattr(self.storage, 'log_records', None) is not None:
+                self.storage.log_truncate(CHANGES_TABLE)
+                self.storage.log_records(CHANGES_TABLE, list(journal.items()))
+            else:
+                self.storage.write(tables)
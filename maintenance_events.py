@@ -0,0 +1,242 @@
+"""Append-only history of maintenances, with cost totals kept up to date on every write.
+
+Every maintenance is stored once as an event (device, responsible user, date,
+cost, notes) and never changed afterwards. Storing an event also adds it to
+the totals of its device, its responsible user, its month and its quarter in
+the `maintenance_rollups` table, within the same write batch. A cost report
+reads one stored total instead of adding up all events. Planned maintenances
+are stored as events as well, but only count once they are done, as an event
+of their own.
+
+Events in a date range are found through `EventIndex`: the event dates sorted
+overall and per device, built from the stored events on first use.
+"""
+import logging
+import math
+import uuid
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from concurrency import VERSION_FIELD
+from database import LazyIndex, LazyTable, cached_all
+from metrics import instrument
+from storage import on_commit, write_batch
+
+logger = logging.getLogger(__name__)
+
+# Kinds of totals, each event counts towards one total of every scope
+ROLLUP_SCOPES = ('device', 'user', 'month', 'quarter')
+
+
+def month_key(day: datetime) -> str:
+    return f'{day.year}-{day.month:02d}'
+
+
+def quarter_key(day: datetime) -> str:
+    return f'{day.year}-Q{(day.month - 1) // 3 + 1}'
+
+
+def rollup_keys(data: dict) -> dict:
+    """scope -> key of the totals an event counts towards"""
+    return {
+        'device': data['device_name'],
+        'user': data['managed_by_user_id'],
+        'month': month_key(data['date']),
+        'quarter': quarter_key(data['date']),
+    }
+
+
+class EventIndex(LazyIndex):
+    """Dates of the stored events, sorted overall and per device, for range queries by binary search"""
+
+    def __init__(self, loader=None, version=None):
+        super().__init__(loader, version)
+        # None or device_name -> sorted [(date, event_id)]
+        self._dates = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._dates is not None
+
+    def add(self, data: dict) -> None:
+        with self._lock:
+            if self._dates is None:
+                return
+            entry = (data['date'], data['event_id'])
+            # Events mostly arrive in date order, insort appends at the end then
+            insort(self._dates.setdefault(None, []), entry)
+            insort(self._dates.setdefault(data['device_name'], []), entry)
+
+    def between(self, start: datetime, end: datetime, device_name: str = None) -> list:
+        """Return the ids of the events in [start, end), of one device or of all, oldest first"""
+        with self._lock:
+            self._ensure_loaded()
+            dates = self._dates.get(device_name, [])
+            position = bisect_left(dates, (start,))
+            result = []
+            while position < len(dates) and dates[position][0] < end:
+                result.append(dates[position][1])
+                position += 1
+            return result
+
+    def _build(self, documents):
+        dates = {}
+        for data in documents:
+            entry = (data['date'], data['event_id'])
+            dates.setdefault(None, []).append(entry)
+            dates.setdefault(data['device_name'], []).append(entry)
+        for entries in dates.values():
+            entries.sort()
+        self._dates = dates
+
+    def _clear(self):
+        self._dates = None
+
+
+class MaintenanceEvent:
+    # Class variables that are shared between all instances of the class
+    db_connector = LazyTable('maintenance_events')
+    rollups = LazyTable('maintenance_rollups')
+    # Event dates sorted per device, for range queries without scanning the table
+    index = EventIndex(lambda: cached_all(MaintenanceEvent.db_connector),
+                       lambda: MaintenanceEvent.db_connector.storage.external_version())
+
+    def __init__(self, device_name: str, managed_by_user_id: str, date: datetime, cost: float = 0.0,
+                 notes: str = "", planned: bool = False, event_id: str = None) -> None:
+        """Create a maintenance of a device done (or planned, if `planned` is set) at `date`"""
+        if not math.isfinite(cost):
+            raise ValueError("Wartungskosten müssen eine endliche Zahl sein")
+        if cost < 0:
+            raise ValueError("Wartungskosten können nicht negativ sein")
+        self.event_id = event_id or uuid.uuid4().hex
+        self.device_name = device_name
+        self.managed_by_user_id = managed_by_user_id
+        self.date = date
+        self.cost = cost
+        self.notes = notes
+        self.planned = planned
+
+    def __str__(self):
+        state = "geplant" if self.planned else "durchgeführt"
+        return f"Maintenance {self.device_name} ({self.managed_by_user_id}) {self.date:%d.%m.%Y} {state} {self.cost:.2f} €"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def to_dict(self) -> dict:
+        return {'event_id': self.event_id, 'device_name': self.device_name,
+                'managed_by_user_id': self.managed_by_user_id, 'date': self.date, 'cost': self.cost,
+                'notes': self.notes, 'planned': self.planned}
+
+    def store_data(self) -> None:
+        """Append the event to the history and add it to the cost totals"""
+        self.store_many([self])
+
+    @classmethod
+    @instrument('MaintenanceEvent.store_many')
+    def store_many(cls, events) -> None:
+        """Append all given events in one write batch, updating every affected total once"""
+        events = list(events)
+        logger.debug("Storing %d maintenance events", len(events))
+        with write_batch(cls.db_connector, cls.rollups):
+            for event in events:
+                # Events are never changed, storing one twice would count it twice
+                if cls.exists(event.event_id):
+                    raise ValueError(f"Wartung {event.event_id} ist bereits gespeichert")
+            cls.db_connector.insert_multiple([{**event.to_dict(), VERSION_FIELD: 1} for event in events])
+            cls._add_to_rollups([event.to_dict() for event in events if not event.planned])
+
+        def add_to_index():
+            for event in events:
+                cls.index.add(event.to_dict())
+        # The events are only stored with the write of the outermost batch, e.g. the one of Device.store_many
+        on_commit(add_to_index)
+
+    @classmethod
+    def exists(cls, event_id: str) -> bool:
+        """Whether an event with this id is stored"""
+        return bool(cls.db_connector.lookup('event_id', event_id))
+
+    @classmethod
+    def rebuild_rollups(cls) -> None:
+        """Compute all totals again from the stored events, e.g. after events were removed by hand"""
+        with write_batch(cls.db_connector, cls.rollups):
+            cls.rollups.truncate()
+            cls._add_to_rollups(data for data in cls.db_connector if not data.get('planned'))
+
+    @classmethod
+    @instrument('MaintenanceEvent.totals')
+    def totals(cls, scope: str, key: str) -> dict:
+        """Number, cost and last date of the done maintenances of one device, user, month ('2024-06') or quarter ('2024-Q2')"""
+        doc_ids = cls.rollups.lookup('rollup_key', f'{scope}:{key}')
+        if not doc_ids:
+            return {'count': 0, 'cost': 0.0, 'last_date': None}
+        data = cls.rollups.get(doc_id=doc_ids[0])
+        return {'count': data['count'], 'cost': data['cost'], 'last_date': data['last_date']}
+
+    @classmethod
+    @instrument('MaintenanceEvent.totals_by')
+    def totals_by(cls, scope: str) -> dict:
+        """key -> totals (see `totals`) of every device, user, month or quarter with done maintenances"""
+        if scope not in ROLLUP_SCOPES:
+            raise ValueError(f"Unbekannte Auswertung '{scope}', erwartet wird eine von {', '.join(ROLLUP_SCOPES)}")
+        documents = cls.rollups.get(doc_ids=cls.rollups.lookup('scope', scope))
+        return {data['key']: {'count': data['count'], 'cost': data['cost'], 'last_date': data['last_date']}
+                for data in sorted(documents, key=lambda data: data['key'])}
+
+    @classmethod
+    @instrument('MaintenanceEvent.find_between')
+    def find_between(cls, start: datetime, end: datetime, device_name: str = None) -> list:
+        """Find the events in [start, end), of one device or of all, oldest first"""
+        return [cls.find_by_attribute('event_id', event_id) for event_id in cls.index.between(start, end, device_name)]
+
+    @classmethod
+    def _from_document(cls, data):
+        return cls(data['device_name'], data['managed_by_user_id'], data['date'], data.get('cost', 0.0),
+                   data.get('notes', ""), data.get('planned', False), data['event_id'])
+
+    @classmethod
+    @instrument('MaintenanceEvent.find_all')
+    def find_all(cls) -> list:
+        """Find all events in the database"""
+        return [cls._from_document(data) for data in cached_all(cls.db_connector)]
+
+    @classmethod
+    def iter_all(cls):
+        """Iterate over all events in the database, creating each event only when it is reached"""
+        for data in cls.db_connector:
+            yield cls._from_document(data)
+
+    @classmethod
+    @instrument('MaintenanceEvent.find_by_attribute')
+    def find_by_attribute(cls, by_attribute: str, attribute_value: str, num_to_return=1):
+        """From the matches in the database, select the event(s) with the given attribute value"""
+        result = cls.db_connector.find(by_attribute, attribute_value, limit=num_to_return)
+        if result:
+            events = [cls._from_document(data) for data in result]
+            return events if num_to_return > 1 else events[0]
+        return None
+
+    @classmethod
+    def _add_to_rollups(cls, events) -> None:
+        # Sum up per total first, so a batch of events updates every total only once
+        changes = {}
+        for data in events:
+            for scope, key in rollup_keys(data).items():
+                change = changes.setdefault(f'{scope}:{key}', {'scope': scope, 'key': key, 'count': 0, 'cost': 0.0,
+                                                                'last_date': data['date']})
+                change['count'] += 1
+                change['cost'] += data['cost']
+                change['last_date'] = max(change['last_date'], data['date'])
+
+        for rollup_key, change in changes.items():
+            doc_ids = cls.rollups.lookup('rollup_key', rollup_key)
+            if not doc_ids:
+                cls.rollups.insert({'rollup_key': rollup_key, **change})
+                continue
+            stored = cls.rollups.get(doc_id=doc_ids[0])
+            cls.rollups.update({
+                'count': stored['count'] + change['count'],
+                'cost': stored['cost'] + change['cost'],
+                'last_date': max(stored['last_date'], change['last_date']),
+            }, doc_ids=doc_ids[:1])
@@ -0,0 +1,105 @@
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+from database import LazyIndex
+
+
+class MaintenanceQueue(LazyIndex):
+    """Min-heap of devices ordered by their next maintenance date.
+
+    The heap is built once from the stored active devices and then updated per
+    device whenever a device is stored or deleted, instead of sorting the whole
+    fleet for every view. It is only built again when another process changed
+    the stored devices. Replaced and removed entries stay in the heap and are
+    skipped when read, the heap is rebuilt once they outnumber the live ones.
+    """
+
+    def __init__(self, loader=None, version=None):
+        super().__init__(loader, version)
+        self._heap = None
+        # device_name -> (next_maintenance, sequence number) of its live heap entry
+        self._current = {}
+        self._sequence = itertools.count()
+
+    @property
+    def loaded(self) -> bool:
+        return self._heap is not None
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._current)
+
+    def __contains__(self, device_name):
+        return device_name in self._current
+
+    def update(self, device_name: str, next_maintenance: datetime) -> None:
+        """Record a new next maintenance date for a device, O(log n)"""
+        with self._lock:
+            if self._heap is None:
+                # Not built yet, the loader will pick up the stored state
+                return
+            if next_maintenance is None:
+                self.remove(device_name)
+                return
+            current = self._current.get(device_name)
+            if current is not None and current[0] == next_maintenance:
+                return
+            entry = (next_maintenance, next(self._sequence), device_name)
+            self._current[device_name] = entry[:2]
+            heapq.heappush(self._heap, entry)
+            self._compact_if_needed()
+
+    def remove(self, device_name: str) -> None:
+        with self._lock:
+            if self._current.pop(device_name, None) is not None:
+                self._compact_if_needed()
+
+    def next_k(self, k: int) -> list:
+        """Return the `k` devices due soonest as (next_maintenance, device_name), in O(k log k)"""
+        with self._lock:
+            return list(itertools.islice(self._in_order(), k))
+
+    def due_within(self, days: int, now: datetime = None) -> list:
+        """Return all devices due in the next `days` days (overdue ones included), soonest first"""
+        limit = (now or datetime.now()) + timedelta(days=days)
+        with self._lock:
+            return list(itertools.takewhile(lambda entry: entry[0] <= limit, self._in_order()))
+
+    def _in_order(self):
+        # Walks the heap in ascending order without popping from it: the
+        # smallest unvisited entry is always a child of an already visited one
+        self._ensure_loaded()
+        heap = self._heap
+        if not heap:
+            return
+        frontier = [(heap[0], 0)]
+        while frontier:
+            (due, sequence, device_name), position = heapq.heappop(frontier)
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if self._current.get(device_name) == (due, sequence):
+                yield due, device_name
+
+    def _build(self, documents):
+        self._current = {}
+        for data in documents:
+            # Inactive devices aren't due, older records without is_active count as active
+            if data.get('is_active') is False:
+                continue
+            if isinstance(data.get('next_maintenance'), datetime) and 'device_name' in data:
+                self._current[data['device_name']] = (data['next_maintenance'], next(self._sequence))
+        self._rebuild()
+
+    def _clear(self):
+        self._heap = None
+        self._current = {}
+
+    def _rebuild(self):
+        self._heap = [(due, sequence, device_name) for device_name, (due, sequence) in self._current.items()]
+        heapq.heapify(self._heap)
+
+    def _compact_if_needed(self):
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._rebuild()
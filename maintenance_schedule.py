@@ -0,0 +1,87 @@
+"""Fleet-wide maintenance schedule, computed for all devices at once with pandas/NumPy.
+
+Works on the stored device documents instead of `Device` objects, so the
+due dates and costs of the whole fleet come out of a few column operations
+instead of one Python method call per device.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from database import open_table, cached_all
+
+# Stored field names, Device keeps these attributes private
+INTERVAL = '_Device__maintenance_interval'
+COST = '_Device__maintenance_cost'
+CREATION_DATE = '_Device__creation_date'
+LAST_MAINTENANCE = '_Device__last_maintenance_date'
+
+# Defaults of Device.__init__ for records stored before these fields existed
+DEFAULT_INTERVAL = 90
+DAYS_PER_QUARTER = 90
+
+
+def load_frame(documents) -> pd.DataFrame:
+    """Turn device documents into one column per field the schedule needs"""
+    documents = list(documents)
+    frame = pd.DataFrame({
+        'device_name': [d.get('device_name') for d in documents],
+        'managed_by_user_id': [d.get('managed_by_user_id') for d in documents],
+        'is_active': [d.get('is_active', True) for d in documents],
+        'interval': [d.get(INTERVAL) for d in documents],
+        'cost': [d.get(COST) for d in documents],
+        'creation_date': [d.get(CREATION_DATE) for d in documents],
+        'last_maintenance': [d.get(LAST_MAINTENANCE) for d in documents],
+    })
+    frame['interval'] = pd.to_numeric(frame['interval']).fillna(DEFAULT_INTERVAL).astype(np.int64)
+    frame['cost'] = pd.to_numeric(frame['cost']).fillna(0.0).astype(np.float64)
+    frame['creation_date'] = pd.to_datetime(frame['creation_date'])
+    frame['last_maintenance'] = pd.to_datetime(frame['last_maintenance'])
+    return frame
+
+
+def compute_schedule(frame: pd.DataFrame, now: datetime = None) -> pd.DataFrame:
+    """Add next due date, days remaining, overdue flag and costs per quarter and year to `frame`.
+
+    Uses the same rules as Device: the next maintenance is due one interval
+    after the last one, or after the creation date if there was none yet, and
+    the days remaining are counted like `timedelta.days`. Devices without a
+    creation date get no due date.
+    """
+    now = pd.Timestamp(now or datetime.now())
+    schedule = frame.copy()
+
+    base = schedule['last_maintenance'].fillna(schedule['creation_date'])
+    schedule['next_due'] = base + pd.to_timedelta(schedule['interval'], unit='D')
+
+    # Float days, so devices without a due date can stay NaN
+    days = np.floor((schedule['next_due'] - now) / pd.Timedelta(days=1))
+    schedule['days_remaining'] = days
+    schedule['overdue'] = days < 0
+
+    schedule['quarterly_cost'] = DAYS_PER_QUARTER / schedule['interval'] * schedule['cost']
+    schedule['annual_cost'] = 4 * schedule['quarterly_cost']
+    return schedule
+
+
+def cost_per_user(schedule: pd.DataFrame) -> pd.DataFrame:
+    """Sum up devices, overdue devices and maintenance costs per responsible user"""
+    return schedule.groupby('managed_by_user_id', sort=True).agg(
+        devices=('device_name', 'size'),
+        overdue=('overdue', 'sum'),
+        quarterly_cost=('quarterly_cost', 'sum'),
+        annual_cost=('annual_cost', 'sum'),
+    )
+
+
+def fleet_schedule(now: datetime = None) -> pd.DataFrame:
+    """Maintenance schedule of all stored devices, soonest due first"""
+    schedule = compute_schedule(load_frame(cached_all(open_table('devices'))), now)
+    return schedule.sort_values('days_remaining', kind='stable', na_position='last', ignore_index=True)
+
+
+if __name__ == "__main__":
+    schedule = fleet_schedule()
+    print(schedule[['device_name', 'managed_by_user_id', 'next_due', 'days_remaining', 'overdue']])
+    print(cost_per_user(schedule))
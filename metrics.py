@@ -0,0 +1,263 @@
+"""Latency, rows, bytes and cache counters per database operation and table.
+
+Model methods, table methods and storage file I/O are wrapped with
+`instrument`. While recording is off (the default, see `config.METRICS`) the
+wrapper only checks a flag and calls through. Once switched on, every call
+adds its latency to a histogram. Operations that scan documents, read or
+write files, or answer from a cache add those numbers too. Model methods are
+recorded as `<Model>.<method>` (e.g. `Device.store_data`), the table and
+storage operations they lead to under their own names (`find`, `insert`,
+`file_write`, ...).
+
+The numbers can be read with `snapshot()` (the debug panel of the UI), as
+Prometheus text with `prometheus_text()`, or served over HTTP with `serve()`.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+import config
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = 'device_db'
+
+
+class Histogram:
+    """Call latencies counted in the fixed `LATENCY_BUCKETS`, plus one bucket for everything slower"""
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket holding the `q` quantile, None without calls (inf if slower than all buckets)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class OperationStats:
+    """Everything recorded for one operation on one table (or database file)"""
+
+    __slots__ = ('latency', 'errors', 'rows', 'bytes_read', 'bytes_written', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else None
+
+
+class Registry:
+    """Thread-safe collection of `OperationStats` keyed by (operation, table)"""
+
+    def __init__(self, enabled: bool = False):
+        # Checked by every instrumented call, switching it is enough to start or stop recording
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, operation: str, table: str, seconds: float, error=False) -> None:
+        with self._lock:
+            stats = self._get(operation, table)
+            stats.latency.observe(seconds)
+            if error:
+                stats.errors += 1
+
+    def add_rows(self, operation: str, table: str, rows: int) -> None:
+        """Count documents an operation had to look at"""
+        with self._lock:
+            self._get(operation, table).rows += rows
+
+    def add_bytes(self, operation: str, table: str, read: int = 0, written: int = 0) -> None:
+        with self._lock:
+            stats = self._get(operation, table)
+            stats.bytes_read += read
+            stats.bytes_written += written
+
+    def cache(self, operation: str, table: str, hit: bool) -> None:
+        with self._lock:
+            stats = self._get(operation, table)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    def stats(self) -> dict:
+        """(operation, table) -> OperationStats, a copy of the current keys"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _get(self, operation, table) -> OperationStats:
+        stats = self._stats.get((operation, table))
+        if stats is None:
+            stats = self._stats[(operation, table)] = OperationStats()
+        return stats
+
+
+registry = Registry(config.METRICS)
+
+
+def label_of(owner) -> str:
+    """The table a model, table or storage works on, or the file name of a storage"""
+    connector = getattr(owner, 'db_connector', None)
+    if connector is not None:
+        return connector.name
+    name = getattr(owner, 'name', None)
+    if isinstance(name, str):
+        return name
+    path = getattr(owner, 'path', None)
+    return os.path.basename(path) if isinstance(path, str) else ''
+
+
+def instrument(operation: str, table: str = None):
+    """Record the latency of a function under `table`, or of a method under the table of its instance or class (see `label_of`)"""
+    def decorate(func):
+        @wraps(func)
+        def measured(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                registry.observe(operation, _label(table, args), time.perf_counter() - start, error=True)
+                raise
+            registry.observe(operation, _label(table, args), time.perf_counter() - start)
+            return result
+        return measured
+    return decorate
+
+
+def snapshot() -> list:
+    """One row per (operation, table) with calls, latency, rows, bytes and cache hit rate, slowest total first"""
+    rows = []
+    for (operation, table), stats in registry.stats().items():
+        latency = stats.latency
+        rows.append({
+            'operation': operation,
+            'table': table,
+            'calls': latency.count,
+            'errors': stats.errors,
+            'total_ms': latency.sum * 1000,
+            'mean_ms': latency.sum / latency.count * 1000 if latency.count else None,
+            'p50_ms': _milliseconds(latency.quantile(0.5)),
+            'p95_ms': _milliseconds(latency.quantile(0.95)),
+            'rows': stats.rows,
+            'bytes_read': stats.bytes_read,
+            'bytes_written': stats.bytes_written,
+            'cache_hit_rate': stats.cache_hit_rate,
+        })
+    rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return rows
+
+
+def prometheus_text() -> str:
+    """All recorded numbers in the Prometheus text exposition format"""
+    stats = sorted(registry.stats().items())
+    lines = [
+        f'# HELP {PREFIX}_operation_seconds Latency of database operations.',
+        f'# TYPE {PREFIX}_operation_seconds histogram',
+    ]
+    for (operation, table), entry in stats:
+        labels = _labels(operation, table)
+        latency = entry.latency
+        if not latency.count:
+            continue
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, latency.counts):
+            cumulative += count
+            lines.append(f'{PREFIX}_operation_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{PREFIX}_operation_seconds_bucket{{{labels},le="+Inf"}} {latency.count}')
+        lines.append(f'{PREFIX}_operation_seconds_sum{{{labels}}} {latency.sum}')
+        lines.append(f'{PREFIX}_operation_seconds_count{{{labels}}} {latency.count}')
+
+    counters = (
+        ('operation_errors_total', 'Failed database operations.', 'errors'),
+        ('rows_scanned_total', 'Documents looked at by database operations.', 'rows'),
+        ('bytes_read_total', 'Bytes read from database files.', 'bytes_read'),
+        ('bytes_written_total', 'Bytes written to database files.', 'bytes_written'),
+        ('cache_hits_total', 'Reads answered from memory.', 'cache_hits'),
+        ('cache_misses_total', 'Reads that had to go to the database file.', 'cache_misses'),
+    )
+    for name, help_text, attribute in counters:
+        values = [(key, getattr(entry, attribute)) for key, entry in stats if getattr(entry, attribute)]
+        if not values:
+            continue
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} counter')
+        for (operation, table), value in values:
+            lines.append(f'{PREFIX}_{name}{{{_labels(operation, table)}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve(port: int, host: str = '127.0.0.1'):
+    """Answer GET /metrics with `prometheus_text()` from a background thread, and return the server"""
+    # Imported here, the HTTP modules take longer to import than everything else of this module
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood stderr
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='database-metrics', daemon=True).start()
+    return server
+
+
+def _label(table, args) -> str:
+    if table is not None:
+        return table
+    return label_of(args[0]) if args else ''
+
+
+def _labels(operation: str, table: str) -> str:
+    table = table.replace('\\', '\\\\').replace('"', '\\"')
+    return f'operation="{operation}",table="{table}"'
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else seconds * 1000
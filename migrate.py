@@ -0,0 +1,47 @@
+"""One-shot migration of database.json into the SQLite backend.
+
+Usage: python migrate.py [database.json] [database.sqlite3]
+"""
+import logging
+import sys
+
+from tinydb.table import Document
+
+import config
+from database import INDEXES
+from serializer import create_serializer
+from sqlite_storage import SQLiteDatabase
+from storage import CHANGES_TABLE
+
+
+def migrate(json_path: str, sqlite_path: str) -> dict:
+    """Copy every table of the JSON database into SQLite, keeping the document ids.
+
+    Tables that already exist in the SQLite file are replaced, so the migration
+    can be repeated. Returns the number of documents copied per table.
+    """
+    # Read through the serializer so the {TinyDateTime} etc. values arrive as Python objects
+    data = create_serializer()(json_path, access_mode='r').read() or {}
+
+    database = SQLiteDatabase(sqlite_path)
+    counts = {}
+    with database.batch():
+        for table_name, documents in data.items():
+            if table_name == CHANGES_TABLE:
+                # The change journal belongs to the snapshots of the JSON database
+                continue
+            table = database.table(table_name, indexes=INDEXES.get(table_name, ()))
+            table.truncate()
+            for doc_id, document in documents.items():
+                table.insert(Document(document, int(doc_id)))
+            counts[table_name] = len(documents)
+    database.close()
+    return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=config.LOG_LEVEL)
+    json_path = sys.argv[1] if len(sys.argv) > 1 else config.JSON_PATH
+    sqlite_path = sys.argv[2] if len(sys.argv) > 2 else config.SQLITE_PATH
+    for table_name, count in migrate(json_path, sqlite_path).items():
+        print(f"{table_name}: {count} documents migrated")
@@ -1,13 +1,14 @@
-import os
-from tinydb import TinyDB, Query
-from serializer import serializer
+from database import open_table
+from metrics import instrument
+from query_planner import Select
 
+@instrument('queries.find_devices', table='devices')
 def find_devices() -> list:
     """Find all devices in the database."""
-    # Define the database connector
-    db_connector = TinyDB(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.json'), storage=serializer).table('devices')
-    # Search the database for all devices that are active
-    result = db_connector.all()
+    # The devices table of the shared database, see database.get_database
+    db_connector = open_table('devices')
+    # Only the device names are read, the rest of the documents is never copied
+    result = Select(db_connector, fields=('device_name',)).run()
     
     # The result is a list of dictionaries, we only want the device names
     if result:
@@ -16,4 +17,4 @@ def find_devices() -> list:
     return result
 
 if __name__ == "__main__":
-    print(find_devices())
\ No newline at end of file
+    print(find_devices())
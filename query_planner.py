@@ -0,0 +1,260 @@
+"""Queries with several conditions, projected fields, an order and a limit, answered through an index where there is one.
+
+    Select(Device.db_connector, fields=('device_name', 'next_maintenance'))
+        .where('managed_by_user_id', '==', 'one@mci.edu')
+        .where('is_active', '==', True)
+        .where('next_maintenance', '<=', datetime.now() + timedelta(days=30))
+        .order_by('next_maintenance')
+        .limit(10)
+        .run()
+
+All conditions have to hold. A missing field counts as None, which only
+`==`/`!=`/`in` can match. The query is planned when it runs, `explain()`
+shows the plan without running it:
+
+- SQLite tables get the whole query as one SQL statement, SQLite chooses the
+  index and only the projected fields leave the database.
+- Other tables look up `==` and `in` conditions on indexed fields in the
+  index and check the rest on the candidates found. Without such a
+  condition every stored document is streamed through the conditions. Without
+  an order, reading stops as soon as `limit` documents matched. With an
+  order, only the best `limit` are kept while reading.
+
+With `fields`, the rows are plain dicts holding only these fields (None if
+missing), nothing else of the stored documents is copied. Without `fields`,
+the rows are whole documents like those of `table.find`.
+"""
+import heapq
+import itertools
+import operator
+from contextlib import closing
+
+import metrics
+from metrics import instrument
+
+
+def _in(value, options) -> bool:
+    return value in options
+
+
+def _prefix(value, prefix) -> bool:
+    return isinstance(value, str) and value.startswith(prefix)
+
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': _in,
+    'prefix': _prefix,
+}
+# Operators whose candidates an index (value -> document ids) can deliver
+INDEXED_OPERATORS = ('==', 'in')
+
+
+class Condition:
+    """`field op value`, e.g. Condition('next_maintenance', '<=', cutoff)"""
+
+    __slots__ = ('field', 'op', 'value')
+
+    def __init__(self, field: str, op: str, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unbekannter Vergleich '{op}', erwartet wird einer von {', '.join(OPERATORS)}")
+        self.field = field
+        self.op = op
+        self.value = tuple(value) if op == 'in' else value
+
+    def matches(self, doc) -> bool:
+        value = doc.get(self.field)
+        if value is None and self.op not in ('==', '!=', 'in'):
+            return False
+        try:
+            return OPERATORS[self.op](value, self.value)
+        except TypeError:
+            # Values of different types (e.g. a date and a text) never match
+            return False
+
+    def uses_index(self, indexed_fields) -> bool:
+        # Documents without the field aren't in the index, so None has to be searched by a scan
+        if self.field not in indexed_fields or self.op not in INDEXED_OPERATORS:
+            return False
+        return None not in (self.value if self.op == 'in' else (self.value,))
+
+    def __str__(self):
+        return f'{self.field} {self.op} {self.value!r}'
+
+    def __repr__(self):
+        return f'Condition({self.field!r}, {self.op!r}, {self.value!r})'
+
+
+class Plan:
+    """How a `Select` is answered: the access path and what is done with the documents it delivers"""
+
+    def __init__(self, select, path: str, index_conditions=(), candidates=None):
+        self.select = select
+        # 'sqlite', 'index' or 'scan'
+        self.path = path
+        self.index_conditions = list(index_conditions)
+        # Ids delivered by the index, sorted, only on the 'index' path
+        self.candidates = candidates
+
+    @property
+    def filters(self) -> list:
+        """Conditions checked per document, after the access path"""
+        return [condition for condition in self.select.conditions if condition not in self.index_conditions]
+
+    def __str__(self):
+        select = self.select
+        lines = [f"table {select.table.name}"]
+        if self.path == 'sqlite':
+            lines.append("sqlite: one statement, conditions, order and limit evaluated by SQLite")
+            if select.conditions:
+                lines.append(f"  where: {' and '.join(str(condition) for condition in select.conditions)}")
+            # Asked for only here, running a query doesn't need SQLite's own plan
+            lines.extend(f"  {detail}" for detail in select.table.explain_select(select))
+        elif self.path == 'index':
+            conditions = ' and '.join(str(condition) for condition in self.index_conditions)
+            lines.append(f"index lookup: {conditions} -> {len(self.candidates)} candidates")
+        else:
+            lines.append("full scan")
+        if self.path != 'sqlite':
+            if self.filters:
+                lines.append(f"filter: {' and '.join(str(condition) for condition in self.filters)}")
+            if select.order is not None:
+                field, descending = select.order
+                direction = 'descending' if descending else 'ascending'
+                if select.row_limit is None:
+                    lines.append(f"order: {field} {direction}, sort all matches")
+                else:
+                    lines.append(f"order: {field} {direction}, keep the best {select.row_limit} while reading")
+            elif select.row_limit is not None:
+                lines.append(f"limit: stop after {select.row_limit} matches")
+        lines.append(f"fields: {', '.join(select.fields)}" if select.fields is not None else "fields: all")
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Select:
+    """A query on one table, built step by step (every step returns the query itself) and run with `run()`"""
+
+    def __init__(self, table, fields=None):
+        self.table = table
+        self.fields = None if fields is None else tuple(fields)
+        self.conditions = []
+        # (field, descending) or None for the order of the document ids
+        self.order = None
+        self.row_limit = None
+
+    def where(self, field: str, op: str = '==', value=None) -> 'Select':
+        self.conditions.append(Condition(field, op, value))
+        return self
+
+    def equals(self, **values) -> 'Select':
+        """Shortcut for several `==` conditions, e.g. equals(is_active=True, managed_by_user_id='one@mci.edu')"""
+        for field, value in values.items():
+            self.where(field, '==', value)
+        return self
+
+    def order_by(self, field: str, descending: bool = False) -> 'Select':
+        """Order the rows by `field`, documents without it come last. Equal values keep the order of the ids"""
+        self.order = (field, descending)
+        return self
+
+    def limit(self, count) -> 'Select':
+        if count is not None and count < 0:
+            raise ValueError("Das Limit darf nicht negativ sein")
+        self.row_limit = count
+        return self
+
+    def plan(self) -> Plan:
+        if getattr(self.table, 'select', None) is not None:
+            return Plan(self, 'sqlite')
+        indexed_fields = getattr(self.table, 'indexed_fields', ())
+        index_conditions = [condition for condition in self.conditions if condition.uses_index(indexed_fields)]
+        if not index_conditions:
+            return Plan(self, 'scan')
+        # Every indexed condition narrows the candidates further, the smallest set is intersected first
+        id_sets = sorted((self._lookup(condition) for condition in index_conditions), key=len)
+        candidates = set.intersection(*id_sets)
+        return Plan(self, 'index', index_conditions, sorted(candidates))
+
+    def explain(self) -> str:
+        """Describe how the query would be answered, without reading any document"""
+        return str(self.plan())
+
+    def run(self) -> list:
+        return _run(self.table, self.plan())
+
+    def first(self):
+        """The first row, or None if nothing matches"""
+        rows = _run(self.table, self.plan(), 1)
+        return rows[0] if rows else None
+
+    def __iter__(self):
+        return iter(self.run())
+
+    def _lookup(self, condition) -> set:
+        values = condition.value if condition.op == 'in' else (condition.value,)
+        doc_ids = set()
+        for value in values:
+            doc_ids.update(self.table.lookup(condition.field, value))
+        return doc_ids
+
+
+@instrument('select')
+def _run(table, plan: Plan, limit=None) -> list:
+    select = plan.select
+    if limit is None or (select.row_limit is not None and select.row_limit < limit):
+        limit = select.row_limit
+    if plan.path == 'sqlite':
+        return table.select(select, limit)
+    if limit == 0:
+        return []
+
+    examined = 0
+
+    def matching(documents):
+        nonlocal examined
+        for doc_id, doc in documents:
+            examined += 1
+            # The index conditions are checked again, the documents may have changed since the lookup
+            if all(condition.matches(doc) for condition in select.conditions):
+                yield doc_id, doc
+
+    # Stored documents, handed out without copies, only the rows returned are copied
+    with closing(table.documents(plan.candidates)) as documents:
+        matches = matching(documents)
+        if select.order is not None:
+            matches = _ordered(matches, select.order, limit)
+        elif limit is not None:
+            matches = itertools.islice(matches, limit)
+        rows = [_row(table, doc_id, doc, select.fields) for doc_id, doc in matches]
+    if metrics.registry.enabled:
+        metrics.registry.add_rows('select', table.name, examined)
+    return rows
+
+
+def _ordered(matches, order: tuple, limit) -> list:
+    field, descending = order
+    if descending:
+        # Documents without the field rank lowest, so they come last as well
+        def key(match):
+            value = match[1].get(field)
+            return (0,) if value is None else (1, value)
+        return heapq.nlargest(limit, matches, key=key) if limit is not None else sorted(matches, key=key, reverse=True)
+
+    def key(match):
+        value = match[1].get(field)
+        return (1,) if value is None else (0, value)
+    return heapq.nsmallest(limit, matches, key=key) if limit is not None else sorted(matches, key=key)
+
+
+def _row(table, doc_id, doc, fields):
+    if fields is None:
+        return table.document_class(doc, doc_id)
+    return {field: doc.get(field) for field in fields}
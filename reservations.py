@@ -0,0 +1,237 @@
+import logging
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from concurrency import VERSION_FIELD
+from database import LazyIndex, LazyTable, cached_all
+from metrics import instrument
+from storage import on_rollback, write_batch
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceCalendar:
+    """The reservations of one device, sorted by start.
+
+    Reservations of a device never overlap (`Reservation.store_data` refuses
+    conflicts), so sorting them by start sorts them by end as well. Every query
+    is a binary search plus a walk over the k reservations it returns.
+    Intervals are half-open: a reservation ending at 12:00 doesn't conflict
+    with one starting at 12:00.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._ids = []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def add(self, reservation_id: str, start: datetime, end: datetime) -> None:
+        position = bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._ends.insert(position, end)
+        self._ids.insert(position, reservation_id)
+
+    def remove(self, reservation_id: str, start: datetime) -> None:
+        position = bisect_left(self._starts, start)
+        while position < len(self._starts) and self._starts[position] == start:
+            if self._ids[position] == reservation_id:
+                del self._starts[position], self._ends[position], self._ids[position]
+                return
+            position += 1
+
+    def overlapping(self, start: datetime, end: datetime) -> list:
+        """Return (reservation_id, start, end) of all reservations overlapping [start, end)"""
+        # The first reservation that ends after `start` is the first candidate
+        position = bisect_right(self._ends, start)
+        result = []
+        while position < len(self._starts) and self._starts[position] < end:
+            result.append((self._ids[position], self._starts[position], self._ends[position]))
+            position += 1
+        return result
+
+    def at(self, moment: datetime):
+        """Return (reservation_id, start, end) of the reservation running at `moment`, or None"""
+        position = bisect_right(self._starts, moment) - 1
+        if position >= 0 and self._ends[position] > moment:
+            return self._ids[position], self._starts[position], self._ends[position]
+        return None
+
+    def free_slots(self, start: datetime, end: datetime, min_duration=None) -> list:
+        """Return the (start, end) gaps between reservations inside [start, end), optionally only those lasting at least `min_duration`"""
+        slots = []
+        free_from = start
+        for _, booked_start, booked_end in self.overlapping(start, end):
+            if booked_start > free_from:
+                slots.append((free_from, booked_start))
+            free_from = max(free_from, booked_end)
+        if free_from < end:
+            slots.append((free_from, end))
+        if min_duration is not None:
+            slots = [(slot_start, slot_end) for slot_start, slot_end in slots if slot_end - slot_start >= min_duration]
+        return slots
+
+
+class ReservationIndex(LazyIndex):
+    """One `DeviceCalendar` per device, built from the stored reservations on first use"""
+
+    def __init__(self, loader=None, version=None):
+        super().__init__(loader, version)
+        self._calendars = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._calendars is not None
+
+    def calendar(self, device_name: str) -> DeviceCalendar:
+        with self._lock:
+            self._ensure_loaded()
+            return self._calendars.get(device_name) or DeviceCalendar()
+
+    def add(self, data: dict) -> None:
+        with self._lock:
+            if self._calendars is None:
+                return
+            self._calendars.setdefault(data['device_name'], DeviceCalendar()).add(
+                data['reservation_id'], data['start_date'], data['end_date'])
+
+    def remove(self, data: dict) -> None:
+        with self._lock:
+            if self._calendars is None or data['device_name'] not in self._calendars:
+                return
+            self._calendars[data['device_name']].remove(data['reservation_id'], data['start_date'])
+
+    def _build(self, documents):
+        self._calendars = {}
+        for data in documents:
+            self.add(data)
+
+    def _clear(self):
+        self._calendars = None
+
+
+class Reservation:
+    # Class variable that is shared between all instances of the class
+    db_connector = LazyTable('reservations')
+    # Reservations per device sorted by time, for conflict checks without scanning the table
+    index = ReservationIndex(lambda: cached_all(Reservation.db_connector),
+                             lambda: Reservation.db_connector.storage.external_version())
+
+    def __init__(self, device_name: str, user_id: str, start_date: datetime, end_date: datetime,
+                 reason: str = "", reservation_id: str = None) -> None:
+        """Create a reservation of a device for the time from `start_date` up to (excluding) `end_date`"""
+        if end_date <= start_date:
+            raise ValueError("Das Ende der Reservierung muss nach dem Start liegen")
+        self.reservation_id = reservation_id or uuid.uuid4().hex
+        self.device_name = device_name
+        self.user_id = user_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.reason = reason
+        # Version of the stored document this reservation was loaded from, None if it wasn't loaded
+        self.version = None
+
+    def __str__(self):
+        return f"Reservation {self.device_name} ({self.user_id}) {self.start_date:%d.%m.%Y %H:%M} - {self.end_date:%d.%m.%Y %H:%M}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def conflicts(self) -> list:
+        """Return the stored reservations of the same device that overlap this one"""
+        calendar = self.index.calendar(self.device_name)
+        conflicting_ids = [reservation_id for reservation_id, _, _ in calendar.overlapping(self.start_date, self.end_date)
+                           if reservation_id != self.reservation_id]
+        return [Reservation.find_by_attribute('reservation_id', reservation_id) for reservation_id in conflicting_ids]
+
+    @instrument('Reservation.store_data')
+    def store_data(self) -> None:
+        """Save the reservation, if the device isn't reserved by someone else at that time.
+
+        Raises StaleVersionError if it was loaded and someone else changed it since.
+        """
+        logger.debug("Storing reservation %s", self.reservation_id)
+        # Conflict check and write as one step, so no other process books the time in between
+        with write_batch(self.db_connector):
+            # The version only counts once the outermost batch is written, it is put back if that fails
+            version = self.version
+            on_rollback(lambda: setattr(self, 'version', version))
+            conflicts = self.conflicts()
+            if conflicts:
+                raise ValueError(f"{self.device_name} ist in diesem Zeitraum bereits reserviert: {conflicts[0]}")
+            # The index is changed right away for the conflict checks of later writes in the same batch,
+            # and read again from the database if the batch fails
+            on_rollback(self.index.invalidate)
+
+            doc_ids = self.db_connector.lookup('reservation_id', self.reservation_id)
+            if doc_ids:
+                # Move the reservation in the index from its old time to the new one
+                stored = self.db_connector.get(doc_id=doc_ids[0])
+                self.version = self.db_connector.update_versioned(self.__dict__, doc_ids[0], self.version)
+                self.index.remove(stored)
+                logger.debug("Reservation %s updated", self.reservation_id)
+            else:
+                self.version = 1
+                self.db_connector.insert(self.__dict__)
+                logger.debug("Reservation %s inserted", self.reservation_id)
+            self.index.add(self.__dict__)
+
+    @instrument('Reservation.delete')
+    def delete(self) -> None:
+        """Delete the reservation from the database"""
+        logger.debug("Deleting reservation %s", self.reservation_id)
+        doc_ids = self.db_connector.lookup('reservation_id', self.reservation_id)
+        if doc_ids:
+            stored = self.db_connector.get(doc_id=doc_ids[0])
+            self.db_connector.remove(doc_ids=[doc_ids[0]])
+            # Read again from the database if the batch this delete is part of fails
+            on_rollback(self.index.invalidate)
+            self.index.remove(stored)
+            logger.debug("Reservation %s deleted", self.reservation_id)
+        else:
+            logger.warning("Reservation %s not found, nothing deleted", self.reservation_id)
+
+    @classmethod
+    def _from_document(cls, data):
+        reservation = cls(data['device_name'], data['user_id'], data['start_date'], data['end_date'],
+                          data.get('reason', ""), data['reservation_id'])
+        reservation.version = data.get(VERSION_FIELD, 0)
+        return reservation
+
+    @classmethod
+    @instrument('Reservation.find_all')
+    def find_all(cls) -> list:
+        """Find all reservations in the database"""
+        return [cls._from_document(data) for data in cached_all(cls.db_connector)]
+
+    @classmethod
+    @instrument('Reservation.find_by_attribute')
+    def find_by_attribute(cls, by_attribute: str, attribute_value: str, num_to_return=1):
+        """From the matches in the database, select the reservation(s) with the given attribute value"""
+        result = cls.db_connector.find(by_attribute, attribute_value, limit=num_to_return)
+        if result:
+            reservations = [cls._from_document(data) for data in result]
+            return reservations if num_to_return > 1 else reservations[0]
+        return None
+
+    @classmethod
+    @instrument('Reservation.find_by_device')
+    def find_by_device(cls, device_name: str, start: datetime, end: datetime) -> list:
+        """Find the reservations of a device overlapping [start, end), sorted by start"""
+        calendar = cls.index.calendar(device_name)
+        return [cls.find_by_attribute('reservation_id', reservation_id)
+                for reservation_id, _, _ in calendar.overlapping(start, end)]
+
+    @classmethod
+    def reserved_at(cls, device_name: str, moment: datetime):
+        """Return the reservation of the device running at `moment`, or None if it is free"""
+        running = cls.index.calendar(device_name).at(moment)
+        return cls.find_by_attribute('reservation_id', running[0]) if running else None
+
+    @classmethod
+    def free_slots(cls, device_name: str, start: datetime, end: datetime, min_duration=None) -> list:
+        """Return the (start, end) periods in [start, end) in which the device isn't reserved"""
+        return cls.index.calendar(device_name).free_slots(start, end, min_duration)
@@ -1,6 +1,8 @@
+import importlib
 from datetime import datetime, date, time
-from tinydb.storages import JSONStorage
 from tinydb_serialization import Serializer, SerializationMiddleware
+import config
+from storage import AtomicJSONStorage, BatchMiddleware
 
 from tinydb_serialization.serializers import DateTimeSerializer
 
@@ -24,7 +26,145 @@ class TimeSerializer(Serializer):
     def decode(self, s):
         return time.fromisoformat(s)
 
-serializer = SerializationMiddleware(JSONStorage)
-serializer.register_serializer(DateTimeSerializer(), 'TinyDateTime')
-serializer.register_serializer(DateSerializer(), 'TinyDate')
-serializer.register_serializer(TimeSerializer(), 'TinyTime')
\ No newline at end of file
+# Tag -> serializer, in the order they are tried. datetime comes first as it is a subclass of date
+SERIALIZERS = {
+    'TinyDateTime': DateTimeSerializer(),
+    'TinyDate': DateSerializer(),
+    'TinyTime': TimeSerializer(),
+}
+
+def encode_value(value):
+    """Encode a single value (recursively for dicts and lists) the way SerializationMiddleware stores it"""
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    for name, serializer in SERIALIZERS.items():
+        if isinstance(value, serializer.OBJ_CLASS):
+            return f'{{{name}}}:{serializer.encode(value)}'
+    return value
+
+def decode_value(value):
+    """Reverse of `encode_value`"""
+    if isinstance(value, dict):
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if isinstance(value, str) and value.startswith('{Tiny'):
+        return _decode_string(value)
+    return value
+
+def _decode_string(value: str):
+    for name, serializer in SERIALIZERS.items():
+        tag = f'{{{name}}}:'
+        if value.startswith(tag):
+            return serializer.decode(value[len(tag):])
+    return value
+
+# Fields holding date/time values per table. Only these are decoded in stored documents
+# of these tables, documents of other tables are scanned value by value
+SCHEMA = {
+    'devices': ('_Device__creation_date', '_Device__last_update', 'end_of_life', 'first_maintenance',
+                'next_maintenance', '_Device__last_maintenance_date'),
+    'users': (),
+    'reservations': ('start_date', 'end_date'),
+    'maintenance_events': ('date',),
+    'maintenance_rollups': ('last_date',),
+}
+
+# JSON codecs in order of preference, the standard library one is always there
+JSON_CODECS = ('orjson', 'ujson', 'json')
+
+def load_codec(name: str = None):
+    """Return (name, module) of the requested JSON codec, or of the fastest one installed"""
+    for candidate in ((name,) if name else JSON_CODECS):
+        try:
+            return candidate, importlib.import_module(candidate)
+        except ImportError:
+            continue
+    raise ImportError(f"JSON codec '{name}' is not installed")
+
+def _encode_default(obj):
+    # Called by the codec for every value it can't serialize by itself
+    encoded = encode_value(obj)
+    if encoded is obj:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return encoded
+
+class SchemaJSONStorage(AtomicJSONStorage):
+    """Drop-in replacement for SerializationMiddleware over a JSON file, using the fastest JSON codec available.
+
+    Dates and times are encoded by the codec's `default` hook while it writes,
+    so the data isn't walked or copied beforehand. On reading, only the fields
+    listed in `SCHEMA` are decoded instead of checking every string. The file
+    format stays the same ({TinyDateTime}:... strings).
+    """
+
+    def __init__(self, path: str, codec: str = None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.codec, self._module = load_codec(codec or config.JSON_CODEC)
+
+    def read(self):
+        content = self._read_file(binary=True)
+        if not content.strip():
+            # Empty file, TinyDB initializes the database itself
+            return None
+        data = self.loads(content)
+        for table_name, table in data.items():
+            for doc_id, doc in table.items():
+                table[doc_id] = decode_document(table_name, doc)
+        return data
+
+    def write(self, data):
+        self._replace_file(self.dumps(data))
+
+    def dumps(self, data):
+        """Encode `data` with the codec, dates and times tagged like SerializationMiddleware does"""
+        return dump_json(data, self._module)
+
+    def loads(self, content):
+        """Parse JSON with the codec, without decoding any dates"""
+        return self._module.loads(content)
+
+def dump_json(data, module):
+    """Encode `data` with a codec module of `load_codec`, dates and times tagged like SerializationMiddleware does"""
+    if module.__name__ == 'orjson':
+        # orjson would write dates itself, without our tags, unless told to pass them through
+        return module.dumps(data, default=_encode_default, option=module.OPT_PASSTHROUGH_DATETIME)
+    return module.dumps(data, default=_encode_default)
+
+def decode_document(table_name: str, doc: dict) -> dict:
+    """Decode the dates and times of a stored document, only checking the `SCHEMA` fields if its table has one"""
+    fields = SCHEMA.get(table_name)
+    if fields is None:
+        return decode_value(doc)
+    for field in fields:
+        value = doc.get(field)
+        if value.__class__ is str and value.startswith('{Tiny'):
+            doc[field] = _decode_string(value)
+    return doc
+
+def create_serializer(storage: str = None):
+    """Build a new storage chain. Middlewares keep the storage they opened, so every database file needs its own.
+
+    `storage` is 'fast' for SchemaJSONStorage, 'middleware' for the generic
+    SerializationMiddleware or 'log' for the append-only LogStorage, by default
+    the one set in config.JSON_STORAGE.
+    """
+    storage = storage or config.JSON_STORAGE
+    if storage == 'log':
+        # Imported here, wal builds on the storages of this module. Batches are
+        # handled by the log itself, it has no use for BatchMiddleware
+        from wal import LogStorage
+        return LogStorage
+    # Outermost layer, so a write batch also skips the (de)serialization of every single write
+    if storage == 'fast':
+        return BatchMiddleware(SchemaJSONStorage)
+    return BatchMiddleware(create_serialization_middleware())
+
+def create_serialization_middleware():
+    """The generic SerializationMiddleware over an AtomicJSONStorage, with all `SERIALIZERS` registered"""
+    serialization = SerializationMiddleware(AtomicJSONStorage)
+    for name, serializer in SERIALIZERS.items():
+        serialization.register_serializer(serializer, name)
+    return serialization
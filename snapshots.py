@@ -0,0 +1,308 @@
+"""Point-in-time snapshots of the database and incremental backups, in a content-addressed store.
+
+A snapshot cuts every table into chunks of `CHUNK_IDS` consecutive document
+ids. Each chunk is stored compressed under the SHA-256 of its JSON, and a
+manifest lists the chunks of every table. A chunk is only written if no chunk
+with the same content is stored yet, so snapshots share everything that didn't
+change between them. The backup directory (config.BACKUP_DIR) holds
+
+    objects/<first two hex digits>/<sha256>   the chunks
+    snapshots/<snapshot id>.json              the manifests
+
+The first snapshot reads the whole database and starts the change journal
+(storage.CHANGES_TABLE): from then on every write notes the ids of the
+documents it changed, stored together with the documents. The next snapshot
+only reads the chunks holding these documents and takes the rest of its
+manifest over from the previous one, so its cost depends on how much changed
+and not on the size of the database. If the journal doesn't belong to a
+snapshot of this directory (e.g. another backup directory was used in between)
+or was dropped with the data (TinyDB's drop_tables), everything is read again.
+
+A snapshot holds the storage's exclusive lock (a transaction with SQLite)
+while it reads, so it sees the database at one point in time. Starting the
+new journal is a write: the 'log' storage and SQLite only write what changed,
+the 'fast' storage rewrites database.json like on every other write.
+
+`restore` replaces the content of the database by a snapshot, keeping the
+document ids, in one write batch. `diff` compares two snapshots and only reads
+the chunks whose hashes differ.
+
+Usage: python snapshots.py create [--full] | list | restore <snapshot id> | diff <old id> <new id>
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import zlib
+from contextlib import nullcontext
+from datetime import datetime
+
+from tinydb.table import Document
+
+import config
+import database
+from serializer import decode_document, dump_json, load_codec
+from storage import CHANGES_TABLE
+
+logger = logging.getLogger(__name__)
+
+# Consecutive document ids per chunk. A written document costs reading and hashing its whole chunk again
+CHUNK_IDS = 1024
+# zlib level of the chunks, the fastest one still makes them about eight times smaller
+COMPRESSION = 1
+
+
+class SnapshotStore:
+    """Snapshots of the shared database, kept in a backup directory"""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or config.BACKUP_DIR
+        _, self._codec = load_codec(config.JSON_CODEC)
+
+    def create(self, full=False, backend: str = None) -> dict:
+        """Take a snapshot of the database and return its manifest.
+
+        Only the chunks holding documents written since the last snapshot are
+        read, unless `full` is set or the last snapshot isn't in this directory.
+        """
+        db = database.get_database(backend)
+        batch = getattr(db.storage, 'batch', None)
+        with batch() if batch is not None else nullcontext():
+            previous, keys = db.changes()
+            parent = None if full or previous is None else self._parent(previous)
+            if parent is None:
+                tables = {}
+                dirty = dict.fromkeys(_data_tables(db))
+            else:
+                tables = {name: dict(chunks) for name, chunks in parent['tables'].items()}
+                dirty = _dirty_chunks(keys)
+
+            snapshot_id = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+            stats = {'chunks_read': 0, 'chunks_written': 0, 'bytes_written': 0}
+            for name, numbers in dirty.items():
+                table = database.open_table(name, backend)
+                chunks = tables.setdefault(name, {})
+                if numbers is None:
+                    # All chunks of the table, and those of the last snapshot that may be empty now
+                    numbers = {doc_id // CHUNK_IDS for doc_id in table.doc_ids()} | {int(number) for number in chunks}
+                for number in sorted(numbers):
+                    chunk = self._store_chunk(table, number, stats)
+                    if chunk is None:
+                        chunks.pop(str(number), None)
+                    else:
+                        chunks[str(number)] = chunk
+                if not chunks:
+                    del tables[name]
+
+            manifest = {
+                'id': snapshot_id,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'parent': parent and parent['id'],
+                'backend': backend or config.DB_BACKEND,
+                'chunk_ids': CHUNK_IDS,
+                'documents': {name: sum(count for _, count in chunks.values()) for name, chunks in tables.items()},
+                # Documents written since the parent, None for a snapshot that read everything
+                'changed': len(keys) if parent is not None else None,
+                **stats,
+                'tables': tables,
+            }
+            # The manifest is in place before the journal starts over, a crash in between only costs a full snapshot
+            self._write_file(self._manifest_path(snapshot_id), json.dumps(manifest).encode('utf-8'))
+            db.reset_changes(snapshot_id)
+        logger.info("Snapshot %s: %d chunks read, %d written (%d bytes)", snapshot_id, stats['chunks_read'],
+                    stats['chunks_written'], stats['bytes_written'])
+        return manifest
+
+    def snapshots(self) -> list:
+        """Manifests of all snapshots, oldest first"""
+        try:
+            names = os.listdir(os.path.join(self.directory, 'snapshots'))
+        except FileNotFoundError:
+            return []
+        return [self.load(name[:-len('.json')]) for name in sorted(names) if name.endswith('.json')]
+
+    def load(self, snapshot_id: str) -> dict:
+        """The manifest of a snapshot"""
+        try:
+            with open(self._manifest_path(snapshot_id), encoding='utf-8') as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            raise ValueError(f"Sicherung '{snapshot_id}' gibt es nicht in {self.directory}") from None
+
+    def read_chunk(self, digest: str) -> dict:
+        """The documents of a chunk, {doc id: document} with the values encoded as stored"""
+        with open(self._object_path(digest), 'rb') as handle:
+            return self._codec.loads(zlib.decompress(handle.read()))
+
+    def restore(self, snapshot_id: str, backend: str = None) -> dict:
+        """Replace the content of the database by a snapshot, and return the documents restored per table"""
+        manifest = self.load(snapshot_id)
+        db = database.get_database(backend)
+        batch = getattr(db.storage, 'batch', None)
+        with batch() if batch is not None else nullcontext():
+            # Nothing of the restore goes into the journal, afterwards the database is the snapshot itself
+            db.reset_changes(None)
+            for name in sorted(_data_tables(db) | set(manifest['tables'])):
+                table = database.open_table(name, backend)
+                table.truncate()
+                chunks = manifest['tables'].get(name, {})
+                insert_stored = getattr(table, 'insert_stored', None)
+                for number in sorted(chunks, key=int):
+                    documents = self.read_chunk(chunks[number][0])
+                    if insert_stored is not None:
+                        # SQLite stores the documents as JSON text, encoded the way the chunk holds them
+                        insert_stored([(int(doc_id), json.dumps(doc)) for doc_id, doc in documents.items()])
+                    else:
+                        table.insert_multiple([Document(decode_document(name, doc), int(doc_id))
+                                               for doc_id, doc in documents.items()])
+            db.reset_changes(snapshot_id)
+        _forget_model_caches()
+        logger.info("Snapshot %s restored", snapshot_id)
+        return manifest['documents']
+
+    def diff(self, old_id: str, new_id: str) -> dict:
+        """Ids of the documents added, removed and changed from one snapshot to the other, per table.
+
+        Returns {table: {'added': [...], 'removed': [...], 'changed': [...]}},
+        tables without differences are left out. Only chunks whose hashes
+        differ are read.
+        """
+        old, new = self.load(old_id), self.load(new_id)
+        # Chunks of different sizes can't be compared by their hashes, all of them are read then
+        same_chunks = old['chunk_ids'] == new['chunk_ids']
+        differences = {}
+        for name in sorted(set(old['tables']) | set(new['tables'])):
+            old_chunks, new_chunks = old['tables'].get(name, {}), new['tables'].get(name, {})
+            before = self._documents(chunk for number, chunk in old_chunks.items()
+                                     if not same_chunks or new_chunks.get(number) != chunk)
+            after = self._documents(chunk for number, chunk in new_chunks.items()
+                                    if not same_chunks or old_chunks.get(number) != chunk)
+            changes = {
+                'added': sorted(after.keys() - before.keys()),
+                'removed': sorted(before.keys() - after.keys()),
+                'changed': sorted(doc_id for doc_id in before.keys() & after.keys() if before[doc_id] != after[doc_id]),
+            }
+            if any(changes.values()):
+                differences[name] = changes
+        return differences
+
+    def _parent(self, snapshot_id: str):
+        # The snapshot the journal started after, if it is in this directory and was cut the same way
+        try:
+            manifest = self.load(snapshot_id)
+        except ValueError:
+            return None
+        return manifest if manifest['chunk_ids'] == CHUNK_IDS else None
+
+    def _store_chunk(self, table, number: int, stats: dict):
+        """Store one chunk of `table` unless it is stored already, and return [hash, documents] or None if it is empty"""
+        doc_ids = range(number * CHUNK_IDS, (number + 1) * CHUNK_IDS)
+        stats['chunks_read'] += 1
+        stored_documents = getattr(table, 'stored_documents', None)
+        if stored_documents is not None:
+            # SQLite keeps the documents as JSON text, the chunk is put together from it without decoding
+            rows = stored_documents(doc_ids)
+            count = len(rows)
+            content = '{' + ','.join(f'"{doc_id}":{doc}' for doc_id, doc in rows) + '}'
+        else:
+            documents = {str(doc_id): doc for doc_id, doc in table.documents(doc_ids)}
+            count = len(documents)
+            content = dump_json(documents, self._codec)
+        if not count:
+            return None
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            compressed = zlib.compress(content, COMPRESSION)
+            self._write_file(path, compressed)
+            stats['chunks_written'] += 1
+            stats['bytes_written'] += len(compressed)
+        return [digest, count]
+
+    def _documents(self, chunks) -> dict:
+        documents = {}
+        for digest, _ in chunks:
+            documents.update((int(doc_id), doc) for doc_id, doc in self.read_chunk(digest).items())
+        return documents
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _manifest_path(self, snapshot_id: str) -> str:
+        return os.path.join(self.directory, 'snapshots', f'{snapshot_id}.json')
+
+    @staticmethod
+    def _write_file(path: str, content: bytes) -> None:
+        # Written to a temporary file and renamed, so a crash never leaves half a chunk or manifest
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(content)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def _data_tables(db) -> set:
+    # The change journal and SQLite's own tables aren't part of a snapshot
+    return {name for name in db.tables() if name != CHANGES_TABLE and not name.startswith('sqlite_')}
+
+
+def _dirty_chunks(keys) -> dict:
+    """{table: numbers of the chunks with written documents, None if the table was truncated} of journal keys"""
+    dirty = {}
+    for key in keys:
+        name, _, doc_id = key.rpartition(':')
+        if doc_id == '*':
+            dirty[name] = None
+            continue
+        numbers = dirty.setdefault(name, set())
+        if numbers is not None:
+            numbers.add(int(doc_id) // CHUNK_IDS)
+    return dirty
+
+
+def _forget_model_caches():
+    # Written around the models, their in-memory indexes have to be built again. Imported
+    # here, taking a snapshot doesn't need the models
+    from devices import Device
+    from maintenance_events import MaintenanceEvent
+    from reservations import Reservation
+    Device.upcoming_maintenance.invalidate()
+    Reservation.index.invalidate()
+    MaintenanceEvent.index.invalidate()
+
+
+def _describe(manifest: dict) -> str:
+    kind = 'full' if manifest['parent'] is None else f"incremental after {manifest['parent']}, {manifest['changed']} changed"
+    return (f"{manifest['id']}  {sum(manifest['documents'].values())} documents, {kind}, "
+            f"{manifest['chunks_written']} chunks written ({manifest['bytes_written']} bytes)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=config.LOG_LEVEL)
+    arguments = sys.argv[1:]
+    store = SnapshotStore()
+    if arguments[:1] == ['create'] and arguments[1:] in ([], ['--full']):
+        print(_describe(store.create(full=arguments[1:] == ['--full'])))
+    elif arguments == ['list']:
+        for snapshot in store.snapshots():
+            print(_describe(snapshot))
+    elif len(arguments) == 2 and arguments[0] == 'restore':
+        for table_name, count in store.restore(arguments[1]).items():
+            print(f"{table_name}: {count} documents restored")
+    elif len(arguments) == 3 and arguments[0] == 'diff':
+        for table_name, changes in store.diff(arguments[1], arguments[2]).items():
+            print(f"{table_name}: " + ', '.join(f"{len(ids)} {kind} {ids[:10]}" for kind, ids in changes.items()))
+    else:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(2)
@@ -0,0 +1,432 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from tinydb.table import Document
+
+import metrics
+from concurrency import VERSION_FIELD, next_version
+from metrics import instrument
+from serializer import encode_value, decode_value
+from storage import CHANGES_TABLE, SNAPSHOT_KEY
+
+
+class SQLiteDatabase:
+    """A SQLite file holding one table per model, with each document stored as JSON.
+
+    The connection runs in WAL mode, so readers in other Streamlit sessions or
+    processes don't block the writer and every write is its own transaction
+    unless it happens inside `batch()`.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._tables = {}
+        # Counts the changes made through this connection, see `version()`
+        self.generation = 0
+        # Autocommit mode, transactions are opened explicitly in `batch()`
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('PRAGMA busy_timeout=5000')
+        # The change journal of the snapshots (see storage.CHANGES_TABLE), filled by triggers of the tables
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{CHANGES_TABLE}" (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def storage(self) -> 'SQLiteDatabase':
+        return self
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._lock
+
+    def version(self) -> tuple:
+        """A token that changes whenever the data changes, by this connection or by another one committing"""
+        return self.generation, self.execute('PRAGMA data_version')[0][0]
+
+    def external_version(self) -> int:
+        """A token that only changes when another connection (e.g. another process) committed a change"""
+        return self.execute('PRAGMA data_version')[0][0]
+
+    def mark_changed(self) -> None:
+        self.generation += 1
+
+    def table(self, name: str, indexes=()) -> 'SQLiteTable':
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(self, name, indexes)
+        return self._tables[name]
+
+    def tables(self) -> set:
+        rows = self.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {name for (name,) in rows}
+
+    def changes(self) -> tuple:
+        """(snapshot id, keys of the documents written since) of the change journal, (None, []) without one"""
+        journal = dict(self.execute(f'SELECT key, value FROM "{CHANGES_TABLE}"'))
+        if SNAPSHOT_KEY not in journal:
+            return None, []
+        return journal.pop(SNAPSHOT_KEY), list(journal)
+
+    def reset_changes(self, snapshot_id=None) -> None:
+        """Start an empty change journal after the snapshot `snapshot_id`, or stop recording changes with None"""
+        with self.batch():
+            self.execute(f'DELETE FROM "{CHANGES_TABLE}"')
+            if snapshot_id is not None:
+                self.execute(f'INSERT INTO "{CHANGES_TABLE}" (key, value) VALUES (?, ?)', (SNAPSHOT_KEY, snapshot_id))
+
+    def execute(self, sql: str, parameters=()) -> list:
+        """Run one statement and return all its rows, read under the lock as all threads share the connection"""
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def execute_insert(self, sql: str, parameters=()) -> int:
+        """Run an INSERT and return the id of the inserted row"""
+        with self._lock:
+            return self._connection.execute(sql, parameters).lastrowid
+
+    def executemany(self, sql: str, parameters) -> None:
+        with self._lock:
+            self._connection.executemany(sql, parameters)
+
+    def iterate(self, sql: str, parameters=(), size=1000):
+        """Yield the rows of a query, fetched `size` at a time. Holds the lock until the iteration ends or is closed"""
+        with self._lock:
+            cursor = self._connection.execute(sql, parameters)
+            try:
+                while True:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def batch(self):
+        """Run all writes inside the block as one transaction, rolled back if the block fails"""
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._depth = 0
+                self._connection.execute('ROLLBACK')
+                # Tables first opened inside the transaction were rolled back with it
+                for table in self._tables.values():
+                    table.create()
+                self.mark_changed()
+                raise
+            self._depth = 0
+            self._connection.execute('COMMIT')
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class SQLiteTable:
+    """Stores documents of one table and answers the same calls the models make on a TinyDB table.
+
+    Indexed fields get an expression index on `json_extract(doc, '$.<field>')`,
+    so `lookup`/`find` on them are index seeks instead of table scans. Triggers
+    note every written document in the change journal once a snapshot started
+    it, whoever writes the table.
+    """
+
+    def __init__(self, database: SQLiteDatabase, name: str, indexes=()):
+        self._database = database
+        self._name = name
+        self._indexed_fields = tuple(indexes)
+        self.create()
+
+    def create(self) -> None:
+        """Create the table with its indexes and triggers, if they don't exist yet"""
+        name = self._name
+        self._database.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" (doc_id INTEGER PRIMARY KEY AUTOINCREMENT, doc TEXT NOT NULL)')
+        for field in self._indexed_fields:
+            self._database.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}_{field}" ON "{name}" ({self._field_expression(field)})')
+        for event, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+            self._database.execute(
+                f'CREATE TRIGGER IF NOT EXISTS "{name}_journal_{event}" AFTER {event.upper()} ON "{name}" '
+                f'WHEN EXISTS (SELECT 1 FROM "{CHANGES_TABLE}" WHERE key = \'{SNAPSHOT_KEY}\') '
+                f'BEGIN INSERT OR IGNORE INTO "{CHANGES_TABLE}" (key) VALUES (\'{name}:\' || {row}.doc_id); END')
+
+    def __repr__(self):
+        return f'<SQLiteTable name={self._name!r}, total={len(self)}>'
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def storage(self) -> SQLiteDatabase:
+        return self._database
+
+    @property
+    def indexed_fields(self) -> tuple:
+        return self._indexed_fields
+
+    def lookup(self, field: str, value) -> list:
+        """Return the ids of all documents whose `field` equals `value`, lowest id first"""
+        if field not in self._indexed_fields:
+            raise KeyError(f"Field '{field}' is not indexed in table '{self._name}'")
+        rows = self._database.execute(
+            f'SELECT doc_id FROM "{self._name}" WHERE {self._field_expression(field)} IS ? ORDER BY doc_id',
+            (encode_value(value),))
+        return [doc_id for (doc_id,) in rows]
+
+    @instrument('find')
+    def find(self, field: str, value, limit=None) -> list:
+        """Return the documents whose `field` equals `value`"""
+        sql = f'SELECT doc_id, doc FROM "{self._name}" WHERE {self._field_expression(field)} IS ? ORDER BY doc_id'
+        parameters = (encode_value(value),)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters += (limit,)
+        rows = self._database.execute(sql, parameters)
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('find', self._name, len(rows))
+        return [self._to_document(row) for row in rows]
+
+    @instrument('find_page')
+    def find_page(self, equals=None, prefixes=None, offset=0, limit=None):
+        """Return one page of the documents matching all conditions, and the number of all matches.
+
+        `equals` maps fields to the value they must have, `prefixes` maps fields
+        to the text they must start with. Prefixes are turned into a range, so
+        they can use the field's index just like equality does.
+        """
+        clauses, parameters = [], []
+        for field, value in (equals or {}).items():
+            clauses.append(f'{self._field_expression(field)} IS ?')
+            parameters.append(encode_value(value))
+        for field, prefix in (prefixes or {}).items():
+            clauses.append(f'{self._field_expression(field)} >= ? AND {self._field_expression(field)} < ?')
+            parameters.extend((prefix, prefix + '\U0010ffff'))
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+
+        total = self._database.execute(f'SELECT COUNT(*) FROM "{self._name}"{where}', parameters)[0][0]
+        rows = self._database.execute(
+            f'SELECT doc_id, doc FROM "{self._name}"{where} ORDER BY doc_id LIMIT ? OFFSET ?',
+            parameters + [-1 if limit is None else limit, offset])
+        if metrics.registry.enabled:
+            # The matches SQLite counted, found through an index or by scanning the table
+            metrics.registry.add_rows('find_page', self._name, total)
+        return [self._to_document(row) for row in rows], total
+
+    def select(self, query, limit=None) -> list:
+        """Answer a query_planner.Select with one statement, reading only the projected fields"""
+        sql, parameters = self._select_sql(query, limit)
+        rows = self._database.execute(sql, parameters)
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('select', self._name, len(rows))
+        if query.fields is None:
+            return [self._to_document(row) for row in rows]
+        return [dict(zip(query.fields, decode_value(json.loads(values)))) for _, values in rows]
+
+    def explain_select(self, query) -> list:
+        """What SQLite plans to do for `select(query)`: table scans, index searches, sorting"""
+        sql, parameters = self._select_sql(query, query.row_limit)
+        rows = self._database.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)
+        return [detail for *_, detail in rows]
+
+    def _select_sql(self, query, limit) -> tuple:
+        clauses, parameters = [], []
+        for condition in query.conditions:
+            expression = self._field_expression(condition.field)
+            if condition.op == 'in':
+                clauses.append(f'({" OR ".join([f"{expression} IS ?"] * len(condition.value)) or "0"})')
+                parameters.extend(encode_value(value) for value in condition.value)
+            elif condition.op == 'prefix':
+                clauses.append(f'{expression} >= ? AND {expression} < ?')
+                parameters.extend((condition.value, condition.value + '\U0010ffff'))
+            elif condition.op in ('==', '!='):
+                clauses.append(f'{expression} {"IS" if condition.op == "==" else "IS NOT"} ?')
+                parameters.append(encode_value(condition.value))
+            else:
+                # NULL never compares, like a missing field in query_planner. Dates are stored as
+                # ISO text behind the same prefix, so they compare in the right order
+                clauses.append(f'{expression} {condition.op} ?')
+                parameters.append(encode_value(condition.value))
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+
+        if query.fields is None:
+            columns = 'doc_id, doc'
+        elif not query.fields:
+            columns = "doc_id, '[]'"
+        else:
+            # With several paths json_extract returns a JSON array of the values, which keeps true and
+            # false apart from 1 and 0. A single path is given twice to get an array as well
+            paths = [self._field_path(field) for field in query.fields]
+            columns = f"doc_id, json_extract(doc, {', '.join(paths * 2 if len(paths) == 1 else paths)})"
+        order = 'doc_id'
+        if query.order is not None:
+            field, descending = query.order
+            expression = self._field_expression(field)
+            # Documents without the field come last, in both directions
+            order = f'{expression} IS NULL, {expression}{" DESC" if descending else ""}, doc_id'
+        sql = f'SELECT {columns} FROM "{self._name}"{where} ORDER BY {order}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+        return sql, parameters
+
+    def get(self, doc_id=None, doc_ids=None):
+        if doc_id is not None:
+            rows = self._database.execute(f'SELECT doc_id, doc FROM "{self._name}" WHERE doc_id = ?', (doc_id,))
+            return self._to_document(rows[0]) if rows else None
+        if doc_ids is not None:
+            doc_ids = list(doc_ids)
+            placeholders = ', '.join('?' * len(doc_ids))
+            rows = self._database.execute(
+                f'SELECT doc_id, doc FROM "{self._name}" WHERE doc_id IN ({placeholders}) ORDER BY doc_id',
+                doc_ids)
+            return [self._to_document(row) for row in rows]
+        raise RuntimeError('You have to pass either doc_id or doc_ids')
+
+    @instrument('all')
+    def all(self) -> list:
+        documents = list(iter(self))
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('all', self._name, len(documents))
+        return documents
+
+    @instrument('search')
+    def search(self, cond) -> list:
+        """Evaluate a TinyDB query against every document, for queries that can't use an index"""
+        documents = list(iter(self))
+        if metrics.registry.enabled:
+            metrics.registry.add_rows('search', self._name, len(documents))
+        return [doc for doc in documents if cond(doc)]
+
+    @instrument('insert')
+    def insert(self, document) -> int:
+        if isinstance(document, Document):
+            doc_id = self._database.execute_insert(
+                f'INSERT INTO "{self._name}" (doc_id, doc) VALUES (?, ?)', (document.doc_id, self._dump(document)))
+        else:
+            doc_id = self._database.execute_insert(
+                f'INSERT INTO "{self._name}" (doc) VALUES (?)', (self._dump(document),))
+        self._database.mark_changed()
+        return doc_id
+
+    def insert_multiple(self, documents) -> list:
+        with self._database.batch():
+            return [self.insert(document) for document in documents]
+
+    @instrument('update')
+    def update(self, fields, cond=None, doc_ids=None) -> list:
+        """Merge `fields` into the matching documents, or into all documents if neither ids nor a query are given"""
+        with self._database.batch():
+            if doc_ids is not None:
+                documents = self.get(doc_ids=doc_ids)
+            elif cond is not None:
+                documents = self.search(cond)
+            else:
+                documents = self.all()
+            for document in documents:
+                document.update(fields)
+            self._database.executemany(
+                f'UPDATE "{self._name}" SET doc = ? WHERE doc_id = ?',
+                [(self._dump(document), document.doc_id) for document in documents])
+            self._database.mark_changed()
+        return [document.doc_id for document in documents]
+
+    def update_versioned(self, fields: dict, doc_id: int, version=None) -> int:
+        """Merge `fields` into the document if it still has the `version` it was loaded with, and return its new version.
+
+        Raises StaleVersionError if someone else changed or removed it in the
+        meantime. Without `version` the document is updated unconditionally.
+        """
+        with self._database.batch():
+            new_version = next_version(self._name, doc_id, self.get(doc_id=doc_id), version)
+            self.update({**fields, VERSION_FIELD: new_version}, doc_ids=[doc_id])
+        return new_version
+
+    @instrument('remove')
+    def remove(self, cond=None, doc_ids=None) -> list:
+        if doc_ids is None:
+            if cond is None:
+                raise RuntimeError('Use truncate() to remove all documents')
+            doc_ids = [document.doc_id for document in self.search(cond)]
+        doc_ids = list(doc_ids)
+        self._database.executemany(f'DELETE FROM "{self._name}" WHERE doc_id = ?', [(doc_id,) for doc_id in doc_ids])
+        self._database.mark_changed()
+        return doc_ids
+
+    def truncate(self) -> None:
+        self._database.execute(f'DELETE FROM "{self._name}"')
+        self._database.mark_changed()
+
+    def invalidate(self) -> None:
+        # Nothing is cached outside SQLite, a rolled back transaction leaves no trace
+        pass
+
+    def __len__(self):
+        return self._database.execute(f'SELECT COUNT(*) FROM "{self._name}"')[0][0]
+
+    def doc_ids(self) -> list:
+        """Ids of all documents, without reading any document"""
+        rows = self._database.execute(f'SELECT doc_id FROM "{self._name}" ORDER BY doc_id')
+        return [doc_id for (doc_id,) in rows]
+
+    def documents(self, doc_ids=None):
+        """Yield (doc_id, document) of the given ids, or of all documents, lowest id first"""
+        documents = iter(self) if doc_ids is None else self.get(doc_ids=doc_ids)
+        for document in documents:
+            yield document.doc_id, document
+
+    def __iter__(self):
+        # Fetched in chunks, so iterating a big table doesn't hold all rows in memory at once
+        for row in self._database.iterate(f'SELECT doc_id, doc FROM "{self._name}" ORDER BY doc_id'):
+            yield self._to_document(row)
+
+    def stored_documents(self, doc_ids: range) -> list:
+        """[(doc_id, JSON text)] of the documents in a range of ids, as stored and without decoding them"""
+        return self._database.execute(
+            f'SELECT doc_id, doc FROM "{self._name}" WHERE doc_id >= ? AND doc_id < ? ORDER BY doc_id',
+            (doc_ids.start, doc_ids.stop))
+
+    def insert_stored(self, rows) -> None:
+        """Insert [(doc_id, JSON text)] like `stored_documents` returns them, without encoding the documents again"""
+        self._database.executemany(f'INSERT INTO "{self._name}" (doc_id, doc) VALUES (?, ?)', rows)
+        self._database.mark_changed()
+
+    @staticmethod
+    def _field_path(field: str) -> str:
+        escaped = field.replace('"', '\\"').replace("'", "''")
+        return f"'$.\"{escaped}\"'"
+
+    @classmethod
+    def _field_expression(cls, field: str) -> str:
+        return f"json_extract(doc, {cls._field_path(field)})"
+
+    def _dump(self, document) -> str:
+        doc = json.dumps(encode_value(dict(document)))
+        if metrics.registry.enabled:
+            metrics.registry.add_bytes('write', self._name, written=len(doc))
+        return doc
+
+    def _to_document(self, row) -> Document:
+        doc_id, doc = row
+        if metrics.registry.enabled:
+            metrics.registry.add_bytes('read', self._name, read=len(doc))
+        return Document(decode_value(json.loads(doc)), doc_id)
@@ -0,0 +1,273 @@
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+from tinydb.middlewares import Middleware
+from tinydb.storages import Storage, touch
+
+import metrics
+from concurrency import FileLock, file_token
+from metrics import instrument
+
+# Table of the change journal, which documents were written since the last snapshot (see snapshots.py).
+# Keys are '<table>:<doc id>', or '<table>:*' for a truncated table, and SNAPSHOT_KEY names the snapshot.
+# Nothing is recorded until a snapshot started the journal
+CHANGES_TABLE = '_changes'
+SNAPSHOT_KEY = '@snapshot'
+
+
+class AtomicJSONStorage(Storage):
+    """JSON file storage that replaces the file atomically on every write.
+
+    The data is written to a temporary file next to the database which is then
+    renamed over it, so a crash mid-write leaves the old file intact instead of
+    a half-written one.
+    """
+
+    def __init__(self, path: str, create_dirs=False, encoding=None, access_mode='r+', **kwargs):
+        super().__init__()
+        self._path = path
+        self._encoding = encoding
+        self._mode = access_mode
+        self.kwargs = kwargs
+        if any(character in access_mode for character in ('+', 'w', 'a')):
+            touch(path, create_dirs=create_dirs)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def read(self):
+        content = self._read_file()
+        if not content:
+            # Empty file, TinyDB initializes the database itself
+            return None
+        return json.loads(content)
+
+    def write(self, data):
+        self._replace_file(json.dumps(data, **self.kwargs))
+
+    @instrument('file_read')
+    def _read_file(self, binary=False):
+        if binary:
+            with open(self._path, 'rb') as handle:
+                content = handle.read()
+        else:
+            with open(self._path, encoding=self._encoding) as handle:
+                content = handle.read()
+        if metrics.registry.enabled:
+            # Characters for text reads, close enough to bytes for the mostly ASCII JSON
+            metrics.registry.add_bytes('file_read', metrics.label_of(self), read=len(content))
+        return content
+
+    def _replace_file(self, content):
+        """Write `content` (str or bytes) to a temporary file and rename it over the database"""
+        temp_path = self._write_temp_file(content)
+        try:
+            os.replace(temp_path, self._path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @instrument('file_write')
+    def _write_temp_file(self, content) -> str:
+        """Write `content` to a new file next to the database, synced to disk, and return its path"""
+        if '+' not in self._mode and 'w' not in self._mode:
+            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+        try:
+            if isinstance(content, bytes):
+                handle = os.fdopen(fd, 'wb')
+            else:
+                handle = os.fdopen(fd, 'w', encoding=self._encoding)
+            with handle:
+                handle.write(content)
+                handle.flush()
+                os.fsync(handle.fileno())
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        if metrics.registry.enabled:
+            metrics.registry.add_bytes('file_write', metrics.label_of(self), written=len(content))
+        return temp_path
+
+
+class BatchMiddleware(Middleware):
+    """Keeps the database in memory between reads and groups the writes made inside `batch()` into a single write.
+
+    The file is only read again when it changed on disk, i.e. when another
+    process wrote it. Reads hold a shared and writes an exclusive file lock.
+    While a batch is open the exclusive lock is held, every read and write
+    works on the in-memory copy and the result is handed to the wrapped
+    storage once when the outermost batch ends. If the batch fails, nothing is
+    written.
+    """
+
+    def __init__(self, storage_cls):
+        super().__init__(storage_cls)
+        self._depth = 0
+        self._data = None
+        # File token (see concurrency.file_token) of the file `_data` was read from or written to
+        self._token = None
+        self._dirty = False
+        # Counts the changes made through this middleware, see `version()`
+        self.generation = 0
+        # Counts the times the data in memory was dropped because someone else changed it
+        self.reloads = 0
+        self.lock = FileLock()
+
+    def __call__(self, *args, **kwargs):
+        super().__call__(*args, **kwargs)
+        self.lock = FileLock(self._path())
+        return self
+
+    def version(self) -> tuple:
+        """A token that changes whenever the data changes, by our own writes or by anyone else writing the file"""
+        token = file_token(self._path())
+        if token is None:
+            return self.generation, None, None
+        return self.generation, token[1], token[2]
+
+    def external_version(self) -> int:
+        """A token that only changes when someone else (e.g. another process) changed the data"""
+        with self.lock.shared():
+            self._refresh()
+            return self.reloads
+
+    def read(self):
+        with self.lock.shared():
+            self._refresh()
+            if metrics.registry.enabled:
+                metrics.registry.cache('read', metrics.label_of(self), self._data is not None)
+            if self._data is None:
+                self._data = self.storage.read()
+                self._token = file_token(self._path())
+            return self._data
+
+    def write(self, data):
+        with self.lock.exclusive():
+            if self._depth:
+                self._data = data
+                self._dirty = True
+                return
+            self._write(data)
+
+    @contextmanager
+    def batch(self):
+        with self.lock.exclusive():
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if not self._depth:
+                    self._discard()
+                raise
+            self._depth -= 1
+            if not self._depth:
+                self.flush()
+
+    def flush(self):
+        with self.lock.exclusive():
+            if self._dirty:
+                self._dirty = False
+                self._write(self._data)
+
+    def _write(self, data):
+        try:
+            self.storage.write(data)
+        except BaseException:
+            # The data in memory may hold changes that never made it to disk
+            self._forget()
+            raise
+        self._data = data
+        self._token = file_token(self._path())
+        self.generation += 1
+
+    def _refresh(self):
+        # Drop the data in memory if the file was written by someone else since
+        if self._dirty or self._data is None:
+            return
+        if file_token(self._path()) != self._token:
+            self._data = None
+            self.reloads += 1
+
+    def _discard(self):
+        # Tables change the data in memory in place, so a write that failed half way may have left
+        # changes in it even if it never got to `write()`. Read everything again from disk
+        self._dirty = False
+        self._forget()
+        self.generation += 1
+
+    def _forget(self):
+        self._data = None
+        self._token = None
+        self.reloads += 1
+
+    def _path(self):
+        return getattr(self.storage, 'path', None) if self.storage is not None else None
+
+
+# [(callback, rollback)] of the write_batch blocks running in this thread, see `on_commit` and `on_rollback`
+_batches = threading.local()
+
+
+@contextmanager
+def write_batch(*tables):
+    """Group all writes to the given tables into one write of the database file.
+
+    All tables have to share the same `BatchMiddleware`. The block runs under
+    the exclusive file lock, so it also makes a read-modify-write atomic
+    against other processes. If the block raises, nothing is written and the
+    tables forget what they cached about the discarded changes. Storages
+    without batches (e.g. MemoryStorage) write every change right away.
+    """
+    batch = getattr(tables[0].storage, 'batch', None)
+    pending = getattr(_batches, 'pending', None)
+    outermost = pending is None
+    if outermost:
+        pending = _batches.pending = []
+    start = len(pending)
+    try:
+        with batch() if batch is not None else nullcontext():
+            yield
+    except BaseException:
+        for table in tables:
+            table.invalidate()
+        # The writes of this block count as not done, even if an outer block goes on
+        failed = pending[start:]
+        del pending[start:]
+        if outermost:
+            _batches.pending = None
+        for _, rollback in reversed(failed):
+            if rollback is not None:
+                rollback()
+        raise
+    if outermost:
+        _batches.pending = None
+        for callback, _ in pending:
+            if callback is not None:
+                callback()
+
+
+def on_commit(callback) -> None:
+    """Call `callback` once the outermost `write_batch` of this thread has written everything, right away outside of one.
+
+    For caches in memory that must only see the changes once they are written.
+    """
+    pending = getattr(_batches, 'pending', None)
+    if pending is None:
+        callback()
+    else:
+        pending.append((callback, None))
+
+
+def on_rollback(rollback) -> None:
+    """Call `rollback` if the `write_batch` blocks this thread is in fail, to undo changes of objects in memory"""
+    pending = getattr(_batches, 'pending', None)
+    if pending is not None:
+        pending.append((None, rollback))
@@ -1,43 +1,91 @@
-import os
-from tinydb import TinyDB, Query
+import logging
+
+from database import LazyTable, cached_all
+from metrics import instrument
+from storage import on_rollback, write_batch
+from concurrency import VERSION_FIELD
+import async_api
+
+logger = logging.getLogger(__name__)
 
 
 class User:
+    # Fixed attributes instead of a per-instance __dict__
+    __slots__ = ('id', 'name', 'version')
+
     # Class variable that is shared between all instances of the class
-    db_connector = TinyDB(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.json')).table('users')
+    db_connector = LazyTable('users')
+    # Writes of the async methods, stored together when they arrive at the same time
+    async_writes = async_api.WriteCoalescer(lambda writes: User.run_batch(writes))
     
     def __init__(self, id, name) -> None:
         """Create a new user based on the given name and id"""
         self.name = name
         self.id = id
+        # Version of the stored document this object was loaded from, None if it wasn't loaded
+        self.version = None
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'id': self.id}
 
+    @instrument('User.store_data')
     def store_data(self) -> None:
-        """Save the user to the database"""
-        print("Storing user data...")
-        # Check if the user already exists in the database
-        UserQuery = Query()
-        result = User.db_connector.search(UserQuery.id == self.id)
-        if result:
-            # Update the existing record with the current instance's data
-            result = self.db_connector.update(self.__dict__, doc_ids=[result[0].doc_id])
-            print("User data updated.")
-        else:
-            # If the user doesn't exist, insert a new record
-            self.db_connector.insert(self.__dict__)
-            print("User data inserted.")
+        """Save the user to the database. Raises StaleVersionError if it was loaded and someone else changed it since"""
+        logger.debug("Storing user %s", self.id)
+        # Lookup and write as one step, so no other process writes in between
+        with write_batch(self.db_connector):
+            # The version only counts once the outermost batch is written, it is put back if that fails
+            version = self.version
+            on_rollback(lambda: setattr(self, 'version', version))
+            # Check if the user already exists in the database
+            doc_ids = User.db_connector.lookup('id', self.id)
+            if doc_ids:
+                # Update the existing record with the current instance's data
+                self.version = self.db_connector.update_versioned(self.to_dict(), doc_ids[0], self.version)
+                logger.debug("User %s updated", self.id)
+            else:
+                # If the user doesn't exist, insert a new record
+                self.db_connector.insert({**self.to_dict(), VERSION_FIELD: 1})
+                self.version = 1
+                logger.debug("User %s inserted", self.id)
+
+    @classmethod
+    @instrument('User.store_many')
+    def store_many(cls, users) -> None:
+        """Save all given users with a single write of the database file"""
+        cls.run_batch([user.store_data for user in users])
+
+    @classmethod
+    def run_batch(cls, writes) -> list:
+        """Call all `writes` (store_data/delete of users) as one write batch and return their results"""
+        with write_batch(cls.db_connector):
+            return [write() for write in writes]
+
+    async def astore_data(self) -> None:
+        """Like store_data, without blocking the event loop"""
+        await self.async_writes.submit(self.store_data)
+
+    async def adelete(self) -> None:
+        """Like delete, without blocking the event loop"""
+        await self.async_writes.submit(self.delete)
+
+    @classmethod
+    async def astore_many(cls, users) -> None:
+        """Like store_many, without blocking the event loop"""
+        await cls.async_writes.submit_many([user.store_data for user in users])
 
+    @instrument('User.delete')
     def delete(self) -> None:
         """Delete the user from the database"""
-        print("Deleting user data...")
+        logger.debug("Deleting user %s", self.id)
         # Check if the user exists in the database
-        UserQuery = Query()
-        result = self.db_connector.search(UserQuery.id == self.id)
-        if result:
+        doc_ids = self.db_connector.lookup('id', self.id)
+        if doc_ids:
             # Delete the record from the database
-            self.db_connector.remove(doc_ids=[result[0].doc_id])
-            print("User data deleted.")
+            self.db_connector.remove(doc_ids=[doc_ids[0]])
+            logger.debug("User %s deleted", self.id)
         else:
-            print("User data not found.")
+            logger.warning("User %s not found, nothing deleted", self.id)
     
     def __str__(self):
         return f"User {self.id} - {self.name}"
@@ -46,14 +94,52 @@ class User:
         return self.__str__()
     
     @classmethod
+    def _from_document(cls, data):
+        user = cls(data['id'], data['name'])
+        user.version = data.get(VERSION_FIELD, 0)
+        return user
+
+    @classmethod
+    @instrument('User.find_all')
     def find_all(cls) -> list:
         """Find all users in the database"""
         users = []
-        for user_data in cls.db_connector.all():
-            users.append(cls(user_data['id'], user_data['name']))
+        for user_data in cached_all(cls.db_connector):
+            users.append(cls._from_document(user_data))
         return users
 
     @classmethod
+    def iter_all(cls):
+        """Iterate over all users in the database, creating each User only when it is reached"""
+        for user_data in cls.db_connector:
+            yield cls._from_document(user_data)
+
+    @classmethod
+    @instrument('User.find_page')
+    def find_page(cls, offset=0, limit=50, name_prefix=None):
+        """Find the users of one page, optionally only those whose name starts with `name_prefix`, and the number of all matches"""
+        prefixes = {'name': name_prefix} if name_prefix else {}
+        documents, total = cls.db_connector.find_page(prefixes=prefixes, offset=offset, limit=limit)
+        return [cls._from_document(user_data) for user_data in documents], total
+
+    @classmethod
+    @instrument('User.find_by_attribute')
     def find_by_attribute(cls, by_attribute: str, attribute_value: str, num_to_return=1):
         """From the matches in the database, select the user with the given attribute value"""
-        pass
+        result = cls.db_connector.find(by_attribute, attribute_value, limit=num_to_return)
+        if result:
+            users = [cls._from_document(user_data) for user_data in result]
+            return users if num_to_return > 1 else users[0]
+        return None
+
+    @classmethod
+    async def afind_by_attribute(cls, by_attribute: str, attribute_value: str, num_to_return=1):
+        return await async_api.run(cls.find_by_attribute, by_attribute, attribute_value, num_to_return)
+
+    @classmethod
+    async def afind_page(cls, offset=0, limit=50, name_prefix=None):
+        return await async_api.run(cls.find_page, offset, limit, name_prefix)
+
+    @classmethod
+    async def afind_all(cls) -> list:
+        return await async_api.run(cls.find_all)
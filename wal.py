@@ -0,0 +1,308 @@
+"""Snapshot plus append-only log storage for TinyDB.
+
+database.json stays the snapshot. Every insert, update and remove made
+through an `IndexedTable` is appended to `<path>.log` as one line holding the
+changed document, instead of rewriting the whole file, so the cost of a single
+write doesn't depend on the size of the database. On open, the log is replayed
+over the snapshot. Once the log grows past `config.LOG_COMPACT_BYTES` (and past
+the size of the snapshot, so the rewrites stay rare as the database grows) the
+data is written as a new snapshot in a background thread and the log starts
+over.
+
+Log lines are `{"table": ..., "id": ..., "doc": {...}}`, with `"doc": null` for
+a removed document, or `{"table": ..., "truncate": true}`. Each one sets the
+final state of a document, so replaying a log over a snapshot that already
+contains it gives the same data again.
+
+Several processes can share the files: appends hold the exclusive file lock,
+and a process that finds the log grown by someone else only replays the new
+lines. During a compaction the old log is renamed to `<path>.log.compacting`
+and kept locked by the compacting process until the new snapshot is in place,
+so readers replay it in the meantime and an abandoned one (the process died)
+is recognized by not being locked.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import config
+import metrics
+from concurrency import FileLock, file_token, try_lock
+from metrics import instrument
+from serializer import SchemaJSONStorage, decode_document
+
+
+class LogStorage(SchemaJSONStorage):
+    """TinyDB storage keeping the data in memory and persisting changed records to an append-only log.
+
+    Tables call `log_records`/`log_truncate` after changing the data returned
+    by `read()` in place. A full `write()` (tables dropped, or written by
+    another table class) is stored as a new snapshot right away.
+    """
+
+    def __init__(self, path: str, compact_bytes: int = None, **kwargs):
+        super().__init__(path, **kwargs)
+        self._log_path = path + '.log'
+        # The log being compacted, renamed out of the way until the new snapshot is written
+        self._compacting_path = path + '.log.compacting'
+        self._compact_bytes = compact_bytes or config.LOG_COMPACT_BYTES
+        self.lock = FileLock(path)
+        self._data = None
+        # (snapshot token, log inode, log size) the data in memory corresponds to
+        self._state = None
+        self._log = None
+        self._snapshot_size = 0
+        self._depth = 0
+        self._pending = []
+        self._compactor = None
+        # Counts the changes made through this storage, see `version()`
+        self.generation = 0
+        # Counts the times changes of someone else were read, see `external_version()`
+        self.reloads = 0
+
+    @property
+    def log_path(self) -> str:
+        return self._log_path
+
+    def version(self) -> tuple:
+        """A token that changes whenever the data changes, by our own writes or by anyone else writing the files"""
+        return (self.generation,) + self._file_state()
+
+    def external_version(self) -> int:
+        """A token that only changes when someone else (e.g. another process) changed the data"""
+        with self.lock.shared():
+            self._refresh()
+            return self.reloads
+
+    def read(self):
+        with self.lock.shared():
+            if metrics.registry.enabled:
+                reloads, loaded = self.reloads, self._data is not None
+                self._refresh()
+                metrics.registry.cache('read', metrics.label_of(self), loaded and self.reloads == reloads)
+            else:
+                self._refresh()
+            # The live data, tables change it in place and log what they changed
+            return self._data
+
+    def write(self, data):
+        with self.lock.exclusive():
+            self._data = data
+            self._pending = []
+            self._write_snapshot()
+            self.generation += 1
+
+    def log_records(self, table_name: str, changes) -> None:
+        """Persist the current state of changed documents, `changes` are (doc_id, document or None if removed)"""
+        self._append([
+            self._encode_line({'table': table_name, 'id': str(doc_id), 'doc': doc})
+            for doc_id, doc in changes
+        ])
+
+    def log_truncate(self, table_name: str) -> None:
+        self._append([self._encode_line({'table': table_name, 'truncate': True})])
+
+    @contextmanager
+    def batch(self):
+        """Append all changes made inside the block at once, with a single fsync. If it fails, nothing is written"""
+        with self.lock.exclusive():
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if not self._depth:
+                    self._discard()
+                raise
+            self._depth -= 1
+            if not self._depth:
+                self.flush()
+
+    def flush(self) -> None:
+        with self.lock.exclusive():
+            lines, self._pending = self._pending, []
+            if lines:
+                self._write_log(lines)
+
+    def compact(self, wait=True) -> None:
+        """Write the data as a new snapshot and start an empty log, in the background unless `wait` is set"""
+        with self.lock.exclusive():
+            self._refresh()
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            if os.path.exists(self._compacting_path):
+                # Another process is compacting right now
+                return
+            # Encode in memory while holding the lock, so the snapshot matches the
+            # rotated log exactly. The slow part, writing it out, runs in the thread
+            content = self.dumps(self._data)
+            self._close_log()
+            marker = open(self._log_path, 'ab')
+            try_lock(marker)
+            os.replace(self._log_path, self._compacting_path)
+            self._state = self._file_state()
+            self._compactor = threading.Thread(
+                target=self._finish_compaction, args=(content, marker, self._state[0]),
+                name='database-compaction', daemon=True)
+            self._compactor.start()
+        if wait:
+            self._join_compactor()
+
+    def close(self) -> None:
+        self.flush()
+        self._join_compactor()
+        with self.lock.exclusive():
+            self._close_log()
+
+    def _refresh(self):
+        """Catch up with the changes other processes made to the files"""
+        # Changes of a batch that aren't written yet would be lost by reloading. Nobody else
+        # can have written meanwhile anyway, the batch holds the exclusive lock
+        if self._data is not None and (self._pending or self._file_state() == self._state):
+            return
+        with self.lock.exclusive():
+            if self._data is None:
+                self._data = self._load()
+                return
+            state = self._file_state()
+            if state == self._state:
+                return
+            snapshot, log_inode, log_size = self._state
+            if state[0] == snapshot and log_inode in (None, state[1]) and state[2] >= log_size:
+                # Only appended to (or a log started after our compaction), replay the new lines
+                self._replay(self._data, self._log_path, start=log_size)
+                self._state = self._file_state()
+            else:
+                self._data = self._load()
+            self.reloads += 1
+
+    def _load(self):
+        data = super().read() or {}
+        self._snapshot_size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        if os.path.exists(self._compacting_path):
+            self._replay(data, self._compacting_path)
+            self._replay(data, self._log_path)
+            self._data = data
+            if self._writable() and self._compaction_abandoned():
+                # The process compacting died, fold both logs into a new snapshot now
+                self._write_snapshot()
+        else:
+            self._replay(data, self._log_path)
+        self._state = self._file_state()
+        return data
+
+    @instrument('log_replay')
+    def _replay(self, data, path, start=0):
+        try:
+            with open(path, 'rb') as handle:
+                handle.seek(start)
+                content = handle.read()
+        except FileNotFoundError:
+            return
+        if metrics.registry.enabled:
+            metrics.registry.add_bytes('log_replay', metrics.label_of(self), read=len(content))
+        valid_end = 0
+        for line in content.splitlines(keepends=True):
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('incomplete line')
+                record = self.loads(line)
+            except ValueError:
+                # A write cut short by a crash, everything before it was complete
+                break
+            table = data.setdefault(record['table'], {})
+            if record.get('truncate'):
+                table.clear()
+            elif record['doc'] is None:
+                table.pop(record['id'], None)
+            else:
+                table[record['id']] = decode_document(record['table'], record['doc'])
+            valid_end += len(line)
+        if valid_end < len(content) and self._writable():
+            with self.lock.exclusive(), open(path, 'r+b') as handle:
+                handle.truncate(start + valid_end)
+
+    def _append(self, lines):
+        with self.lock.exclusive():
+            self.generation += 1
+            if self._depth:
+                self._pending.extend(lines)
+                return
+            self._write_log(lines)
+
+    @instrument('log_append')
+    def _write_log(self, lines):
+        if not self._writable():
+            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+        if self._log is None:
+            self._log = open(self._log_path, 'ab')
+        content = b''.join(lines)
+        self._log.write(content)
+        self._log.flush()
+        if metrics.registry.enabled:
+            metrics.registry.add_bytes('log_append', metrics.label_of(self), written=len(content))
+        os.fsync(self._log.fileno())
+        self._state = self._file_state()
+        if self._state[2] > max(self._compact_bytes, self._snapshot_size):
+            self.compact(wait=False)
+
+    def _write_snapshot(self):
+        content = self.dumps(self._data)
+        self._replace_file(content)
+        self._snapshot_size = len(content)
+        self._close_log()
+        for path in (self._log_path, self._compacting_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._state = self._file_state()
+
+    def _finish_compaction(self, content, marker, snapshot_token):
+        try:
+            temp_path = self._write_temp_file(content)
+            with self.lock.exclusive():
+                if file_token(self._path) != snapshot_token:
+                    # Replaced by a full write in the meantime, which holds everything already
+                    os.remove(temp_path)
+                    return
+                os.replace(temp_path, self._path)
+                os.remove(self._compacting_path)
+                self._snapshot_size = len(content)
+                if self._state is not None:
+                    # The log is still the one this process caught up with
+                    self._state = (file_token(self._path),) + self._state[1:]
+        finally:
+            marker.close()
+
+    def _compaction_abandoned(self) -> bool:
+        with open(self._compacting_path, 'rb') as handle:
+            return try_lock(handle)
+
+    def _join_compactor(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def _discard(self):
+        # The tables changed the in-memory data already, read it again from disk
+        self._pending = []
+        self._data = None
+        self.reloads += 1
+        self.generation += 1
+
+    def _file_state(self) -> tuple:
+        log = file_token(self._log_path)
+        return file_token(self._path), log and log[0], log[2] if log else 0
+
+    def _close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _encode_line(self, record) -> bytes:
+        line = self.dumps(record)
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        return line + b'\n'
+
+    def _writable(self) -> bool:
+        return '+' in self._mode or 'w' in self._mode